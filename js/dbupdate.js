@@ -16,24 +16,157 @@ if(!navigator.onLine) {
   self.setProgress(1);
   self.close();
 }
-var dbPromise = matruspDB.metadata.get('ETag').then(async (etag) => {
-  // Fetch DB from the server. Send ETag to avoid downloading exactly the same DB again.
-  var response = await fetch('../db/db.json', {method: 'GET', headers: {'If-None-Match': etag || ''}});
-  if(!response.ok) {
-    // End worker if server returns 304 not modified
-    if(response.status == 304) {
-      return;
+// ETag of the last full db.json download, kept under a key of its own URL so that it is never sent with another file
+var ETAG_DB = 'ETag ../db/db.json';
+
+// Incremental update of the lectures. db/versoes/versao.json describes the current version of the DB, its full
+// snapshot and the patches from previous versions (see py/versoes.py). A client a few versions behind downloads and
+// applies a single patch; otherwise the snapshot is downloaded, in the compact format (see py/compacto.py) when
+// versao.json lists one. Servers without versoes/ use the full db.json.
+var dbPromise = matruspDB.metadata.get('db-version').then(async (localVersion) => {
+  try {
+    var response = await fetch('../db/versoes/versao.json', {cache: 'no-cache'});
+    if(!response.ok) throw new Error(`Server returned code ${response.status} for DB version request`);
+    var version = await response.json();
+  }
+  catch(e) {
+    return updateLecturesFull();
+  }
+
+  if(localVersion === version.versao) return;
+
+  if(localVersion && version.patches[localVersion]) {
+    try {
+      return await applyPatch(await fetchJSON('../db/versoes/' + version.patches[localVersion]), version.busca);
+    }
+    catch(e) {
+      console.error(e); // Fall back to the snapshot
     }
-    else throw new Error(`Server returned code ${response.status} for DB request`); //Throw error for any unknown error
   }
 
-  // Update the indexedDB and put new etag when done
+  var [lectures, index] = await Promise.all([fetchJSON('../db/versoes/' + (version.compacto || version.snapshot)), fetchIndex(version.busca && '../db/versoes/' + version.busca)]);
+  if(version.compacto) lectures = decodeCompact(lectures);
   self.addProgress(0.1);
-  await Promise.all([matruspDB.trigrams.clear(),matruspDB.lectures.clear()]);
-  await loadLectures (await response.json()); 
-  await matruspDB.metadata.put(response.headers.get("ETag"),"ETag");
+  await Promise.all([matruspDB.trigrams.clear(),matruspDB.lectures.clear(),matruspDB.metadata.delete(ETAG_DB)]);
+  await loadLectures(lectures, index);
+  await matruspDB.metadata.put(version.versao,"db-version");
+}).catch(e => {
+  console.error(e);
+  return updateLecturesFull();
 });
 
+// Full update from db.json, using its ETag
+function updateLecturesFull() {
+  return matruspDB.metadata.get(ETAG_DB).then(async (etag) => {
+    // Fetch DB from the server. Send ETag to avoid downloading exactly the same DB again.
+    var response = await fetch('../db/db.json', {method: 'GET', headers: {'If-None-Match': etag || ''}});
+    if(!response.ok) {
+      // End worker if server returns 304 not modified
+      if(response.status == 304) {
+        return;
+      }
+      else throw new Error(`Server returned code ${response.status} for DB request`); //Throw error for any unknown error
+    }
+
+    // Update the indexedDB and put new etag when done
+    var [lectures, index] = await Promise.all([response.json(), fetchIndex('../db/busca.json')]);
+    self.addProgress(0.1);
+    await Promise.all([matruspDB.trigrams.clear(),matruspDB.lectures.clear(),matruspDB.metadata.delete('db-version')]);
+    await loadLectures (lectures, index);
+    await matruspDB.metadata.put(response.headers.get("ETag"),ETAG_DB);
+  });
+}
+
+async function fetchJSON(url) {
+  var response = await fetch(url);
+  if(!response.ok) throw new Error(`Server returned code ${response.status} for ${url}`);
+  return response.json();
+}
+
+// Search index precomputed by the crawler (py/indice_busca.py), or null to build it from the lectures
+function fetchIndex(url) {
+  if(!url) return Promise.resolve(null);
+  return fetchJSON(url).catch(e => {
+    console.error(e);
+    return null;
+  });
+}
+
+// Rebuilds the list of lectures of db.json from the compact format of py/compacto.py: string table, and one table
+// of columns per kind of object, whose rows are read in order
+function decodeCompact(data) {
+  if(data.formato != 'matrusp-compacto' || data.versao != 1) throw new Error(`Unknown DB format ${data.formato} ${data.versao}`);
+  var readers = {};
+  for(var name in data.tabelas) {
+    var table = data.tabelas[name], references = new Set(table.referencias), columns = {};
+    for(var field in table.colunas) {
+      var values = table.colunas[field];
+      columns[field] = {values: references.has(field) ? values.map(v => typeof v === 'number' ? data.textos[v] : v) : values, next: 0};
+    }
+    readers[name] = {columns: columns, shapes: table.formas, shape: table.forma && {values: table.forma, next: 0}, children: table.filhos || {}};
+  }
+  var next = column => column.values[column.next++];
+
+  function read(name) {
+    var reader = readers[name];
+    if(!reader.shapes) return next(reader.columns['@valor']);
+    var shape = reader.shape ? next(reader.shape) : 0;
+    if(shape === null) return null;
+    var object = {};
+    reader.shapes[shape].forEach(field => {
+      var value = next(reader.columns[field]), child = reader.children[field];
+      if(child && value !== null) {
+        var count = value;
+        if(child[0] == 'lista') {
+          value = [];
+          for(var i = 0; i < count; i++) value.push(read(child[1]));
+        }
+        else {
+          value = {};
+          for(var i = 0; i < count; i++) {
+            var key = next(readers[child[1]].columns['@chave']);
+            value[key] = read(child[1]);
+          }
+        }
+      }
+      object[field] = value;
+    });
+    return object;
+  }
+
+  var lectures = [];
+  for(var i = 0; i < data.tabelas.materias.linhas; i++) lectures.push(read('materias'));
+  return lectures;
+}
+
+// Applies a patch from py/versoes.py: only added, changed and removed lectures are written. Trigrams and units
+// only depend on codigo, nome, unidade and departamento, so they are only updated if one of those changed, from the
+// precomputed index of the new version if there is one.
+async function applyPatch(patch, indexFile) {
+  self.addProgress(0.1);
+  var lectures = patch.adicionadas.concat(patch.alteradas);
+  addTimeframes(lectures);
+
+  var oldLectures = await matruspDB.lectures.bulkGet(patch.alteradas.map(lecture => lecture.codigo));
+  var reindex = patch.adicionadas.length || patch.removidas.length || patch.alteradas.some((lecture, i) =>
+    !oldLectures[i] || lecture.nome != oldLectures[i].nome || lecture.unidade != oldLectures[i].unidade ||
+    lecture.departamento != oldLectures[i].departamento);
+
+  await matruspDB.transaction('rw', matruspDB.lectures, async () => {
+    await matruspDB.lectures.bulkDelete(patch.removidas);
+    await matruspDB.lectures.bulkPut(lectures);
+  });
+  self.addProgress(0.3);
+
+  if(reindex) {
+    var index = await fetchIndex(indexFile && '../db/versoes/' + indexFile);
+    await Promise.all([matruspDB.trigrams.clear(),matruspDB.units.clear()]);
+    await (index ? putIndexes(index) : buildIndexes(await matruspDB.lectures.toArray()));
+  }
+  // The version is only updated at the end: an interrupted patch is applied again on the next update
+  await matruspDB.metadata.put(patch.para,"db-version");
+}
+
 var coursesPromise = matruspDB.metadata.get('ETag-courses').then(async (etag) => {
   var response = await fetch('../db/cursos.json', {method: 'GET', headers: {'If-None-Match': etag || ''}});
   if(!response.ok) {
@@ -78,25 +211,32 @@ Promise.all([dbPromise,coursesPromise,campiPromise]).then(() => {
   self.close(); 
 });
 
-function loadLectures (lectures) {
+// Puts the lectures in the DB with their timeframes, trigrams and units. These come from the precomputed index if
+// there is one, and are computed here otherwise.
+function loadLectures (lectures, index) {
   self.addProgress(0.1);
-  var trigrams = { length: 0 }; // Trigram list with property length used in weighting
-
-  // Adds a trigram from a lecture to the list
-  function addToTrigramList(trigram, lecture) {
-    if (!trigrams[trigram]) {
-      trigrams[trigram] = {
-        length: 0
-      };
-    }
-    if (!trigrams[trigram][lecture.codigo]) {
-      trigrams[trigram][lecture.codigo] = 0;
-    }
-    trigrams[trigram][lecture.codigo]++;
-    trigrams[trigram].length++;
-    trigrams.length++;
+  if(index) {
+    lectures.forEach(lecture => {
+      if(index.periodos.hasOwnProperty(lecture.codigo)) lecture.periodos = index.periodos[lecture.codigo];
+    });
   }
+  else addTimeframes(lectures);
+
+  var lecturesPromise = matruspDB.lectures.bulkPut(lectures).then(() => self.addProgress(0.2)); // Put lectures in DB.
+
+  return Promise.all([lecturesPromise,index ? putIndexes(index) : buildIndexes(lectures)]); //Await all indexedDB promises
+}
 
+// Puts a precomputed index (py/indice_busca.py) in the DB
+function putIndexes(index) {
+  self.addProgress(0.2);
+  var trigramsPromise = matruspDB.trigrams.bulkPut(Object.values(index.trigramas), Object.keys(index.trigramas)).then(() => self.addProgress(0.2));
+  var unitsPromise = matruspDB.units.bulkPut(Object.values(index.unidades), Object.keys(index.unidades));
+  return Promise.all([trigramsPromise,unitsPromise]);
+}
+
+// Sets lecture.periodos (matutino, vespertino, noturno) from the schedules of each lecture
+function addTimeframes(lectures) {
   //Iterate each schedule of each lecture to obtain lecture's timeframes
   lectures.forEach(lecture => {
     var timeframes = new Set();
@@ -124,8 +264,26 @@ function loadLectures (lectures) {
     });
     lecture.periodos = [...timeframes];
   });
+}
 
-  var lecturesPromise = matruspDB.lectures.bulkPut(lectures).then(() => self.addProgress(0.2)); // Put lectures in DB.
+// Builds the trigram and unit indexes from the complete list of lectures
+function buildIndexes(lectures) {
+  var trigrams = { length: 0 }; // Trigram list with property length used in weighting
+
+  // Adds a trigram from a lecture to the list
+  function addToTrigramList(trigram, lecture) {
+    if (!trigrams[trigram]) {
+      trigrams[trigram] = {
+        length: 0
+      };
+    }
+    if (!trigrams[trigram][lecture.codigo]) {
+      trigrams[trigram][lecture.codigo] = 0;
+    }
+    trigrams[trigram][lecture.codigo]++;
+    trigrams[trigram].length++;
+    trigrams.length++;
+  }
 
   var units = {};
 
@@ -157,5 +315,5 @@ function loadLectures (lectures) {
   delete trigrams.length;
   var trigramsPromise = matruspDB.trigrams.bulkPut(Object.values(trigrams), Object.keys(trigrams)).then(() => self.addProgress(0.2));
 
-  return Promise.all([lecturesPromise,trigramsPromise,unitsPromise]); //Await all indexedDB promises
+  return Promise.all([trigramsPromise,unitsPromise]);
 }
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Camada de backends de análise de HTML usada pelos parsers do JupiterWeb.
+#
+# Os parsers (parsear_turmas, parsear_horario, parsear_vagas, parsear_info_turma, parsear_info_materia e
+# parsear_periodos) só precisam das tabelas-folha da página (tabelas sem tabelas dentro), de suas linhas e
+# das strings de cada célula. Cada backend converte a página nessa representação mínima, de forma que os
+# parsers rodam iguais sobre html5lib, lxml ou selectolax.
+#
+# Backends disponíveis, do mais rápido ao mais lento:
+#   selectolax - lexbor (C), opcional
+#   lxml       - libxml2 (C), opcional
+#   html5lib   - Python puro, via BeautifulSoup; sempre disponível e usado como alternativa
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Pattern, Tuple, Union
+
+from bs4 import BeautifulSoup
+
+try:
+        import lxml.html
+except ImportError:
+        lxml = None
+
+try:
+        from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:
+        SelectolaxParser = None
+
+Html = Union[str, bytes]
+
+class Linha:
+        __slots__ = ('celulas', 'textos')
+
+        # celulas: strings (sem espaços nas pontas, como em stripped_strings) de cada <td> da linha
+        # textos: todas as strings da linha, inclusive de células <th>
+        def __init__(self, celulas: List[List[str]], textos: List[str]):
+                self.celulas = celulas
+                self.textos = textos
+
+        # Texto completo de cada célula, como "".join(td.stripped_strings)
+        def textos_celulas(self) -> List[str]:
+                return ["".join(c) for c in self.celulas]
+
+        # Primeira string de cada célula, como map(lambda x: next(x.stripped_strings), tds).
+        # Assim como no map original, a lista termina na primeira célula vazia.
+        def primeiras_strings(self) -> List[str]:
+                strings = []
+                for c in self.celulas:
+                        if not c:
+                                break
+                        strings.append(c[0])
+                return strings
+
+class Tabela:
+        __slots__ = ('linhas', 'textos')
+
+        def __init__(self, linhas: List[Linha], textos: List[str]):
+                self.linhas = linhas
+                self.textos = textos
+
+        # Equivalente a tabela.find(text=padrao): strings iguais a padrao, ou em que a regex padrao é encontrada
+        def contem(self, padrao: Union[str, Pattern]) -> bool:
+                if isinstance(padrao, str):
+                        return padrao in self.textos
+                return any(padrao.search(t) for t in self.textos)
+
+class Documento:
+        def __init__(self, tabelas_folha: Callable[[], List[Tabela]], texto: Callable[[], str],
+                     links: Callable[[], List[Tuple[str, str]]], links_com_linha: Callable[[], List[Tuple[str, List[List[str]]]]]):
+                self._tabelas_folha = tabelas_folha
+                self._texto = texto
+                self._links = links
+                self._links_com_linha = links_com_linha
+
+        def tabelas_folha(self) -> List[Tabela]:
+                return self._tabelas_folha()
+
+        # Texto completo do documento, como soup.get_text()
+        def texto(self) -> str:
+                return self._texto()
+
+        # Lista de (href, texto) dos links cujo href contém padrao
+        def links(self, padrao: Union[str, Pattern]) -> List[Tuple[str, str]]:
+                padrao = re.compile(padrao) if isinstance(padrao, str) else padrao
+                return [(href, texto) for href, texto in self._links() if padrao.search(href)]
+
+        # Lista de (href, células) dos links cujo href contém padrao, com as strings de cada <td> da linha (<tr>) em
+        # que o link está, como em Linha.celulas (sem linha, a lista de células é vazia)
+        def links_com_linha(self, padrao: Union[str, Pattern]) -> List[Tuple[str, List[List[str]]]]:
+                padrao = re.compile(padrao) if isinstance(padrao, str) else padrao
+                return [(href, celulas) for href, celulas in self._links_com_linha() if padrao.search(href)]
+
+def _strings(textos: Iterable[str]) -> List[str]:
+        return [t for t in (t.strip() for t in textos) if t]
+
+# ---------------------------------------------------------------------------
+# BeautifulSoup (html5lib, ou qualquer outro tree builder do bs4)
+# ---------------------------------------------------------------------------
+
+def _eh_tabela_folha(tag) -> bool:
+        return tag.name == "table" and tag.table == None
+
+def _analisar_bs4(html: Html, builder: str) -> Documento:
+        soup = BeautifulSoup(html, builder)
+
+        def tabelas_folha():
+                return [Tabela([Linha([list(td.stripped_strings) for td in tr.find_all("td")], list(tr.stripped_strings))
+                                for tr in tabela.find_all("tr")],
+                               list(tabela.stripped_strings))
+                        for tabela in soup.find_all(_eh_tabela_folha)]
+
+        def links():
+                return [(a.get('href'), a.get_text()) for a in soup.find_all('a', href=True)]
+
+        def links_com_linha():
+                resultado = []
+                for a in soup.find_all('a', href=True):
+                        tr = a.find_parent('tr')
+                        resultado.append((a.get('href'), [list(td.stripped_strings) for td in tr.find_all('td', recursive=False)] if tr else []))
+                return resultado
+
+        return Documento(tabelas_folha, soup.get_text, links, links_com_linha)
+
+# ---------------------------------------------------------------------------
+# lxml
+# ---------------------------------------------------------------------------
+
+def _analisar_lxml(html: Html) -> Documento:
+        raiz = lxml.html.document_fromstring(html)
+
+        def tabelas_folha():
+                return [Tabela([Linha([_strings(td.itertext()) for td in tr.iter('td')], _strings(tr.itertext()))
+                                for tr in tabela.iter('tr')],
+                               _strings(tabela.itertext()))
+                        for tabela in raiz.iter('table') if next(tabela.iterdescendants('table'), None) is None]
+
+        def links():
+                return [(a.get('href'), a.text_content()) for a in raiz.iter('a') if a.get('href') is not None]
+
+        def links_com_linha():
+                resultado = []
+                for a in raiz.iter('a'):
+                        if a.get('href') is None:
+                                continue
+                        tr = next(a.iterancestors('tr'), None)
+                        resultado.append((a.get('href'), [_strings(td.itertext()) for td in tr if td.tag == 'td'] if tr is not None else []))
+                return resultado
+
+        return Documento(tabelas_folha, raiz.text_content, links, links_com_linha)
+
+# ---------------------------------------------------------------------------
+# selectolax
+# ---------------------------------------------------------------------------
+
+def _textos_selectolax(no) -> List[str]:
+        return _strings(n.text(deep=False) for n in no.traverse(include_text=True) if n.tag == '-text')
+
+def _analisar_selectolax(html: Html) -> Documento:
+        arvore = SelectolaxParser(html)
+
+        def tabelas_folha():
+                return [Tabela([Linha([_textos_selectolax(td) for td in tr.css('td')], _textos_selectolax(tr))
+                                for tr in tabela.css('tr')],
+                               _textos_selectolax(tabela))
+                        for tabela in arvore.css('table:not(:has(table))')]
+
+        def links():
+                return [(a.attributes['href'], a.text()) for a in arvore.css('a[href]')]
+
+        def links_com_linha():
+                resultado = []
+                for a in arvore.css('a[href]'):
+                        tr = a.parent
+                        while tr is not None and tr.tag != 'tr':
+                                tr = tr.parent
+                        resultado.append((a.attributes['href'], [_textos_selectolax(td) for td in tr.iter() if td.tag == 'td'] if tr is not None else []))
+                return resultado
+
+        return Documento(tabelas_folha, lambda: arvore.root.text() if arvore.root else '', links, links_com_linha)
+
+# ---------------------------------------------------------------------------
+# Seleção do backend
+# ---------------------------------------------------------------------------
+
+BACKENDS: Dict[str, Callable[[Html], Documento]] = {'html5lib': lambda html: _analisar_bs4(html, "html5lib")}
+if lxml is not None:
+        BACKENDS['lxml'] = _analisar_lxml
+if SelectolaxParser is not None:
+        BACKENDS['selectolax'] = _analisar_selectolax
+
+PREFERENCIA = ('selectolax', 'lxml', 'html5lib')
+
+backend_atual: str = next(b for b in PREFERENCIA if b in BACKENDS)
+
+def definir_backend(nome: Optional[str]) -> str:
+        global backend_atual
+        if nome:
+                if nome not in BACKENDS:
+                        raise ValueError(f"Backend de HTML '{nome}' indisponível (disponíveis: {', '.join(BACKENDS)})")
+                backend_atual = nome
+        return backend_atual
+
+def analisar(html: Html, backend: Optional[str] = None) -> Documento:
+        return BACKENDS[backend or backend_atual](html)
+
+def tabelas_folha(html: Html, backend: Optional[str] = None) -> List[Tabela]:
+        return analisar(html, backend).tabelas_folha()
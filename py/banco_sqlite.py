@@ -0,0 +1,274 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Exportação das matérias (db.json) e dos cursos (cursos.json) para um banco SQLite normalizado e indexado, para
+# consultas no servidor ("turmas de terça à noite em São Carlos", "matérias do professor X", "cursos em que Y é
+# requisito") sem carregar e percorrer o JSON inteiro.
+#
+# Tabelas:
+#   materias(id, codigo, nome, unidade, departamento, campus, creditos_aula, creditos_trabalho, objetivos,
+#            programa_resumido)
+#   turmas(id, materia, codigo, inicio, fim, tipo, codigo_teorica, observacoes, ocupacao)
+#                                                         ocupacao: máscara semanal do horário (ver horarios.py)
+#   horarios(turma, dia, inicio, fim)                     dia como no JupiterWeb: seg, ter, ..., sab
+#   professores(turma, professor, responsavel)            professores distintos de cada turma; responsavel: "(R)"
+#   vagas(turma, tipo, grupo, vagas, inscritos, pendentes, matriculados)   grupo NULL: total do tipo de vaga
+#   cursos(codigo, periodo, nome, unidade)
+#   curso_materias(curso, periodo, semestre, materia, tipo)   semestre: "período ideal" da grade
+#   requisitos(curso, periodo, materia, requisito, tipo)      tipo: forte, fraco ou conjunto
+#   materias_busca                                            FTS5 sobre nome e objetivos das matérias
+#   metadados(chave, valor)
+# com índices em código, unidade, campus, dia e horário, professor e nas duas pontas dos requisitos.
+#
+# O banco é montado num arquivo temporário e substitui o anterior de forma atômica.
+#
+# Uso: python banco_sqlite.py exportar DIRETORIO_DB [-o ARQUIVO]     a partir de db.json e cursos.json
+#      python banco_sqlite.py ARQUIVO materia MAC0110
+#      python banco_sqlite.py ARQUIVO horarios --dia ter --depois 18:00 --campus "São Carlos"
+#      python banco_sqlite.py ARQUIVO professor "Fulano"
+#      python banco_sqlite.py ARQUIVO dependentes MAC0110 --tipo forte
+#      python banco_sqlite.py ARQUIVO busca "álgebra linear"
+#      python banco_sqlite.py ARQUIVO sql "SELECT ..."
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import saida
+from horarios import ocupacao, para_hex
+
+logger = logging.getLogger('log')
+
+ARQUIVO_PADRAO = 'matrusp.sqlite'
+
+ESQUEMA = """
+CREATE TABLE metadados (chave TEXT PRIMARY KEY, valor TEXT);
+CREATE TABLE materias (id INTEGER PRIMARY KEY, codigo TEXT NOT NULL UNIQUE, nome TEXT, unidade TEXT, departamento TEXT,
+                       campus TEXT, creditos_aula INTEGER, creditos_trabalho INTEGER, objetivos TEXT, programa_resumido TEXT);
+CREATE TABLE turmas (id INTEGER PRIMARY KEY, materia TEXT NOT NULL, codigo TEXT, inicio TEXT, fim TEXT, tipo TEXT,
+                     codigo_teorica TEXT, observacoes TEXT, ocupacao TEXT);
+CREATE TABLE horarios (turma INTEGER NOT NULL, dia TEXT, inicio TEXT, fim TEXT);
+CREATE TABLE professores (turma INTEGER NOT NULL, professor TEXT NOT NULL COLLATE NOCASE, responsavel INTEGER NOT NULL);
+CREATE TABLE vagas (turma INTEGER NOT NULL, tipo TEXT, grupo TEXT, vagas INTEGER, inscritos INTEGER, pendentes INTEGER,
+                    matriculados INTEGER);
+CREATE TABLE cursos (codigo TEXT NOT NULL, periodo TEXT NOT NULL, nome TEXT, unidade TEXT, PRIMARY KEY (codigo, periodo));
+CREATE TABLE curso_materias (curso TEXT NOT NULL, periodo TEXT NOT NULL, semestre INTEGER, materia TEXT NOT NULL, tipo TEXT);
+CREATE TABLE requisitos (curso TEXT NOT NULL, periodo TEXT NOT NULL, materia TEXT NOT NULL, requisito TEXT NOT NULL, tipo TEXT NOT NULL);
+CREATE VIRTUAL TABLE materias_busca USING fts5(nome, objetivos, content='materias', content_rowid='id',
+                                               tokenize='unicode61 remove_diacritics 2');
+"""
+
+# Criados depois da carga, que é mais rápida sem eles
+INDICES = """
+CREATE INDEX materias_unidade ON materias (unidade);
+CREATE INDEX materias_campus ON materias (campus);
+CREATE INDEX turmas_materia ON turmas (materia);
+CREATE INDEX horarios_dia ON horarios (dia, inicio, fim);
+CREATE INDEX horarios_turma ON horarios (turma);
+CREATE INDEX professores_professor ON professores (professor);
+CREATE INDEX professores_turma ON professores (turma);
+CREATE INDEX vagas_turma ON vagas (turma);
+CREATE INDEX curso_materias_materia ON curso_materias (materia);
+CREATE INDEX curso_materias_curso ON curso_materias (curso, periodo);
+CREATE INDEX requisitos_requisito ON requisitos (requisito, tipo);
+CREATE INDEX requisitos_materia ON requisitos (materia, tipo);
+INSERT INTO materias_busca (materias_busca) VALUES ('rebuild');
+"""
+
+TIPOS_REQUISITO = {'req_forte': 'forte', 'req_fraco': 'fraco', 'ind_conjunto': 'conjunto'}
+
+def _inserir_materia(conexao: sqlite3.Connection, materia: Dict[str, Any]) -> None:
+        codigo = materia['codigo']
+        conexao.execute("INSERT INTO materias (codigo, nome, unidade, departamento, campus, creditos_aula, creditos_trabalho, "
+                        "objetivos, programa_resumido) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (codigo, materia.get('nome'), materia.get('unidade'), materia.get('departamento'), materia.get('campus'),
+                         materia.get('creditos_aula'), materia.get('creditos_trabalho'), materia.get('objetivos'),
+                         materia.get('programa_resumido')))
+        for turma in materia.get('turmas', []):
+                id_turma = conexao.execute("INSERT INTO turmas (materia, codigo, inicio, fim, tipo, codigo_teorica, observacoes, ocupacao) "
+                                           "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                           (codigo, turma.get('codigo'), turma.get('inicio'), turma.get('fim'), turma.get('tipo'),
+                                            turma.get('codigo_teorica'), turma.get('observacoes'), para_hex(ocupacao(turma)))).lastrowid
+                professores: Dict[str, bool] = {}
+                for aula in turma.get('horario') or []:
+                        conexao.execute("INSERT INTO horarios VALUES (?, ?, ?, ?)", (id_turma, aula['dia'], aula['inicio'], aula['fim']))
+                        for professor in aula['professores']:
+                                responsavel = professor.startswith('(R)')
+                                nome = professor[3:].strip() if responsavel else professor.strip()
+                                if nome:
+                                        professores[nome] = professores.get(nome, False) or responsavel
+                conexao.executemany("INSERT INTO professores VALUES (?, ?, ?)",
+                                    [(id_turma, nome, int(responsavel)) for nome, responsavel in professores.items()])
+                for tipo, vagas in (turma.get('vagas') or {}).items():
+                        conexao.execute("INSERT INTO vagas VALUES (?, ?, NULL, ?, ?, ?, ?)",
+                                        (id_turma, tipo, vagas['vagas'], vagas['inscritos'], vagas['pendentes'], vagas['matriculados']))
+                        conexao.executemany("INSERT INTO vagas VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                            [(id_turma, tipo, grupo, g['vagas'], g['inscritos'], g['pendentes'], g['matriculados'])
+                                             for grupo, g in vagas.get('grupos', {}).items()])
+
+def _inserir_curso(conexao: sqlite3.Connection, curso: Dict[str, Any]) -> None:
+        chave = (curso['codigo'], curso['periodo'])
+        conexao.execute("INSERT OR REPLACE INTO cursos VALUES (?, ?, ?, ?)", chave + (curso.get('nome'), curso.get('unidade')))
+        for semestre, materias in (curso.get('periodos') or {}).items():
+                for materia in materias:
+                        conexao.execute("INSERT INTO curso_materias VALUES (?, ?, ?, ?, ?)",
+                                        chave + (int(semestre) if semestre.isdigit() else None, materia['codigo'], materia.get('tipo')))
+                        for campo, tipo in TIPOS_REQUISITO.items():
+                                conexao.executemany("INSERT INTO requisitos VALUES (?, ?, ?, ?, ?)",
+                                                    [chave + (materia['codigo'], requisito, tipo) for requisito in materia.get(campo, [])])
+
+# Monta o banco a partir das matérias e dos cursos (dicionários, como em db.json e cursos.json) e o grava em
+# `caminho`, substituindo o anterior de forma atômica
+def exportar(caminho: Union[str, Path], materias: Iterable[Dict[str, Any]], cursos: Iterable[Dict[str, Any]],
+             metadados: Optional[Dict[str, Any]] = None) -> Dict[str, int]:
+        caminho = Path(caminho)
+        caminho.parent.mkdir(parents=True, exist_ok=True)
+        temporario = saida._temporario(caminho)
+        try:
+                conexao = sqlite3.connect(temporario)
+                try:
+                        # O arquivo temporário não precisa sobreviver a uma queda: sem journal e sem fsync durante a carga
+                        conexao.execute("PRAGMA journal_mode = OFF")
+                        conexao.execute("PRAGMA synchronous = OFF")
+                        conexao.executescript(ESQUEMA)
+                        with conexao:
+                                for materia in materias:
+                                        _inserir_materia(conexao, materia)
+                                for curso in cursos:
+                                        _inserir_curso(conexao, curso)
+                                metadados = dict(metadados or {}, data=time.strftime('%Y-%m-%dT%H:%M:%S'))
+                                conexao.executemany("INSERT INTO metadados VALUES (?, ?)", [(k, json.dumps(v, ensure_ascii=False)) for k, v in metadados.items()])
+                        conexao.executescript(INDICES)
+                        conexao.execute("ANALYZE")
+                        contagem = {tabela: conexao.execute(f"SELECT count(*) FROM {tabela}").fetchone()[0]
+                                    for tabela in ('materias', 'turmas', 'cursos', 'requisitos')}
+                finally:
+                        conexao.close()
+                Path(temporario).replace(caminho)
+        except BaseException:
+                Path(temporario).unlink(missing_ok=True)
+                raise
+        logger.info(f" -   Banco SQLite {caminho}: {contagem['materias']} matérias, {contagem['turmas']} turmas, "
+                    f"{contagem['cursos']} cursos, {contagem['requisitos']} requisitos")
+        return contagem
+
+# ---------------------------------------------------------------------------
+# Consultas
+# ---------------------------------------------------------------------------
+
+def conectar(caminho: Union[str, Path]) -> sqlite3.Connection:
+        conexao = sqlite3.connect(f"file:{caminho}?mode=ro", uri=True)
+        conexao.row_factory = sqlite3.Row
+        return conexao
+
+def materia(conexao: sqlite3.Connection, codigo: str) -> List[sqlite3.Row]:
+        return conexao.execute("SELECT m.codigo, m.nome, m.unidade, m.campus, t.codigo AS turma, h.dia, h.inicio, h.fim "
+                               "FROM materias m LEFT JOIN turmas t ON t.materia = m.codigo LEFT JOIN horarios h ON h.turma = t.id "
+                               "WHERE m.codigo = ? ORDER BY t.codigo, h.rowid", (codigo,)).fetchall()
+
+# Turmas com aula no dia, começando a partir de `depois` e terminando até `antes` (HH:MM), opcionalmente de um campus
+# ou unidade
+def horarios(conexao: sqlite3.Connection, dia: str, depois: Optional[str] = None, antes: Optional[str] = None,
+             campus: Optional[str] = None, unidade: Optional[str] = None) -> List[sqlite3.Row]:
+        condicoes, parametros = ["h.dia = ?"], [dia]
+        for condicao, valor in (("h.inicio >= ?", depois), ("h.fim <= ?", antes), ("m.campus = ?", campus), ("m.unidade = ?", unidade)):
+                if valor is not None:
+                        condicoes.append(condicao)
+                        parametros.append(valor)
+        return conexao.execute("SELECT m.codigo, m.nome, t.codigo AS turma, h.dia, h.inicio, h.fim, m.campus "
+                               "FROM horarios h JOIN turmas t ON t.id = h.turma JOIN materias m ON m.codigo = t.materia "
+                               f"WHERE {' AND '.join(condicoes)} ORDER BY h.inicio, m.codigo, t.codigo", parametros).fetchall()
+
+# Turmas de professores cujo nome começa com `nome` (sem diferenciar maiúsculas; o prefixo usa o índice)
+def professor(conexao: sqlite3.Connection, nome: str) -> List[sqlite3.Row]:
+        return conexao.execute("SELECT p.professor, p.responsavel, m.codigo, m.nome, t.codigo AS turma "
+                               "FROM professores p JOIN turmas t ON t.id = p.turma JOIN materias m ON m.codigo = t.materia "
+                               "WHERE p.professor LIKE ? ESCAPE '\\' ORDER BY p.professor, m.codigo, t.codigo",
+                               (nome.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%',)).fetchall()
+
+# Matérias que têm `codigo` como requisito, em cada curso
+def dependentes(conexao: sqlite3.Connection, codigo: str, tipo: Optional[str] = None) -> List[sqlite3.Row]:
+        return conexao.execute("SELECT r.materia, r.tipo, r.curso, r.periodo, c.nome AS nome_curso FROM requisitos r "
+                               "LEFT JOIN cursos c ON c.codigo = r.curso AND c.periodo = r.periodo "
+                               "WHERE r.requisito = ? AND (? IS NULL OR r.tipo = ?) ORDER BY r.materia, r.curso, r.periodo",
+                               (codigo, tipo, tipo)).fetchall()
+
+# Busca textual (FTS5) em nome e objetivos, das mais relevantes para as menos
+def busca(conexao: sqlite3.Connection, texto: str, limite: int = 20) -> List[sqlite3.Row]:
+        # Cada palavra como termo entre aspas, para que pontuação e operadores do FTS5 no texto não causem erro
+        consulta = ' '.join('"' + palavra.replace('"', '""') + '"' for palavra in texto.split())
+        return conexao.execute("SELECT m.codigo, m.nome, m.campus FROM materias_busca b JOIN materias m ON m.id = b.rowid "
+                               "WHERE materias_busca MATCH ? ORDER BY bm25(materias_busca) LIMIT ?", (consulta, limite)).fetchall()
+
+def _imprimir(linhas: Sequence[sqlite3.Row]) -> None:
+        if linhas:
+                print('\t'.join(linhas[0].keys()))
+        for linha in linhas:
+                print('\t'.join('' if v is None else str(v) for v in linha))
+
+# Lista de db.json ou cursos.json já gravado (vazia se o arquivo não existe)
+def carregar_json(caminho: Path) -> List[Dict[str, Any]]:
+        try:
+                return json.loads(caminho.read_bytes())
+        except FileNotFoundError:
+                logger.warning(f" -   {caminho} não encontrado")
+                return []
+
+if __name__ == "__main__":
+        if len(sys.argv) > 1 and sys.argv[1] == 'exportar':
+                parser = argparse.ArgumentParser(description="Exporta db.json e cursos.json para um banco SQLite")
+                parser.add_argument('comando')
+                parser.add_argument('diretorio_db', help="diretório com db.json e cursos.json")
+                parser.add_argument('-o', '--out', help=f"arquivo do banco (padrão: {ARQUIVO_PADRAO} no diretório)")
+                args = parser.parse_args()
+                logger.setLevel(logging.INFO)
+                logger.addHandler(logging.StreamHandler())
+                diretorio = Path(args.diretorio_db)
+                exportar(args.out or diretorio / ARQUIVO_PADRAO, carregar_json(diretorio / 'db.json'), carregar_json(diretorio / 'cursos.json'))
+                sys.exit(0)
+
+        parser = argparse.ArgumentParser(description="Consultas ao banco SQLite do MatrUSP")
+        parser.add_argument('arquivo', help="banco gravado por parse_usp.py --sqlite ou por 'banco_sqlite.py exportar'")
+        parser.add_argument('-t', '--tempo', help="mostrar o tempo da consulta", action='store_true')
+        comandos = parser.add_subparsers(dest='comando', required=True)
+        c = comandos.add_parser('materia', help="turmas e horários de uma matéria")
+        c.add_argument('codigo')
+        c = comandos.add_parser('horarios', help="turmas com aula num dia e intervalo de horário")
+        c.add_argument('--dia', required=True, choices=['seg', 'ter', 'qua', 'qui', 'sex', 'sab', 'dom'])
+        c.add_argument('--depois', help="aulas que começam a partir de HH:MM")
+        c.add_argument('--antes', help="aulas que terminam até HH:MM")
+        c.add_argument('--campus')
+        c.add_argument('--unidade')
+        c = comandos.add_parser('professor', help="turmas dos professores cujo nome começa com NOME")
+        c.add_argument('nome')
+        c = comandos.add_parser('dependentes', help="matérias que têm CODIGO como requisito")
+        c.add_argument('codigo')
+        c.add_argument('--tipo', choices=sorted(TIPOS_REQUISITO.values()))
+        c = comandos.add_parser('busca', help="busca textual em nome e objetivos")
+        c.add_argument('texto')
+        c.add_argument('-n', '--limite', type=int, default=20)
+        c = comandos.add_parser('sql', help="consulta SQL qualquer (somente leitura)")
+        c.add_argument('consulta')
+        args = parser.parse_args()
+
+        conexao = conectar(args.arquivo)
+        inicio = time.perf_counter()
+        if args.comando == 'materia':
+                linhas = materia(conexao, args.codigo)
+        elif args.comando == 'horarios':
+                linhas = horarios(conexao, args.dia, args.depois, args.antes, args.campus, args.unidade)
+        elif args.comando == 'professor':
+                linhas = professor(conexao, args.nome)
+        elif args.comando == 'dependentes':
+                linhas = dependentes(conexao, args.codigo, args.tipo)
+        elif args.comando == 'busca':
+                linhas = busca(conexao, args.texto, args.limite)
+        else:
+                linhas = conexao.execute(args.consulta).fetchall()
+        tempo = time.perf_counter() - inicio
+        _imprimir(linhas)
+        if args.tempo:
+                print(f"{len(linhas)} linhas em {tempo * 1000:.2f} ms", file=sys.stderr)
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Benchmark do catálogo compacto (compacto.py) contra db.json: tamanho do arquivo e de cada variante compactada, e
+# tempo de decodificação, em Python (json.loads, mais decodificar) e no Node.js (gunzip, JSON.parse e, para o formato
+# compacto, decodeCompact de js/dbupdate.js), como o cliente faz depois do download.
+#
+# db.json é antes serializado de novo como parse_usp.py o grava hoje (modelo.serializar, sem espaços e em UTF-8), já que
+# um arquivo de uma versão anterior pode ter outra formatação com as mesmas matérias; os tamanhos são os desse db.json.
+# Os dois lados precisam produzir as mesmas matérias: em Python, a lista decodificada, serializada da mesma forma, é
+# idêntica a db.json, byte a byte; no Node.js, JSON.stringify das duas listas é igual.
+#
+# A coluna "relação" é o tempo do compacto dividido pelo de db.json: acima de 1, o compacto é mais lento. Em Python,
+# decodificar custa mais do que o json.loads que economiza, e o compacto sai mais lento (cerca de 1,25 vez); só no
+# Node.js ele é mais rápido, e por pouco. O ganho do formato é no tamanho do download.
+#
+# Uso:
+#   python benchmark_compacto.py ../db/db.json.gz --repeticoes 5
+import sys
+import gzip
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import saida
+import compacto
+import modelo
+
+DIRETORIO_JS = Path(__file__).resolve().parent.parent / 'js'
+
+# Imprime os tempos (ms) de gunzip + JSON.parse de db.json e de gunzip + JSON.parse + decodeCompact do formato
+# compacto, e se as duas listas de matérias são iguais
+PROGRAMA_NODE = r"""
+const fs = require('fs'), vm = require('vm'), zlib = require('zlib');
+const [dbupdate, original, compactado, repeticoes] = process.argv.slice(1);
+const codigo = fs.readFileSync(dbupdate, 'utf8');
+const inicio = codigo.indexOf('function decodeCompact');
+vm.runInThisContext(codigo.slice(inicio, codigo.indexOf('\n}\n', inicio) + 3));
+const arquivos = {original: fs.readFileSync(original), compacto: fs.readFileSync(compactado)};
+const decodificar = {original: d => JSON.parse(zlib.gunzipSync(d)), compacto: d => decodeCompact(JSON.parse(zlib.gunzipSync(d)))};
+const tempos = {}, resultados = {};
+for (const nome of ['original', 'compacto']) {
+  tempos[nome] = [];
+  for (let i = 0; i < Number(repeticoes); i++) {
+    const t = process.hrtime.bigint();
+    resultados[nome] = decodificar[nome](arquivos[nome]);
+    tempos[nome].push(Number(process.hrtime.bigint() - t) / 1e6);
+  }
+}
+process.stdout.write(JSON.stringify({tempos: tempos, iguais: JSON.stringify(resultados.original) === JSON.stringify(resultados.compacto)}));
+"""
+
+def melhor_tempo(funcao: Callable[[], object], repeticoes: int) -> float:
+        tempos = []
+        for _ in range(repeticoes):
+                t = time.perf_counter()
+                funcao()
+                tempos.append(time.perf_counter() - t)
+        return min(tempos)
+
+def tamanhos(dados: bytes, compressao: saida.Compressao) -> Dict[str, int]:
+        resultado = {'json': len(dados)}
+        for formato in compressao.formatos():
+                resultado[formato] = len(compressao.compactar(formato, dados))
+        return resultado
+
+def executar_node(node: str, original: bytes, compactado: bytes, repeticoes: int) -> Dict[str, object]:
+        with tempfile.TemporaryDirectory() as diretorio:
+                arquivos: List[Path] = [Path(diretorio) / 'db.json.gz', Path(diretorio) / 'db.compacto.json.gz']
+                arquivos[0].write_bytes(gzip.compress(original, 9, mtime=0))
+                arquivos[1].write_bytes(gzip.compress(compactado, 9, mtime=0))
+                resultado = subprocess.run([node, '-e', PROGRAMA_NODE, DIRETORIO_JS / 'dbupdate.js', *arquivos, str(repeticoes)],
+                                           check=True, capture_output=True, text=True).stdout
+        return json.loads(resultado)
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Benchmark do catálogo compacto contra db.json")
+        parser.add_argument('db', help="db.json ou db.json.gz")
+        parser.add_argument('--repeticoes', help="repetições de cada decodificação (vale o menor tempo)", type=int, default=5)
+        parser.add_argument('--node', help="executável do Node.js (padrão: o do PATH, se houver)", default=shutil.which('node'))
+        args = parser.parse_args()
+
+        abrir = gzip.open if args.db.endswith('.gz') else open
+        with abrir(args.db, 'rb') as f:
+                materias = json.load(f)
+        original = b''.join(saida.lista_json(modelo.serializar(m) for m in materias))
+        t = time.perf_counter()
+        compactado = compacto.serializar(compacto.codificar(materias))
+        print(f"{len(materias)} matérias, codificadas em {time.perf_counter() - t:.2f} s")
+
+        if b''.join(saida.lista_json(modelo.serializar(m) for m in compacto.decodificar(json.loads(compactado)))) != original:
+                print("A decodificação do formato compacto não reproduz db.json")
+                sys.exit(1)
+
+        compressao = saida.Compressao({formato: saida.FORMATOS[formato].nivel_padrao for formato in saida.formatos_disponiveis()})
+        tamanho_original, tamanho_compacto = tamanhos(original, compressao), tamanhos(compactado, compressao)
+        print(f"{'tamanho':<10}{'db.json':>12}{'compacto':>12}{'redução':>10}")
+        for formato in tamanho_original:
+                print(f"{formato:<10}{tamanho_original[formato]:>12}{tamanho_compacto[formato]:>12}"
+                      f"{1 - tamanho_compacto[formato] / tamanho_original[formato]:>10.1%}")
+
+        gz_original, gz_compacto = gzip.compress(original, 9, mtime=0), gzip.compress(compactado, 9, mtime=0)
+        tempos = {'python': (melhor_tempo(lambda: json.loads(gzip.decompress(gz_original)), args.repeticoes),
+                             melhor_tempo(lambda: compacto.decodificar(json.loads(gzip.decompress(gz_compacto))), args.repeticoes))}
+        if args.node:
+                node = executar_node(args.node, original, compactado, args.repeticoes)
+                if not node['iguais']:
+                        print("decodeCompact (js/dbupdate.js) não reproduz as matérias de db.json")
+                        sys.exit(1)
+                tempos['node'] = (min(node['tempos']['original']) / 1000, min(node['tempos']['compacto']) / 1000)
+        else:
+                print("Node.js não encontrado (use --node): só a decodificação em Python é medida")
+
+        print(f"{'decodificação (ms)':<20}{'db.json.gz':>12}{'compacto.gz':>12}{'relação':>10}")
+        for nome, (tempo_original, tempo_compacto) in tempos.items():
+                print(f"{nome:<20}{tempo_original * 1000:>12.1f}{tempo_compacto * 1000:>12.1f}{tempo_compacto / tempo_original:>10.2f}"
+                      f"  ({'mais lento' if tempo_compacto > tempo_original else 'mais rápido'})")
@@ -0,0 +1,227 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Microbenchmarks das funções de análise dos crawlers sobre um corpus fixo de páginas (corpus/, no formato das
+# fixtures de servidor_jupiter.py), para saber qual delas domina a CPU e detectar regressões sem depender da rede:
+#   html (obterTurma), html (obterDisciplina), html (grade)   analise_html.tabelas_folha de cada página
+#   parsear_turmas, parsear_info_turma, parsear_horario, parsear_vagas   páginas obterTurma
+#   parsear_info_materia                                       páginas obterDisciplina
+#   parsear_periodos                                           grades curriculares (listarGradeCurricular)
+# parsear_turmas inclui as outras três; cada uma das três é medida também separadamente, nas tabelas que
+# parsear_turmas lhe passaria.
+#
+# O corpus tem páginas típicas e os piores casos do catálogo: FLG0499 (44 turmas), FLL0433 (49 grupos de vagas),
+# 6700002 (37 professores num horário), 0100901 (71 horários), 6700006 (24 mil caracteres de objetivos), 2014-102
+# (349 matérias na grade), além de 4302111 e PMI3103 e da grade 6022-3, de tamanho mediano.
+#
+# As páginas de corpus/ ainda são sintéticas: foram renderizadas por servidor_jupiter.py (gerar) a partir do JSON
+# dessas matérias, e não têm a marcação real do JupiterWeb. Para trocá-las pelas reais, grave com
+# `servidor_jupiter.py gravar` as unidades dos casos (FFLCH, Poli, IF, FM, FMVZ, FD, FSP e a interunidade
+# FM/ICB/IQ/IB de 6700002 e 6700006) e copie as mesmas páginas com --copiar-de (o que faltar na gravação é avisado
+# e mantido); depois grave de novo a referência, já que as razões mudam com a marcação. As páginas ainda sintéticas
+# estão listadas em corpus/origem.json, que --copiar-de atualiza, e são avisadas a cada execução.
+#
+# Sem a marcação real (tabelas de layout aninhadas, scripts, espaços), a divisão do tempo entre as funções não é a do
+# crawler de verdade, então a referência gravada com páginas sintéticas (e a de corpus/referencia.json é uma delas)
+# só serve para comparação: enquanto a referência ou o corpus tiver páginas sintéticas, as regressões são mostradas
+# mas o código de saída é 0.
+#
+# O tempo de cada função é o menor de --repeticoes passagens pelo corpus. Como o tempo absoluto depende da máquina, a
+# referência guarda a razão entre o tempo de cada função e o da calibração: o html.parser da biblioteca padrão lendo
+# as mesmas páginas, que não depende de nada deste repositório. Com --referencia, as razões medidas são comparadas às
+# gravadas (com --gravar-referencia) e o script termina com código 1 se alguma passou da referência por mais de
+# --tolerancia. A razão ainda varia um pouco com a versão do Python, e bastante com o backend, que são avisados.
+#
+# Uso:
+#   python benchmark_corpus.py --gravar-referencia corpus/referencia.json
+#   python benchmark_corpus.py --referencia corpus/referencia.json --tolerancia 0.2
+#   python benchmark_corpus.py --profile corpus.prof
+#   python servidor_jupiter.py gravar gravadas/ -u CODCG... && python benchmark_corpus.py --copiar-de gravadas/
+import re
+import html.parser
+import sys
+import json
+import time
+import argparse
+import shutil
+import platform
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import analise_html
+import metricas
+import parse_usp
+import parse_cursos_usp
+import servidor_jupiter
+
+CORPUS = Path(__file__).resolve().parent / 'corpus'
+
+# Páginas do corpus ainda renderizadas por servidor_jupiter.py gerar, e não gravadas do JupiterWeb
+ARQUIVO_ORIGEM = 'origem.json'
+
+# Medida que serve de unidade para as demais (ver calibracao)
+CALIBRACAO = 'html.parser (calibração)'
+VERSAO_REFERENCIA = 2
+
+re_disciplinas_obrigatorias = re.compile(r"Disciplinas\s+Obrigatórias")
+
+# Páginas do corpus, por tipo de página (os arquivos são {chave}.html, como em servidor_jupiter.caminho_fixture)
+CASOS = {'obterTurma': ('0100901', '4302111', '6700002', 'FLG0499', 'FLL0433', 'PMI3103'),
+         'obterDisciplina': ('4302111', '6700006', 'MSP4231', 'PMI3103'),
+         'listarGradeCurricular': ('2014-102', '6022-3')}
+
+def paginas_sinteticas(corpus: Path) -> List[str]:
+        try:
+                return json.loads((corpus / ARQUIVO_ORIGEM).read_text())['sinteticas']
+        except FileNotFoundError:
+                return []
+
+# Copia as páginas de CASOS (e a lista de unidades) de um diretório gravado com servidor_jupiter.py gravar para o
+# corpus, e as retira das sintéticas. Devolve as páginas que não estavam na gravação.
+def copiar_casos(gravadas: Path, corpus: Path) -> List[str]:
+        faltando = []
+        sinteticas = paginas_sinteticas(corpus)
+        for pagina, chave in [('jupColegiadoLista', None)] + [(p, c) for p, chaves in CASOS.items() for c in chaves]:
+                origem = servidor_jupiter.caminho_fixture(gravadas, pagina, chave)
+                if not origem.exists():
+                        faltando.append(f"{pagina}/{chave}" if chave else pagina)
+                        continue
+                destino = servidor_jupiter.caminho_fixture(corpus, pagina, chave)
+                destino.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(origem, destino)
+                sinteticas = [p for p in sinteticas if p != (f"{pagina}/{chave}" if chave else pagina)]
+        (corpus / ARQUIVO_ORIGEM).write_text(json.dumps({'sinteticas': sinteticas}, indent=1) + '\n')
+        return faltando
+
+# Tabelas da página obterTurma que parsear_turmas passa a cada função, na mesma ordem de testes
+def tabelas_turmas(tabelas: List[Any]) -> Dict[str, List[Any]]:
+        separadas: Dict[str, List[Any]] = {'parsear_info_turma': [], 'parsear_horario': [], 'parsear_vagas': []}
+        for folha in tabelas:
+                if folha.contem(parse_usp.re_codigo_turma):
+                        separadas['parsear_info_turma'].append(folha)
+                elif folha.contem("Horário"):
+                        separadas['parsear_horario'].append(folha)
+                elif folha.contem(parse_usp.re_atividades_didaticas):
+                        continue
+                elif folha.contem("Vagas"):
+                        separadas['parsear_vagas'].append(folha)
+        return separadas
+
+# Cada caso: (número de chamadas por passagem, função que faz uma passagem pelo corpus)
+def casos(corpus: Path, backend: str) -> Dict[str, Tuple[int, Callable[[], object]]]:
+        documento = analise_html.analisar((corpus / 'jupColegiadoLista.html').read_text(encoding='utf-8'), backend)
+        parse_usp.codigos_unidades = {texto: re.search(r"codcg=(\d+)", href).group(1) for href, texto in documento.links("jupColegiadoMenu")}
+
+        paginas = {tipo: [f.read_text(encoding='utf-8') for f in sorted((corpus / tipo).glob('*.html'))]
+                   for tipo in ('obterTurma', 'obterDisciplina', 'listarGradeCurricular')}
+        tabelas = {tipo: [analise_html.tabelas_folha(html, backend) for html in htmls] for tipo, htmls in paginas.items()}
+        turmas = {funcao: [folha for pagina in tabelas['obterTurma'] for folha in tabelas_turmas(pagina)[funcao]]
+                  for funcao in ('parsear_info_turma', 'parsear_horario', 'parsear_vagas')}
+        grades = [next(folha for folha in pagina if folha.contem(re_disciplinas_obrigatorias)) for pagina in tabelas['listarGradeCurricular']]
+
+        resultado: Dict[str, Tuple[int, Callable[[], object]]] = {}
+        todas = [h for htmls in paginas.values() for h in htmls]
+        resultado[CALIBRACAO] = (len(todas), lambda: calibracao(todas))
+        for tipo, nome in (('obterTurma', 'html (obterTurma)'), ('obterDisciplina', 'html (obterDisciplina)'), ('listarGradeCurricular', 'html (grade)')):
+                resultado[nome] = (len(paginas[tipo]), lambda htmls=paginas[tipo]: [analise_html.tabelas_folha(h, backend) for h in htmls])
+        resultado['parsear_turmas'] = (len(tabelas['obterTurma']), lambda: [parse_usp.parsear_turmas(t) for t in tabelas['obterTurma']])
+        for funcao, folhas in turmas.items():
+                resultado[funcao] = (len(folhas), lambda f=getattr(parse_usp, funcao), folhas=folhas: [f(folha) for folha in folhas])
+        resultado['parsear_info_materia'] = (len(tabelas['obterDisciplina']),
+                                             lambda: [parse_usp.parsear_info_materia(t) for t in tabelas['obterDisciplina']])
+        resultado['parsear_periodos'] = (len(grades), lambda: [parse_cursos_usp.parsear_periodos(folha) for folha in grades])
+        return resultado
+
+# Leitura das páginas pelo html.parser da biblioteca padrão, sem montar árvore: o mesmo trabalho em qualquer versão
+# deste repositório, então acompanha só a velocidade da máquina e do Python
+def calibracao(htmls: List[str]) -> None:
+        for h in htmls:
+                leitor = html.parser.HTMLParser()
+                leitor.feed(h)
+                leitor.close()
+
+def melhor_tempo(funcao: Callable[[], object], repeticoes: int) -> float:
+        tempos = []
+        for _ in range(repeticoes):
+                t = time.perf_counter()
+                funcao()
+                tempos.append(time.perf_counter() - t)
+        return min(tempos)
+
+# Tempo de cada função em unidades da calibração
+def relativos(tempos: Dict[str, float]) -> Dict[str, float]:
+        return {nome: tempo / tempos[CALIBRACAO] for nome, tempo in tempos.items() if nome != CALIBRACAO}
+
+def ler_referencia(arquivo: str) -> Dict[str, Any]:
+        referencia = json.loads(Path(arquivo).read_text())
+        if referencia.get('versao') != VERSAO_REFERENCIA:
+                sys.exit(f"{arquivo}: referência em formato antigo (tempos absolutos); grave-a de novo com --gravar-referencia")
+        return referencia
+
+def comparar(razoes: Dict[str, float], referencia: Dict[str, Any], tolerancia: float) -> List[str]:
+        regressoes = []
+        for nome, razao in razoes.items():
+                anterior = referencia['relativos'].get(nome)
+                if anterior is not None and razao > anterior * (1 + tolerancia):
+                        regressoes.append(f"{nome}: {anterior:.3f} -> {razao:.3f} da calibração ({razao / anterior - 1:+.0%})")
+        return regressoes
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Microbenchmarks das funções de análise sobre o corpus de páginas")
+        parser.add_argument('--corpus', help="diretório do corpus (padrão: corpus/, ao lado deste script)", default=str(CORPUS))
+        parser.add_argument('--parser', help="backend de análise de HTML", choices=list(analise_html.BACKENDS), default=analise_html.backend_atual)
+        parser.add_argument('--repeticoes', help="passagens pelo corpus em cada função (vale o menor tempo)", type=int, default=20)
+        parser.add_argument('--referencia', help="tempos de referência (gravados com --gravar-referencia) para detectar regressões")
+        parser.add_argument('--tolerancia', help="aumento relativo de tempo aceito em relação à referência", type=float, default=0.2)
+        parser.add_argument('--gravar-referencia', help="gravar os tempos medidos neste arquivo, como referência", metavar='ARQUIVO')
+        parser.add_argument('--profile', help="perfilar as medições com cProfile e gravar o perfil neste arquivo (ver metricas.perfil)",
+                            nargs='?', const='', metavar='ARQUIVO', dest='perfil')
+        parser.add_argument('--copiar-de', help="copiar as páginas do corpus de um diretório gravado com servidor_jupiter.py gravar",
+                            metavar='GRAVADAS')
+        args = parser.parse_args()
+
+        if args.copiar_de:
+                faltando = copiar_casos(Path(args.copiar_de), Path(args.corpus))
+                for pagina in faltando:
+                        print(f"Aviso: {pagina} não está em {args.copiar_de}, mantida a página atual do corpus")
+                print(f"{sum(map(len, CASOS.values())) + 1 - len(faltando)} páginas copiadas para {args.corpus}")
+                sys.exit(0)
+
+        sinteticas = paginas_sinteticas(Path(args.corpus))
+        if sinteticas:
+                print(f"Aviso: {len(sinteticas)} páginas do corpus são sintéticas (renderizadas por servidor_jupiter.py), e não a "
+                      f"marcação real do JupiterWeb; veja {ARQUIVO_ORIGEM} e --copiar-de")
+
+        analise_html.definir_backend(args.parser)
+        medidas = casos(Path(args.corpus), args.parser)
+        with metricas.perfil(args, 'benchmark_corpus'):
+                tempos = {nome: melhor_tempo(funcao, args.repeticoes) * 1e6 for nome, (_, funcao) in medidas.items()}
+
+        razoes = relativos(tempos)
+        referencia = ler_referencia(args.referencia) if args.referencia else None
+        ambiente = {'python': platform.python_version(), 'backend': args.parser}
+        if referencia is not None and {k: referencia.get(k) for k in ambiente} != ambiente:
+                print(f"Aviso: referência gravada com {referencia.get('python')}/{referencia.get('backend')}, "
+                      f"medindo com {ambiente['python']}/{ambiente['backend']}")
+
+        print(f"{'função':<26}{'chamadas':>10}{'µs/passagem':>14}{'µs/chamada':>12}{'relativo':>10}{'referência':>12}{'variação':>10}")
+        for nome, (chamadas, _) in medidas.items():
+                razao = razoes.get(nome)
+                anterior = referencia['relativos'].get(nome) if referencia and razao is not None else None
+                comparacao = f"{anterior:>12.3f}{razao / anterior - 1:>+10.1%}" if anterior else f"{'-':>12}{'-':>10}"
+                relativo = f"{razao:>10.3f}" if razao is not None else f"{'1':>10}"
+                print(f"{nome:<26}{chamadas:>10}{tempos[nome]:>14.0f}{tempos[nome] / chamadas:>12.1f}{relativo}{comparacao}")
+
+        if args.gravar_referencia:
+                Path(args.gravar_referencia).write_text(json.dumps(dict(ambiente, versao=VERSAO_REFERENCIA, calibracao=CALIBRACAO,
+                                                                        sinteticas=len(sinteticas), relativos={n: round(r, 4) for n, r in razoes.items()}),
+                                                                   indent=1, ensure_ascii=False) + '\n')
+                print(f"Referência gravada em {args.gravar_referencia}")
+
+        if referencia is not None:
+                regressoes = comparar(razoes, referencia, args.tolerancia)
+                for regressao in regressoes:
+                        print(f"Regressão: {regressao}")
+                if sinteticas or referencia.get('sinteticas', 0):
+                        print(f"Referência ou corpus com páginas sintéticas: regressões não verificadas (ver {ARQUIVO_ORIGEM})")
+                        sys.exit(0)
+                sys.exit(1 if regressoes else 0)
@@ -0,0 +1,201 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Benchmark de ponta a ponta do crawler (parse_usp.py) contra o servidor local de servidor_jupiter.py.
+#
+# Uso:
+#   python servidor_jupiter.py gerar ../db fixtures/
+#   python benchmark_crawler.py fixtures/ --latencia 100 --jitter 50 --saida-json base.json
+#   python benchmark_crawler.py fixtures/ --latencia 100 --jitter 50 --referencia base.json
+#
+# Com --referencia, o benchmark termina com código 1 se a vazão cair ou o pico de memória subir mais do que
+# --tolerancia em relação ao relatório de referência.
+#
+# Com --verificar, as matérias e os cursos obtidos são comparados, como objetos, aos do diretório de onde as páginas
+# foram geradas (servidor_jupiter.py gerar): {codigo}.json de cada matéria e cursos.json. Qualquer diferença (um
+# registro a mais, a menos ou diferente) termina o benchmark com código 1.
+#   python benchmark_crawler.py fixtures/ --verificar ../db
+import os
+import re
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import logging
+import resource
+import statistics
+import tempfile
+import multiprocessing
+import urllib.request
+from pathlib import Path
+from typing import Dict, List, Any
+
+import aiohttp
+
+import analise_html
+import parse_usp
+import servidor_jupiter
+
+logger = logging.getLogger('log')
+
+def porta_livre() -> int:
+        with socket.socket() as s:
+                s.bind(('127.0.0.1', 0))
+                return s.getsockname()[1]
+
+def iniciar_servidor(fixtures: Path, porta: int, **opcoes) -> multiprocessing.Process:
+        # O servidor roda em outro processo para não disputar a CPU do event loop do crawler
+        processo = multiprocessing.Process(target=servidor_jupiter.servir, args=(fixtures, '127.0.0.1', porta), kwargs=opcoes, daemon=True)
+        processo.start()
+        for _ in range(100):
+                try:
+                        urllib.request.urlopen(f'http://127.0.0.1:{porta}/_status', timeout=1).read()
+                        return processo
+                except OSError:
+                        time.sleep(0.1)
+        processo.terminate()
+        raise RuntimeError("O servidor local não respondeu")
+
+def percentil(valores: List[float], p: int) -> float:
+        if not valores:
+                return 0.0
+        if len(valores) == 1:
+                return valores[0]
+        return statistics.quantiles(valores, n=100, method='inclusive')[p - 1]
+
+def criar_trace(latencias: List[float], falhas: Dict[str, int], marcos: Dict[str, float]) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def inicio(session, ctx, params):
+                ctx.inicio = time.perf_counter()
+
+        async def fim(session, ctx, params):
+                latencias.append(time.perf_counter() - ctx.inicio)
+                # A primeira página obterDisciplina respondida marca a primeira matéria completa
+                if 'primeira_materia' not in marcos and 'obterDisciplina' in params.url.path:
+                        marcos['primeira_materia'] = time.perf_counter()
+                if params.response.status != 200:
+                        falhas[str(params.response.status)] = falhas.get(str(params.response.status), 0) + 1
+
+        async def excecao(session, ctx, params):
+                nome = type(params.exception).__name__
+                falhas[nome] = falhas.get(nome, 0) + 1
+
+        trace.on_request_start.append(inicio)
+        trace.on_request_end.append(fim)
+        trace.on_request_exception.append(excecao)
+        return trace
+
+def executar(args: argparse.Namespace, destino: str, url_base: str) -> Dict[str, Any]:
+        argv = [destino, '-s', str(args.simultaneidade), '-t', str(args.timeout), '--url-base', url_base, '--nogzip', '--parser', args.parser, '-w', str(args.workers)]
+        if args.unidades:
+                argv += ['-u'] + args.unidades
+        parse_usp.args = parse_usp.criar_parser().parse_args(argv)
+        parse_usp.args.db_dir = os.path.abspath(destino)
+        analise_html.definir_backend(parse_usp.args.parser)
+
+        latencias: List[float] = []
+        falhas: Dict[str, int] = {}
+        marcos: Dict[str, float] = {}
+        parse_usp.configuracoes_trace = [criar_trace(latencias, falhas, marcos)]
+
+        t = time.perf_counter()
+        asyncio.run(parse_usp.main())
+        duracao = time.perf_counter() - t
+
+        materias = len(json.loads((Path(destino) / parse_usp.args.out).read_text()))
+        arquivo_cursos = Path(destino) / 'cursos.json'
+        return {
+                'materias': materias,
+                'cursos': len(json.loads(arquivo_cursos.read_text())) if arquivo_cursos.exists() else 0,
+                'duracao_s': round(duracao, 3),
+                'materias_por_segundo': round(materias / duracao, 2),
+                'primeira_materia_s': round(marcos.get('primeira_materia', t) - t, 3),
+                'pedidos': len(latencias),
+                'falhas': falhas,
+                'latencia_p50_ms': round(percentil(latencias, 50) * 1000, 2),
+                'latencia_p99_ms': round(percentil(latencias, 99) * 1000, 2),
+                # ru_maxrss é dado em KiB no Linux e em bytes no macOS
+                'pico_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != 'darwin' else 1024 * 1024), 1),
+        }
+
+# Diferenças entre dois conjuntos de registros {chave: registro}, descritas pela chave
+def diferencas(nome: str, obtidos: Dict[Any, Any], esperados: Dict[Any, Any]) -> List[str]:
+        resultado = [f"{nome} {chave}: ausente" for chave in sorted(esperados.keys() - obtidos.keys())]
+        resultado += [f"{nome} {chave}: a mais" for chave in sorted(obtidos.keys() - esperados.keys())]
+        resultado += [f"{nome} {chave}: diferente" for chave in sorted(esperados.keys() & obtidos.keys()) if esperados[chave] != obtidos[chave]]
+        return resultado
+
+# Compara a saída do crawler em destino ao db/ de origem das páginas geradas
+def verificar(destino: Path, origem: Path) -> List[str]:
+        esperadas = {f.stem: json.loads(f.read_text()) for f in origem.glob('*.json') if re.fullmatch(r'[A-Z0-9]{7}\.json', f.name)}
+        obtidas = {m['codigo']: m for m in json.loads((destino / parse_usp.args.out).read_text())}
+        arquivo_cursos = origem / 'cursos.json'
+        chave = lambda curso: (curso['codigo'], curso['periodo'])
+        esperados = {chave(c): c for c in json.loads(arquivo_cursos.read_text())} if arquivo_cursos.exists() else {}
+        obtidos = {chave(c): c for c in json.loads((destino / 'cursos.json').read_text())} if esperados else {}
+        return diferencas('matéria', obtidas, esperadas) + diferencas('curso', obtidos, esperados)
+
+def comparar(relatorio: Dict[str, Any], referencia: Dict[str, Any], tolerancia: float) -> List[str]:
+        regressoes = []
+        if relatorio['materias_por_segundo'] < referencia['materias_por_segundo'] * (1 - tolerancia):
+                regressoes.append(f"vazão caiu de {referencia['materias_por_segundo']} para {relatorio['materias_por_segundo']} materias/s")
+        if relatorio['pico_rss_mb'] > referencia['pico_rss_mb'] * (1 + tolerancia):
+                regressoes.append(f"pico de memória subiu de {referencia['pico_rss_mb']} para {relatorio['pico_rss_mb']} MB")
+        if relatorio['materias'] < referencia['materias']:
+                regressoes.append(f"número de materias caiu de {referencia['materias']} para {relatorio['materias']}")
+        return regressoes
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Benchmark de ponta a ponta do crawler MatrUSP")
+        parser.add_argument('fixtures', help="diretório com as páginas gravadas (ver servidor_jupiter.py)")
+        parser.add_argument('-v','--verbosidade',action = 'count', default = 0)
+        parser.add_argument('-u','--unidades', help=  "iterar apenas estes códigos de unidade", nargs = '+')
+        parser.add_argument('-s','--simultaneidade',help = "número de pedidos HTTP simultâneos", type=int, default=100)
+        parser.add_argument('-w','--workers',help = "número de processos para a análise das páginas", type=int, default=0)
+        parser.add_argument('-t','--timeout',help = "tempo máximo (segundos) do pedido HTTP", type=int, default=120)
+        parser.add_argument('--parser',help = "backend de análise de HTML", choices=list(analise_html.BACKENDS), default=analise_html.backend_atual)
+        parser.add_argument('--latencia', help="latência média (ms) do servidor local", type=float, default=0)
+        parser.add_argument('--jitter', help="variação máxima (ms) em torno da latência média", type=float, default=0)
+        parser.add_argument('--taxa-erro', help="fração das respostas que retornam erro 500/503", type=float, default=0)
+        parser.add_argument('--semente', help="semente do gerador aleatório do servidor", type=int, default=0)
+        parser.add_argument('--saida-json', help="salvar o relatório neste arquivo")
+        parser.add_argument('--referencia', help="relatório anterior para detectar regressões")
+        parser.add_argument('--tolerancia', help="variação relativa aceita em relação à referência", type=float, default=0.1)
+        parser.add_argument('--verificar', help="comparar as matérias e os cursos obtidos aos do db/ de onde as páginas foram geradas", metavar='DB')
+        args = parser.parse_args()
+
+        logger.setLevel(60-10*(args.verbosidade or 3))
+        ch = logging.StreamHandler()
+        ch.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(ch)
+
+        porta = porta_livre()
+        servidor = iniciar_servidor(Path(args.fixtures), porta, latencia=args.latencia, jitter=args.jitter,
+                                    taxa_erro=args.taxa_erro, semente=args.semente)
+        try:
+                with tempfile.TemporaryDirectory() as destino:
+                        relatorio = executar(args, destino, f'http://127.0.0.1:{porta}')
+                        divergencias = verificar(Path(destino), Path(args.verificar)) if args.verificar else []
+        finally:
+                servidor.terminate()
+
+        relatorio['parametros'] = {'parser': args.parser, 'latencia_ms': args.latencia, 'jitter_ms': args.jitter, 'taxa_erro': args.taxa_erro,
+                                   'simultaneidade': args.simultaneidade, 'workers': args.workers, 'unidades': args.unidades}
+        print(json.dumps(relatorio, indent=2, ensure_ascii=False))
+
+        if args.saida_json:
+                Path(args.saida_json).write_text(json.dumps(relatorio, indent=2, ensure_ascii=False))
+
+        if divergencias:
+                for d in divergencias[:20]:
+                        logger.error(f" - Divergência: {d}")
+                logger.error(f" - {len(divergencias)} divergências entre as páginas geradas e {args.verificar}")
+                sys.exit(1)
+
+        if args.referencia:
+                regressoes = comparar(relatorio, json.loads(Path(args.referencia).read_text()), args.tolerancia)
+                for r in regressoes:
+                        logger.error(f" - Regressão: {r}")
+                sys.exit(1 if regressoes else 0)
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Benchmark do histórico de vagas (historico.py) num período de matrícula sintético: --chaves chaves (turma, tipo de
+# vaga), --execucoes execuções do crawler, em cada uma --mudancas das chaves com inscritos novos. Mede o tempo de cada
+# acréscimo (registrar e concluir), o tamanho do histórico contra o de guardar as vagas completas de cada execução em
+# JSON, e o tempo das consultas: a série de uma chave, um intervalo de um décimo do período e mais_rapidas nesse
+# intervalo.
+#
+# Uso:
+#   python benchmark_historico.py --chaves 60000 --execucoes 100 --mudancas 0.05
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Callable, List
+
+import historico
+import modelo
+
+def melhor_tempo(funcao: Callable[[], object], repeticoes: int) -> float:
+        tempos = []
+        for _ in range(repeticoes):
+                t = time.perf_counter()
+                funcao()
+                tempos.append(time.perf_counter() - t)
+        return min(tempos)
+
+def tamanho(diretorio: Path) -> int:
+        return sum(arquivo.stat().st_size for arquivo in diretorio.iterdir())
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Benchmark do histórico de vagas")
+        parser.add_argument('--chaves', help="número de turmas (uma chave por turma)", type=int, default=60000)
+        parser.add_argument('--execucoes', help="número de execuções do crawler no período", type=int, default=100)
+        parser.add_argument('--mudancas', help="fração das turmas com vagas diferentes a cada execução", type=float, default=0.05)
+        parser.add_argument('--repeticoes', help="repetições de cada consulta (vale o menor tempo)", type=int, default=5)
+        args = parser.parse_args()
+
+        aleatorio = random.Random(0)
+        materias = [f"MAC{i // 4:04d}" for i in range(args.chaves)]
+        inscritos = [0] * args.chaves
+        diretorio = Path(tempfile.mkdtemp(prefix='historico_'))
+        tempo = [1_700_000_000]
+        historico.time.time = lambda: tempo[0]
+        tempos_acrescimo: List[float] = []
+        tamanho_json = 0
+        try:
+                for execucao in range(args.execucoes):
+                        for i in aleatorio.sample(range(args.chaves), int(args.chaves * args.mudancas)):
+                                inscritos[i] = min(40, inscritos[i] + aleatorio.randint(1, 10))
+                        turmas = [(materias[i], modelo.Turma(f"2026{i % 4:03d}", None, None, None, None, None, None,
+                                                             {'Obrigatória': modelo.Vagas(40, inscritos[i], 0, 0, {})}))
+                                  for i in range(args.chaves)]
+                        tamanho_json += len(modelo.serializar([t for _, t in turmas]))
+                        t = time.perf_counter()
+                        with historico.EscritorHistorico(diretorio) as escritor:
+                                for codigo, turma in turmas:
+                                        escritor.registrar(codigo, (turma,))
+                                escritor.concluir()
+                        tempos_acrescimo.append(time.perf_counter() - t)
+                        tempo[0] += 3600
+
+                with historico.Historico(diretorio) as h:
+                        print(f"{len(h)} linhas, {len(h.chaves)} chaves, {args.execucoes} execuções")
+                        print(f"{'tamanho (MiB)':<36}{'histórico':>12}{'JSON por execução':>20}")
+                        print(f"{'':<36}{tamanho(diretorio) / 2**20:>12.1f}{tamanho_json / 2**20:>20.1f}")
+                        print(f"{'acréscimo (ms)':<36}{'primeiro':>12}{'mediana':>20}")
+                        print(f"{'':<36}{tempos_acrescimo[0] * 1000:>12.1f}{sorted(tempos_acrescimo)[len(tempos_acrescimo) // 2] * 1000:>20.1f}")
+
+                        inicio = 1_700_000_000 + 3600 * (args.execucoes * 4 // 10)
+                        fim = inicio + 3600 * (args.execucoes // 10)
+                        consultas = {'serie (uma chave)': lambda: h.serie(h.chaves[len(h.chaves) // 2]),
+                                     'intervalo (1/10 do período)': lambda: h.intervalo(inicio, fim),
+                                     'mais_rapidas (1/10 do período)': lambda: h.mais_rapidas(20, inicio, fim)}
+                        print(f"{'consulta':<36}{'ms':>12}")
+                        for nome, consulta in consultas.items():
+                                print(f"{nome:<36}{melhor_tempo(consulta, args.repeticoes) * 1000:>12.3f}")
+        finally:
+                shutil.rmtree(diretorio)
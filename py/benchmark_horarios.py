@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Benchmark da enumeração de combinações de turmas sem conflito: comparação de strings de dia e hora entre todos os
+# horários (como é feito hoje a partir do JSON) contra as máscaras de horarios.py.
+#
+# São sorteadas --materias matérias de um db.json e enumeradas todas as combinações com uma turma de cada, até
+# --limite combinações. Os dois métodos precisam encontrar as mesmas combinações.
+#
+# Uso:
+#   python benchmark_horarios.py ../db/db.json.gz --materias 8
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+from typing import Any, Dict, Iterator, List
+
+import horarios
+
+def horarios_validos(turma: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [h for h in turma['horario'] or [] if h['inicio'] and h['fim']]
+
+def conflita_strings(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+        return any(x['dia'] == y['dia'] and x['inicio'] < y['fim'] and y['inicio'] < x['fim']
+                   for x in horarios_validos(a) for y in horarios_validos(b))
+
+def combinacoes_strings(grupos: List[List[Dict[str, Any]]]) -> Iterator[List[Any]]:
+        escolhidas: List[Dict[str, Any]] = []
+
+        def buscar(indice: int) -> Iterator[List[Any]]:
+                if indice == len(grupos):
+                        yield [t['codigo'] for t in escolhidas]
+                        return
+                for turma in grupos[indice]:
+                        if not any(conflita_strings(turma, outra) for outra in escolhidas):
+                                escolhidas.append(turma)
+                                yield from buscar(indice + 1)
+                                escolhidas.pop()
+
+        return buscar(0)
+
+def primeiras(iterador: Iterator[List[Any]], limite: int) -> List[List[Any]]:
+        resultado = []
+        for combinacao in iterador:
+                resultado.append(combinacao)
+                if len(resultado) >= limite:
+                        break
+        return resultado
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Benchmark de conflitos de horário com máscaras de bits")
+        parser.add_argument('db', help="db.json ou db.json.gz")
+        parser.add_argument('--materias', help="número de matérias da grade", type=int, default=8)
+        parser.add_argument('--limite', help="número máximo de combinações", type=int, default=200000)
+        parser.add_argument('--semente', help="semente do sorteio das matérias", type=int, default=0)
+        args = parser.parse_args()
+
+        abrir = gzip.open if args.db.endswith('.gz') else open
+        with abrir(args.db, 'rt', encoding='utf-8') as f:
+                materias = [m for m in json.load(f) if len(m['turmas']) > 1]
+        sorteadas = random.Random(args.semente).sample(materias, args.materias)
+        grupos = [m['turmas'] for m in sorteadas]
+        print(f"{len(grupos)} matérias, {' x '.join(str(len(g)) for g in grupos)} turmas")
+
+        t = time.perf_counter()
+        por_strings = primeiras(combinacoes_strings(grupos), args.limite)
+        tempo_strings = time.perf_counter() - t
+
+        t = time.perf_counter()
+        grupos_mascaras = [[(turma['codigo'], horarios.ocupacao(turma)) for turma in grupo] for grupo in grupos]
+        por_mascaras = primeiras(horarios.combinacoes(grupos_mascaras), args.limite)
+        tempo_mascaras = time.perf_counter() - t
+
+        print(f"{'método':<10}{'combinações':>14}{'tempo (s)':>12}")
+        print(f"{'strings':<10}{len(por_strings):>14}{tempo_strings:>12.3f}")
+        print(f"{'máscaras':<10}{len(por_mascaras):>14}{tempo_mascaras:>12.3f}")
+        print(f"speedup: {tempo_strings / tempo_mascaras:.1f}x")
+
+        if por_strings != por_mascaras:
+                print("As combinações encontradas pelos dois métodos são diferentes")
+                sys.exit(1)
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Benchmark do modelo em memória (modelo.py) contra os dicionários usados antes, sobre o catálogo completo: memória
+# ocupada pelas matérias (tracemalloc), tempo de serialização de cada matéria (json.dumps dos dicionários, como antes,
+# e modelo.serializar, com o orjson e com o json da biblioteca padrão) e tamanho e tempo do pickle, que é como as
+# turmas voltam dos processos de análise (--workers).
+#
+# As duas serializações do modelo precisam produzir os mesmos bytes, e o JSON produzido precisa ser o mesmo de antes
+# (json.loads igual); qualquer diferença termina o script com código 1.
+#
+# Uso:
+#   python benchmark_modelo.py ../db/db.json.gz --repeticoes 5
+import gc
+import sys
+import gzip
+import json
+import time
+import pickle
+import argparse
+import tracemalloc
+from typing import Any, Callable, List, Tuple
+
+import modelo
+
+def melhor_tempo(funcao: Callable[[], object], repeticoes: int) -> float:
+        tempos = []
+        for _ in range(repeticoes):
+                t = time.perf_counter()
+                funcao()
+                tempos.append(time.perf_counter() - t)
+        return min(tempos)
+
+# Memória ocupada (bytes) pelo resultado de funcao, depois que os temporários usados para construí-lo foram liberados
+def memoria(funcao: Callable[[], Any]) -> Tuple[Any, int]:
+        gc.collect()
+        tracemalloc.start()
+        antes = tracemalloc.get_traced_memory()[0]
+        resultado = funcao()
+        gc.collect()
+        depois = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return resultado, depois - antes
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Benchmark do modelo em memória contra os dicionários")
+        parser.add_argument('db', help="db.json ou db.json.gz")
+        parser.add_argument('--repeticoes', help="repetições de cada medida (vale o menor tempo)", type=int, default=5)
+        args = parser.parse_args()
+
+        abrir = gzip.open if args.db.endswith('.gz') else open
+        with abrir(args.db, 'rb') as f:
+                # O JSON de cada matéria, como chega da análise de cada página
+                paginas: List[bytes] = [json.dumps(m).encode('utf-8') for m in json.load(f)]
+        print(f"{len(paginas)} matérias, {sum(len(m.turmas) for m in map(modelo.materia_de_dict, map(json.loads, paginas)))} turmas")
+
+        dicionarios, memoria_dicionarios = memoria(lambda: [json.loads(p) for p in paginas])
+        objetos, memoria_objetos = memoria(lambda: [modelo.materia_de_dict(json.loads(p)) for p in paginas])
+        print(f"{'memória (MiB)':<28}{'dicionários':>12}{'modelo':>12}{'redução':>10}")
+        print(f"{'matérias':<28}{memoria_dicionarios / 2**20:>12.1f}{memoria_objetos / 2**20:>12.1f}"
+              f"{1 - memoria_objetos / memoria_dicionarios:>10.1%}")
+
+        serializacoes = {'json.dumps (dicionários)': lambda: [json.dumps(m).encode('utf-8') for m in dicionarios],
+                         'modelo, json': lambda: [modelo._serializar_json(m) for m in objetos]}
+        if modelo.orjson is not None:
+                serializacoes['modelo, orjson'] = lambda: [modelo._serializar_orjson(m) for m in objetos]
+        else:
+                print("orjson não instalado: só a serialização pelo json da biblioteca padrão é medida")
+
+        resultados = {nome: funcao() for nome, funcao in serializacoes.items()}
+        referencia = resultados.pop('json.dumps (dicionários)')
+        for nome, resultado in resultados.items():
+                if resultado != resultados['modelo, json']:
+                        print(f"{nome} não produz os mesmos bytes que modelo, json")
+                        sys.exit(1)
+                if any(json.loads(a) != json.loads(b) for a, b in zip(resultado, referencia)):
+                        print(f"{nome} não produz o mesmo JSON que json.dumps dos dicionários")
+                        sys.exit(1)
+
+        print(f"{'serialização':<28}{'ms':>12}{'bytes':>12}")
+        tamanhos = {'json.dumps (dicionários)': sum(map(len, referencia))}
+        tamanhos.update({nome: sum(map(len, resultado)) for nome, resultado in resultados.items()})
+        for nome, funcao in serializacoes.items():
+                print(f"{nome:<28}{melhor_tempo(funcao, args.repeticoes) * 1000:>12.1f}{tamanhos[nome]:>12}")
+
+        # Uma matéria por vez, como os resultados da análise de cada página
+        print(f"{'pickle (ida e volta)':<28}{'ms':>12}{'bytes':>12}")
+        for nome, valor in (('dicionários', dicionarios), ('modelo', objetos)):
+                tempo = melhor_tempo(lambda: [pickle.loads(pickle.dumps(m, pickle.HIGHEST_PROTOCOL)) for m in valor], args.repeticoes)
+                print(f"{nome:<28}{tempo * 1000:>12.1f}{sum(len(pickle.dumps(m, pickle.HIGHEST_PROTOCOL)) for m in valor):>12}")
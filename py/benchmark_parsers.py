@@ -0,0 +1,185 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Verificação de equivalência e benchmark dos backends de analise_html.py.
+#
+# Para cada {codigo}.json de um diretório db/ (e para cada curso de cursos.json), as páginas do JupiterWeb são
+# reconstruídas com os renderizadores de servidor_jupiter.py e parseadas de novo com cada backend. A saída
+# precisa ser idêntica ao JSON de origem; qualquer diferença é listada e o script termina com código 1.
+#
+# Como as páginas reconstruídas só têm a marcação que servidor_jupiter.py produz, a equivalência vale de fato
+# sobre as páginas reais gravadas com `servidor_jupiter.py gravar`: com --gravadas, cada página do diretório
+# (listas de unidades, disciplinas e cursos, obterTurma, obterDisciplina e listarGradeCurricular) é parseada com
+# cada backend e comparada ao resultado do html5lib, que é o parser original do crawler.
+#
+# Uso:
+#   python benchmark_parsers.py ../db
+#   python benchmark_parsers.py ../db --backends lxml selectolax --limite 500
+#   python servidor_jupiter.py gravar gravadas/ -u 8 16 45 55 76 && python benchmark_parsers.py --gravadas gravadas/
+import re
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from typing import Callable, Dict, List, Any, Tuple
+
+import analise_html
+import modelo
+import parse_usp
+import parse_cursos_usp
+import servidor_jupiter
+
+def carregar(db_dir: Path, limite: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        arquivos = [f for f in sorted(db_dir.glob('*.json')) if re.fullmatch(r'[A-Z0-9]{7}\.json', f.name)]
+        materias = [completar(json.loads(f.read_text())) for f in arquivos[:limite]]
+        cursos_file = db_dir / 'cursos.json'
+        cursos = json.loads(cursos_file.read_text())[:limite] if cursos_file.exists() else []
+        return materias, cursos
+
+# JSONs gravados quando db.json ainda tinha o campo 'ocupacao' (derivado do horário, hoje só no banco SQLite) o
+# perdem para a comparação
+def completar(materia: Dict[str, Any]) -> Dict[str, Any]:
+        for turma in materia['turmas']:
+                turma.pop('ocupacao', None)
+        return materia
+
+def parsear_materia(html_turmas: str, html_disciplina: str, backend: str) -> modelo.Materia:
+        turmas = parse_usp.parsear_turmas(analise_html.tabelas_folha(html_turmas, backend))
+        info = parse_usp.parsear_info_materia(analise_html.tabelas_folha(html_disciplina, backend))
+        info.turmas = turmas
+        return info
+
+def parsear_periodos(html_grade: str, backend: str) -> Dict[str, List[modelo.MateriaCurso]]:
+        for folha in analise_html.tabelas_folha(html_grade, backend):
+                if folha.contem(re.compile(r"Disciplinas\s+Obrigatórias")):
+                        return parse_cursos_usp.parsear_periodos(folha)
+        return None
+
+# Resultado comparável do parser sobre uma página; uma exceção também é um resultado, que os outros backends
+# precisam repetir
+def comparavel(funcao: Callable[[], Any]) -> bytes:
+        try:
+                return modelo.serializar(funcao())
+        except Exception as e:
+                return f"{type(e).__name__}: {e}".encode()
+
+def executar(db_dir: Path, backends: List[str], limite: int) -> int:
+        materias, cursos = carregar(db_dir, limite)
+
+        campi: Dict[str, List[str]] = {}
+        for m in materias:
+                if m['unidade'] not in campi.setdefault(m['campus'], []):
+                        campi[m['campus']].append(m['unidade'])
+        parse_usp.codigos_unidades = servidor_jupiter.atribuir_codigos(campi)
+
+        paginas = [(m, servidor_jupiter.renderizar_turmas(m), servidor_jupiter.renderizar_disciplina(m)) for m in materias]
+        grades = [(c, servidor_jupiter.renderizar_grade(c)) for c in cursos]
+        bytes_total = sum(len(t) + len(d) for _, t, d in paginas) + sum(len(g) for _, g in grades)
+        print(f"{len(materias)} disciplinas e {len(cursos)} cursos ({bytes_total / 2**20:.1f} MiB de HTML)")
+
+        divergencias = 0
+        tempos = {}
+        for backend in backends:
+                t = time.perf_counter()
+                resultados = [parsear_materia(turmas, disciplina, backend) for _, turmas, disciplina in paginas]
+                resultados_cursos = [parsear_periodos(grade, backend) for _, grade in grades]
+                tempos[backend] = time.perf_counter() - t
+
+                for (original, _, _), resultado in zip(paginas, resultados):
+                        if modelo.serializar(resultado) != modelo.serializar(original):
+                                divergencias += 1
+                                print(f"  [{backend}] {original['codigo']} diverge do JSON de origem")
+                for (original, _), periodos in zip(grades, resultados_cursos):
+                        if modelo.carregar(modelo.serializar(periodos)) != original.get('periodos'):
+                                divergencias += 1
+                                print(f"  [{backend}] curso {original['codigo']} diverge do JSON de origem")
+
+        referencia = tempos.get('html5lib')
+        print(f"{'backend':<12}{'tempo (s)':>12}{'páginas/s':>12}{'speedup':>10}")
+        for backend, tempo in tempos.items():
+                n_paginas = 2 * len(paginas) + len(grades)
+                speedup = f"{referencia / tempo:.1f}x" if referencia else '-'
+                print(f"{backend:<12}{tempo:>12.2f}{n_paginas / tempo:>12.0f}{speedup:>10}")
+
+        return 1 if divergencias else 0
+
+# Páginas gravadas com servidor_jupiter.py gravar, como (descrição, html) por tipo de página
+def carregar_gravadas(fixtures: Path, limite: int) -> Dict[str, List[Tuple[str, str]]]:
+        paginas = {}
+        for tipo in servidor_jupiter.PAGINAS[1:]:
+                arquivos = sorted((fixtures / tipo).glob('*.html'))[:limite]
+                paginas[tipo] = [(f"{tipo}/{f.name}", f.read_text(encoding='utf-8')) for f in arquivos]
+        lista = servidor_jupiter.caminho_fixture(fixtures, 'jupColegiadoLista')
+        paginas['jupColegiadoLista'] = [(lista.name, lista.read_text(encoding='utf-8'))] if lista.exists() else []
+        return paginas
+
+# O que os crawlers extraem de cada tipo de página, com o backend dado
+def parsear_gravada(tipo: str, html: str, backend: str) -> Any:
+        if tipo == 'jupColegiadoLista':
+                return analise_html.analisar(html, backend).links("jupColegiadoMenu")
+        if tipo == 'jupDisciplinaLista':
+                return analise_html.analisar(html, backend).links("obterTurma")
+        if tipo == 'jupCursoLista':
+                return analise_html.analisar(html, backend).links_com_linha("listarGradeCurricular")
+        if tipo == 'obterTurma':
+                return parse_usp.parsear_turmas(analise_html.tabelas_folha(html, backend))
+        if tipo == 'obterDisciplina':
+                return parse_usp.parsear_info_materia(analise_html.tabelas_folha(html, backend))
+        return parsear_periodos(html, backend)
+
+def executar_gravadas(fixtures: Path, backends: List[str], limite: int) -> int:
+        paginas = carregar_gravadas(fixtures, limite)
+        if paginas['jupColegiadoLista']:
+                links_unidades = parsear_gravada('jupColegiadoLista', paginas['jupColegiadoLista'][0][1], 'html5lib')
+                parse_usp.codigos_unidades = {texto: re.search(r"codcg=(\d+)", href).group(1) for href, texto in links_unidades}
+        n_paginas = sum(len(p) for p in paginas.values())
+        bytes_total = sum(len(html) for p in paginas.values() for _, html in p)
+        print(f"{n_paginas} páginas gravadas ({bytes_total / 2**20:.1f} MiB de HTML): "
+              + ", ".join(f"{len(p)} {tipo}" for tipo, p in paginas.items()))
+        if not n_paginas:
+                print(f"Nenhuma página gravada em {fixtures}")
+                return 1
+
+        # O html5lib é a referência, então roda primeiro e sempre, mesmo que não esteja entre os backends pedidos
+        divergencias = 0
+        tempos = {}
+        referencia = None
+        for backend in ['html5lib'] + [b for b in backends if b != 'html5lib']:
+                t = time.perf_counter()
+                resultados = {tipo: [comparavel(lambda: parsear_gravada(tipo, html, backend)) for _, html in p] for tipo, p in paginas.items()}
+                if backend in backends:
+                        tempos[backend] = time.perf_counter() - t
+
+                if referencia is None:
+                        referencia = resultados
+                        continue
+                for tipo, p in paginas.items():
+                        for (nome, _), esperado, obtido in zip(p, referencia[tipo], resultados[tipo]):
+                                if obtido != esperado:
+                                        divergencias += 1
+                                        print(f"  [{backend}] {nome} diverge do html5lib")
+
+        html5lib = tempos.get('html5lib')
+        print(f"{'backend':<12}{'tempo (s)':>12}{'páginas/s':>12}{'speedup':>10}")
+        for backend, tempo in tempos.items():
+                speedup = f"{html5lib / tempo:.1f}x" if html5lib else '-'
+                print(f"{backend:<12}{tempo:>12.2f}{n_paginas / tempo:>12.0f}{speedup:>10}")
+
+        return 1 if divergencias else 0
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Equivalência e benchmark dos backends de HTML do crawler MatrUSP")
+        parser.add_argument('db_dir', help="diretório com {codigo}.json e cursos.json de referência", nargs='?')
+        parser.add_argument('--gravadas', help="comparar os backends ao html5lib nas páginas reais gravadas neste diretório "
+                                               "(com servidor_jupiter.py gravar), em vez de reconstruí-las de db_dir")
+        parser.add_argument('--backends', help="backends a comparar", nargs='+', choices=list(analise_html.BACKENDS),
+                            default=[b for b in reversed(analise_html.PREFERENCIA) if b in analise_html.BACKENDS])
+        parser.add_argument('--limite', help="número máximo de disciplinas/cursos (com --gravadas, de páginas de cada tipo)",
+                            type=int, default=sys.maxsize)
+        args = parser.parse_args()
+
+        if args.gravadas:
+                sys.exit(executar_gravadas(Path(args.gravadas), args.backends, args.limite))
+        if not args.db_dir:
+                parser.error("informe db_dir ou --gravadas")
+        sys.exit(executar(Path(args.db_dir), args.backends, args.limite))
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Catálogo compacto (db/db.compacto.json): o mesmo conteúdo de db.json, em colunas e com os textos repetidos
+# (unidades, departamentos, campi, tipos de turma, dias, datas, professores, grupos de vagas) guardados uma única vez.
+# O JSON é gravado em UTF-8 e sem espaços, como db.json. decodificar (e decodeCompact, em js/dbupdate.js)
+# reconstrói exatamente a lista de matérias de db.json, com os mesmos campos na mesma ordem.
+#
+# Formato:
+#   {"formato": "matrusp-compacto", "versao": 1,
+#    "textos": [texto, ...],                        textos repetidos, do mais ao menos frequente
+#    "tabelas": {nome: tabela, ...}}                 "materias" é a tabela principal
+# Cada tabela guarda, coluna a coluna, as linhas de um tipo de objeto (materias, turmas, horarios, vagas, grupos):
+#   {"linhas": N,
+#    "formas": [[campo, ...], ...],                  os campos de cada forma de objeto, na ordem original
+#    "forma": [i, ...],                              a forma de cada linha (null: a linha é null); ausente se só há uma
+#    "colunas": {campo: [valor, ...]},               os valores do campo nas linhas que o têm, na ordem das linhas
+#    "referencias": [campo, ...],                    colunas de textos: nelas, um número é o índice do texto em "textos"
+#    "filhos": {campo: ["lista" | "mapa", tabela]}}
+# Um campo filho guarda o número de elementos (ou null), e os elementos são as próximas linhas da tabela filha; num
+# mapa ({chave: objeto}, como as vagas), a chave de cada elemento fica na coluna CHAVE da tabela filha. Uma tabela sem
+# "formas" é de valores simples (os professores de cada horário), na coluna VALOR.
+#
+# Gravado por parse_usp.py junto com db.json com --compacto, e também como snapshot das versões (ver versoes.py),
+# que é de onde o cliente o baixa quando versao.json o anuncia. A codificação monta todas as colunas em memória.
+#
+# Uso: python compacto.py ../db/db.json.gz [-o db.compacto.json]       codificar
+#      python compacto.py db.compacto.json --decodificar [-o db.json]   decodificar
+import sys
+import gzip
+import json
+import argparse
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import saida
+import modelo
+
+FORMATO = 'matrusp-compacto'
+VERSAO = 1
+
+ARQUIVO = 'db.compacto.json'
+
+CHAVE = '@chave'
+VALOR = '@valor'
+
+# Campos que são listas ou mapas de objetos, e a tabela de seus elementos. Os demais campos são guardados como estão.
+ESQUEMA: Dict[str, Optional[Dict[str, Tuple[str, str]]]] = {
+        'materias': {'turmas': ('lista', 'turmas')},
+        'turmas': {'horario': ('lista', 'horarios'), 'vagas': ('mapa', 'vagas')},
+        'horarios': {'professores': ('lista', 'professores')},
+        'vagas': {'grupos': ('mapa', 'grupos')},
+        'grupos': {},
+        'professores': None,
+}
+
+class _Tabela:
+        def __init__(self, filhos: Optional[Dict[str, Tuple[str, str]]]):
+                self.filhos = filhos
+                self.linhas = 0
+                self.formas: Dict[Tuple[str, ...], int] = {}
+                self.forma: List[Optional[int]] = []
+                self.colunas: Dict[str, List[Any]] = {}
+
+        def coluna(self, campo: str) -> List[Any]:
+                return self.colunas.setdefault(campo, [])
+
+def _acrescentar(tabelas: Dict[str, _Tabela], nome: str, valor: Any, chave: Optional[str] = None) -> None:
+        tabela = tabelas[nome]
+        tabela.linhas += 1
+        if chave is not None:
+                tabela.coluna(CHAVE).append(chave)
+        if tabela.filhos is None:
+                tabela.coluna(VALOR).append(valor)
+                return
+        if valor is None:
+                tabela.forma.append(None)
+                return
+        if not isinstance(valor, dict):
+                raise ValueError(f"{nome}: esperado um objeto, encontrado {type(valor).__name__}")
+        tabela.forma.append(tabela.formas.setdefault(tuple(valor), len(tabela.formas)))
+        for campo, conteudo in valor.items():
+                filho = tabela.filhos.get(campo)
+                if filho is None or conteudo is None:
+                        tabela.coluna(campo).append(conteudo)
+                elif filho[0] == 'lista' and isinstance(conteudo, list):
+                        tabela.coluna(campo).append(len(conteudo))
+                        for elemento in conteudo:
+                                _acrescentar(tabelas, filho[1], elemento)
+                elif filho[0] == 'mapa' and isinstance(conteudo, dict):
+                        tabela.coluna(campo).append(len(conteudo))
+                        for chave_elemento, elemento in conteudo.items():
+                                _acrescentar(tabelas, filho[1], elemento, chave_elemento)
+                else:
+                        raise ValueError(f"{nome}.{campo}: esperado {filho[0]}, encontrado {type(conteudo).__name__}")
+
+def _coluna_de_textos(valores: List[Any]) -> bool:
+        return any(isinstance(v, str) for v in valores) and all(v is None or isinstance(v, str) for v in valores)
+
+# Codifica as matérias (na ordem dada, como em db.json) no formato compacto
+def codificar(materias: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        tabelas = {nome: _Tabela(filhos) for nome, filhos in ESQUEMA.items()}
+        for materia in materias:
+                _acrescentar(tabelas, 'materias', materia)
+
+        # Só os textos que se repetem vão para a tabela; os únicos (nomes, objetivos, ...) ficam na própria coluna
+        referencias = {nome: [campo for campo, valores in tabela.colunas.items() if _coluna_de_textos(valores)]
+                       for nome, tabela in tabelas.items()}
+        frequencia = Counter(v for nome, campos in referencias.items() for campo in campos
+                             for v in tabelas[nome].colunas[campo] if v is not None)
+        textos = sorted((t for t, n in frequencia.items() if n > 1), key=lambda t: (-frequencia[t], t))
+        indices = {t: i for i, t in enumerate(textos)}
+
+        saida: Dict[str, Any] = {}
+        for nome, tabela in tabelas.items():
+                colunas = {campo: [indices.get(v, v) for v in valores] if campo in referencias[nome] else valores
+                           for campo, valores in tabela.colunas.items()}
+                descricao: Dict[str, Any] = {'linhas': tabela.linhas}
+                if tabela.filhos is not None:
+                        descricao['formas'] = [list(forma) for forma in tabela.formas]
+                        if len(tabela.formas) != 1 or None in tabela.forma:
+                                descricao['forma'] = tabela.forma
+                        descricao['filhos'] = {campo: list(filho) for campo, filho in tabela.filhos.items()}
+                descricao['colunas'] = colunas
+                descricao['referencias'] = referencias[nome]
+                saida[nome] = descricao
+        return {'formato': FORMATO, 'versao': VERSAO, 'textos': textos, 'tabelas': saida}
+
+def serializar(compacto: Dict[str, Any]) -> bytes:
+        return json.dumps(compacto, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+class _Leitor:
+        def __init__(self, tabela: Dict[str, Any], textos: List[str]):
+                referencias = set(tabela['referencias'])
+                self.colunas = {campo: iter([textos[v] if isinstance(v, int) else v for v in valores] if campo in referencias else valores)
+                                for campo, valores in tabela['colunas'].items()}
+                self.formas: Optional[List[List[str]]] = tabela.get('formas')
+                self.forma = iter(tabela['forma']) if 'forma' in tabela else None
+                self.filhos: Dict[str, List[str]] = tabela.get('filhos', {})
+
+def _ler(leitores: Dict[str, _Leitor], nome: str) -> Any:
+        leitor = leitores[nome]
+        if leitor.formas is None:
+                return next(leitor.colunas[VALOR])
+        forma = next(leitor.forma) if leitor.forma is not None else 0
+        if forma is None:
+                return None
+        objeto = {}
+        for campo in leitor.formas[forma]:
+                valor = next(leitor.colunas[campo])
+                filho = leitor.filhos.get(campo)
+                if filho is not None and valor is not None:
+                        tipo, tabela = filho
+                        if tipo == 'lista':
+                                valor = [_ler(leitores, tabela) for _ in range(valor)]
+                        else:
+                                chaves = leitores[tabela].colunas[CHAVE]
+                                valor = {next(chaves): _ler(leitores, tabela) for _ in range(valor)}
+                objeto[campo] = valor
+        return objeto
+
+# Reconstrói a lista de matérias de db.json a partir do formato compacto
+def decodificar(compacto: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if compacto.get('formato') != FORMATO or compacto.get('versao') != VERSAO:
+                raise ValueError(f"formato desconhecido: {compacto.get('formato')} {compacto.get('versao')}")
+        leitores = {nome: _Leitor(tabela, compacto['textos']) for nome, tabela in compacto['tabelas'].items()}
+        return [_ler(leitores, 'materias') for _ in range(compacto['tabelas']['materias']['linhas'])]
+
+def carregar(caminho: str) -> Any:
+        abrir = gzip.open if caminho.endswith('.gz') else open
+        with abrir(caminho, 'rb') as f:
+                return json.load(f)
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Codifica db.json no formato compacto, ou o decodifica")
+        parser.add_argument('entrada', help="db.json, db.compacto.json (ou .gz)")
+        parser.add_argument('--decodificar', help="decodificar o formato compacto", action='store_true')
+        parser.add_argument('-o', '--saida', help="arquivo de saída (padrão: a saída padrão)")
+        args = parser.parse_args()
+
+        entrada = carregar(args.entrada)
+        if args.decodificar:
+                dados = b''.join(saida.lista_json(modelo.serializar(m) for m in decodificar(entrada)))
+        else:
+                dados = serializar(codificar(entrada))
+        if args.saida:
+                with open(args.saida, 'wb') as f:
+                        f.write(dados)
+        else:
+                sys.stdout.buffer.write(dados)
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Diário de progresso do crawler (db/diario.jsonl), para que uma execução interrompida (falta de memória, queda da
+# rede, Ctrl-C) possa ser retomada com --resume sem baixar de novo o que já foi concluído.
+#
+# Cada linha é um registro JSON, acrescentado ao arquivo assim que o evento acontece:
+#   {"inicio": "2026-10-18T00:00:00", "url_base": "...", "unidades": null}      início da execução
+#   {"unidade": "45", "materias": [["MAC0110", "Introdução à Computação"], ...]}  lista da unidade: matérias pendentes
+#   {"materia": "MAC0110", "estado": "ok"}         concluída; db/MAC0110.json já está gravado
+#   {"materia": "MAC0110", "estado": "ignorada"}   sem turmas ou sem informações no JupiterWeb
+#   {"materia": "MAC0110", "estado": "falha"}      será obtida de novo na retomada
+# O último registro de cada matéria prevalece. Uma linha incompleta no fim (o processo morreu no meio da escrita) é
+# descartada. O diário é removido ao fim de uma execução sem falhas.
+import json
+import time
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger('log')
+
+ARQUIVO_DIARIO = 'diario.jsonl'
+
+CONCLUIDA = 'ok'
+IGNORADA = 'ignorada'
+FALHA = 'falha'
+
+class Diario:
+        # Com retomar, o diário existente é lido e continua a ser escrito, desde que tenha sido criado com os mesmos
+        # parâmetros (url_base, unidades, ...); caso contrário, começa vazio.
+        def __init__(self, diretorio: Union[str, Path], retomar: bool = False, **parametros: Any):
+                self.caminho = Path(diretorio) / ARQUIVO_DIARIO
+                self.unidades: Dict[str, List[Tuple[str, str]]] = {}
+                self.estados: Dict[str, str] = {}
+                retomado = retomar and self._ler(parametros)
+                self._arquivo = open(self.caminho, 'a' if retomado else 'w', encoding='utf-8')
+                if not retomado:
+                        self._registrar(dict(inicio=time.strftime('%Y-%m-%dT%H:%M:%S'), **parametros))
+
+        # Lê o diário e devolve se ele pode ser retomado. Descarta a linha incompleta do fim, se houver, para que os
+        # próximos registros comecem numa linha nova.
+        def _ler(self, parametros: Dict[str, Any]) -> bool:
+                try:
+                        dados = self.caminho.read_bytes()
+                except FileNotFoundError:
+                        return False
+
+                linhas = dados.split(b'\n')
+                completas = linhas[:-1]
+                try:
+                        registros = [json.loads(linha) for linha in completas]
+                except ValueError:
+                        logger.warning(f" -   Diário {self.caminho} inválido, a execução começará do início")
+                        return False
+                if not registros or any(registros[0].get(chave) != valor for chave, valor in parametros.items()):
+                        logger.warning(f" -   Diário {self.caminho} é de uma execução com outros parâmetros, a execução começará do início")
+                        return False
+                if linhas[-1]:
+                        with open(self.caminho, 'r+b') as f:
+                                f.truncate(len(dados) - len(linhas[-1]))
+
+                for registro in registros[1:]:
+                        if 'unidade' in registro:
+                                self.unidades[registro['unidade']] = [tuple(m) for m in registro['materias']]
+                        elif 'materia' in registro:
+                                self.estados[registro['materia']] = registro['estado']
+                return True
+
+        # Cada registro é descarregado no sistema operacional imediatamente: se o processo morrer, o que foi
+        # registrado continua no arquivo
+        def _registrar(self, registro: Dict[str, Any]) -> None:
+                self._arquivo.write(json.dumps(registro, ensure_ascii=False) + '\n')
+                self._arquivo.flush()
+
+        # Matérias da unidade, como (codigo, nome), se a lista da unidade já foi obtida
+        def materias_unidade(self, codigo: str) -> Optional[List[Tuple[str, str]]]:
+                return self.unidades.get(codigo)
+
+        def registrar_unidade(self, codigo: str, materias: List[Tuple[str, str]]) -> None:
+                self.unidades[codigo] = materias
+                self._registrar({'unidade': codigo, 'materias': materias})
+
+        def estado(self, codigo: str) -> Optional[str]:
+                return self.estados.get(codigo)
+
+        def registrar_materia(self, codigo: str, estado: str) -> None:
+                self.estados[codigo] = estado
+                self._registrar({'materia': codigo, 'estado': estado})
+
+        # Número de matérias em cada estado
+        def resumo(self) -> Dict[str, int]:
+                contagem = {CONCLUIDA: 0, IGNORADA: 0, FALHA: 0}
+                for estado in self.estados.values():
+                        contagem[estado] = contagem.get(estado, 0) + 1
+                return contagem
+
+        # Fecha o diário; com remover (execução concluída), apaga o arquivo
+        def fechar(self, remover: bool = False) -> None:
+                self._arquivo.close()
+                if remover:
+                        self.caminho.unlink(missing_ok=True)
@@ -22,6 +22,11 @@
             python3Packages.aiodns
             python3Packages.multi-key-dict
             python3Packages.python-dateutil
+            python3Packages.lxml
+            python3Packages.selectolax
+            python3Packages.brotli
+            python3Packages.zstandard
+            python3Packages.orjson
 
           ];
 
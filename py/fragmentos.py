@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Banco de dados dividido por campus (e, opcionalmente, por unidade), para que um cliente carregue só as matérias
+# do seu campus e cada parte seja atualizada independentemente das outras.
+#
+# Arquivos em db/fragmentos/ (todos também pré-compactados, nos formatos de saida.Compressao):
+#   {campus}.json            matérias do campus, no formato de db.json (ex.: ribeirao-preto.json)
+#   busca-{campus}.json      índice de busca dessas matérias (ver indice_busca.py)
+#   unidade-{codigo}.json    matérias da unidade, com --fragmentos-unidades
+#   manifesto.json           hash, número de matérias e tamanhos de cada fragmento:
+#     {"campi": {"Ribeirão Preto": {"arquivo": "ribeirao-preto.json", "busca": "busca-ribeirao-preto.json",
+#                                   "materias": 540, "bytes": ..., "bytes_gz": ..., "bytes_br": ..., "hash": "...",
+#                                   "unidades": ["Faculdade de Medicina de Ribeirão Preto", ...]}, ...},
+#      "unidades": {"Faculdade de Medicina de Ribeirão Preto": {"codigo": "17", "campus": "Ribeirão Preto",
+#                   "arquivo": "unidade-17.json", "materias": ..., "bytes": ..., "bytes_gz": ..., "hash": "..."}}}
+#
+# Os fragmentos são gravados pelo manifesto de saida.py, então só os que mudaram são reescritos, e por partes, a
+# partir das matérias acumuladas em disco (saida.Acumulador).
+import re
+import json
+import unicodedata
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+import saida
+import indice_busca
+
+DIRETORIO_FRAGMENTOS = 'fragmentos'
+
+# "Ribeirão Preto" -> "ribeirao-preto"
+def nome_arquivo(texto: str) -> str:
+        texto = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii')
+        return re.sub(r'[^a-z0-9]+', '-', texto.lower()).strip('-') or 'outro'
+
+class Fragmentos:
+        def __init__(self, manifesto: saida.Manifesto, por_unidade: bool = False):
+                self.manifesto = manifesto
+                self.por_unidade = por_unidade
+                self.diretorio = manifesto.diretorio / DIRETORIO_FRAGMENTOS
+
+        def _gravar(self, arquivo: str, partes: Callable[[], Iterable[bytes]]) -> Dict[str, Any]:
+                nome = f"{DIRETORIO_FRAGMENTOS}/{arquivo}"
+                self.manifesto.gravar_partes(nome, partes)
+                descricao = {'arquivo': arquivo, 'bytes': (self.diretorio / arquivo).stat().st_size, 'hash': self.manifesto.hashes[nome]}
+                for formato in self.manifesto.compressao.formatos():
+                        descricao[f'bytes_{formato}'] = (self.diretorio / f"{arquivo}.{formato}").stat().st_size
+                return descricao
+
+        # Partes do array JSON das matérias com os códigos dados
+        @staticmethod
+        def _lista(materias: saida.Acumulador, codigos: List[str]) -> Callable[[], Iterable[bytes]]:
+                return lambda: saida.lista_json(materias.ler(c) for c in codigos)
+
+        # Grava os fragmentos das matérias (o JSON de cada uma, por código, como em db.json), dado o campus e o
+        # nome da unidade de cada uma. codigos_unidades é o dicionário nome da unidade -> código de parse_usp.py.
+        # Com remover_antigos, fragmentos de campi e unidades que não existem mais são removidos.
+        def gravar(self, materias: saida.Acumulador, localizacao: Dict[str, Tuple[str, str]],
+                   codigos_unidades: Dict[str, str], remover_antigos: bool = True) -> Dict[str, Any]:
+                self.diretorio.mkdir(parents=True, exist_ok=True)
+
+                # Códigos de cada campus e unidade, na ordem de db.json
+                por_campus: Dict[str, List[str]] = {}
+                por_unidade: Dict[str, List[str]] = {}
+                for codigo in materias.chaves():
+                        campus, unidade = localizacao[codigo]
+                        por_campus.setdefault(campus, []).append(codigo)
+                        por_unidade.setdefault(unidade, []).append(codigo)
+                unidades_campus: Dict[str, Dict[str, None]] = {}
+                for campus, unidade in localizacao.values():
+                        unidades_campus.setdefault(campus, {})[unidade] = None
+
+                descricao: Dict[str, Any] = {'campi': {}, 'unidades': {}}
+                for campus, lista in sorted(por_campus.items()):
+                        arquivo = nome_arquivo(campus)
+                        # O índice de busca de cada campus tem os pesos calculados só sobre as matérias do campus,
+                        # como o cliente os calcularia se carregasse apenas este fragmento
+                        busca = json.dumps(indice_busca.gerar(json.loads(materias.ler(c)) for c in lista), separators=(',', ':')).encode('utf-8')
+                        descricao['campi'][campus] = dict(self._gravar(f"{arquivo}.json", self._lista(materias, lista)), materias=len(lista),
+                                                          busca=self._gravar(f"busca-{arquivo}.json", lambda: [busca])['arquivo'],
+                                                          unidades=sorted(unidades_campus[campus]))
+
+                if self.por_unidade:
+                        for unidade, lista in sorted(por_unidade.items()):
+                                codigo = codigos_unidades.get(unidade) or nome_arquivo(unidade)
+                                campus = next(c for c, u in unidades_campus.items() if unidade in u)
+                                descricao['unidades'][unidade] = dict(self._gravar(f"unidade-{codigo}.json", self._lista(materias, lista)),
+                                                                      codigo=codigo, campus=campus, materias=len(lista))
+
+                if remover_antigos:
+                        atuais = {f"{DIRETORIO_FRAGMENTOS}/manifesto.json"}
+                        atuais |= {f"{DIRETORIO_FRAGMENTOS}/{d['arquivo']}" for d in descricao['campi'].values()}
+                        atuais |= {f"{DIRETORIO_FRAGMENTOS}/{d['busca']}" for d in descricao['campi'].values()}
+                        atuais |= {f"{DIRETORIO_FRAGMENTOS}/{d['arquivo']}" for d in descricao['unidades'].values()}
+                        for nome in list(self.manifesto.hashes):
+                                if nome.startswith(DIRETORIO_FRAGMENTOS + '/') and nome not in atuais:
+                                        self.manifesto.remover(nome)
+
+                self.manifesto.gravar(f"{DIRETORIO_FRAGMENTOS}/manifesto.json", json.dumps(descricao, indent=1, ensure_ascii=False))
+                return descricao
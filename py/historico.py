@@ -0,0 +1,360 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Histórico das vagas entre execuções: cada execução do crawler sobrescreve as vagas das turmas, e este histórico
+# guarda como elas mudaram ao longo do período de matrícula, de forma compacta e só por acréscimo.
+#
+# Cada chave (matéria, turma, tipo de vaga, grupo) tem uma série de observações (tempo, vagas, inscritos, pendentes,
+# matriculados). O grupo "" é o total do tipo de vaga. Só as mudanças são gravadas: uma observação igual à anterior
+# da mesma chave não gera linha, então o custo de cada execução é proporcional às linhas que mudaram, e não ao
+# catálogo.
+#
+# Formato (diretório; inteiros na ordem de bytes little-endian):
+#   historico.json   gravado por último a cada acréscimo: formato, versão e os números de linhas e de chaves. O que
+#                    estiver nos outros arquivos além desses números (um acréscimo interrompido) é descartado.
+#   chaves.jsonl     uma chave por linha, [materia, turma, tipo, grupo]; o número da linha é o id da chave
+#   ultima.i32       para cada id de chave, a sua linha mais recente
+#   colunas, uma linha por mudança, na ordem do tempo:
+#     tempo.i64      quando foi observada (Unix, segundos)
+#     chave.i32      id da chave
+#     anterior.i32   linha anterior da mesma chave (-1 na primeira)
+#     vagas.i32, inscritos.i32, pendentes.i32, matriculados.i32
+#
+# As colunas são lidas por mmap. A série de uma chave é percorrida de ultima.i32 para trás, por anterior.i32, só pelas
+# suas linhas; um intervalo de tempo é localizado por busca binária em tempo.i64 e só as suas linhas são lidas.
+#
+# Alimentado por parse_usp.py --historico (com ou sem --vagas), a cada página obterTurma analisada. O diretório padrão,
+# db/historico, não é publicado com o site (ver db/.htaccess) nem versionado.
+#
+# Uso: python historico.py DIRETORIO                                      resumo do histórico
+#      python historico.py DIRETORIO --serie MATERIA [TURMA]              série de cada chave das turmas da matéria
+#      python historico.py DIRETORIO --mais-rapidas [N] [--desde DATA] [--ate DATA] [--grupos]
+#           as N turmas (tipos de vaga) que lotaram mais rápido no período
+import sys
+import mmap
+import json
+import time
+import array
+import logging
+import argparse
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import modelo
+import saida
+
+logger = logging.getLogger('log')
+
+FORMATO = 'matrusp-historico-vagas'
+VERSAO = 1
+
+DIRETORIO_PADRAO = 'historico'
+ARQUIVO_DESCRICAO = 'historico.json'
+ARQUIVO_CHAVES = 'chaves.jsonl'
+ARQUIVO_ULTIMA = 'ultima.i32'
+
+# Colunas, com o typecode de array de cada uma
+COLUNAS = {'tempo': 'q', 'chave': 'i', 'anterior': 'i', 'vagas': 'i', 'inscritos': 'i', 'pendentes': 'i', 'matriculados': 'i'}
+VALORES = ('vagas', 'inscritos', 'pendentes', 'matriculados')
+
+class Chave(NamedTuple):
+        materia: str
+        turma: str
+        tipo: str
+        grupo: str
+
+class Observacao(NamedTuple):
+        tempo: int
+        vagas: int
+        inscritos: int
+        pendentes: int
+        matriculados: int
+
+# Uma chave que lotou no período: quando foi observada pela primeira vez, quando lotou e quanto tempo levou
+class Lotacao(NamedTuple):
+        chave: Chave
+        inicio: int
+        lotacao: int
+        segundos: int
+
+def _arquivo_coluna(nome: str) -> str:
+        return f"{nome}.{'i64' if COLUNAS[nome] == 'q' else 'i32'}"
+
+# Observações (chave, valores) das vagas das turmas de uma matéria: o total de cada tipo de vaga e cada grupo
+def observacoes(codigo: str, turmas: Iterable[modelo.Turma]) -> Iterator[Tuple[Chave, Tuple[int, int, int, int]]]:
+        for turma in turmas:
+                if turma.codigo is None or not turma.vagas:
+                        continue
+                for tipo, vagas in turma.vagas.items():
+                        yield Chave(codigo, turma.codigo, tipo, ''), (vagas.vagas, vagas.inscritos, vagas.pendentes, vagas.matriculados)
+                        for grupo, g in vagas.grupos.items():
+                                yield Chave(codigo, turma.codigo, tipo, grupo), (g.vagas, g.inscritos, g.pendentes, g.matriculados)
+
+# Arquivo de inteiros mapeado na memória, como uma sequência de typecode; vazio se o arquivo não existe ou está vazio
+class _Mapeado:
+        def __init__(self, caminho: Path, typecode: str, itens: int):
+                self._arquivo = None
+                self._dados = None
+                self.valores: memoryview = memoryview(array.array(typecode))
+                tamanho = itens * array.array(typecode).itemsize
+                if tamanho == 0:
+                        return
+                self._arquivo = open(caminho, 'rb')
+                try:
+                        self._dados = mmap.mmap(self._arquivo.fileno(), tamanho, access=mmap.ACCESS_READ)
+                except (ValueError, OSError):
+                        self._arquivo.close()
+                        raise ValueError(f"{caminho} é menor que o descrito em {ARQUIVO_DESCRICAO}")
+                self._bytes = memoryview(self._dados)
+                self.valores = self._bytes.cast(typecode)
+
+        def fechar(self) -> None:
+                self.valores.release()
+                if self._dados is not None:
+                        self._bytes.release()
+                        self._dados.close()
+                        self._arquivo.close()
+
+def _ler_descricao(diretorio: Path) -> Dict[str, int]:
+        try:
+                descricao = json.loads((diretorio / ARQUIVO_DESCRICAO).read_bytes())
+        except FileNotFoundError:
+                return {'linhas': 0, 'chaves': 0}
+        if descricao.get('formato') != FORMATO or descricao.get('versao') != VERSAO:
+                raise ValueError(f"{diretorio / ARQUIVO_DESCRICAO}: formato desconhecido")
+        return descricao
+
+# As n primeiras chaves de chaves.jsonl, e o tamanho em bytes das linhas lidas
+def _ler_chaves(diretorio: Path, n: int) -> Tuple[List[Chave], int]:
+        if n == 0:
+                return [], 0
+        linhas = (diretorio / ARQUIVO_CHAVES).read_bytes().split(b'\n', n)[:n]
+        if len(linhas) < n or not linhas[-1]:
+                raise ValueError(f"{diretorio / ARQUIVO_CHAVES} tem menos chaves que o descrito em {ARQUIVO_DESCRICAO}")
+        chaves = [Chave(*map(sys.intern, campos)) for campos in modelo.carregar(b'[' + b','.join(linhas) + b']')]
+        return chaves, sum(map(len, linhas)) + n
+
+class Historico:
+        def __init__(self, diretorio: Union[str, Path]):
+                if sys.byteorder != 'little':
+                        raise ValueError("o histórico de vagas só pode ser lido em máquinas little-endian")
+                self.diretorio = Path(diretorio)
+                descricao = _ler_descricao(self.diretorio)
+                self.linhas: int = descricao['linhas']
+                self.chaves, tamanho_chaves = _ler_chaves(self.diretorio, descricao['chaves'])
+                self._preparar(tamanho_chaves)
+                self.ids: Dict[Chave, int] = {chave: i for i, chave in enumerate(self.chaves)}
+                self._abrir()
+
+        def _preparar(self, tamanho_chaves: int) -> None:
+                pass
+
+        def _abrir(self) -> None:
+                self._mapeados = {nome: _Mapeado(self.diretorio / _arquivo_coluna(nome), typecode, self.linhas) for nome, typecode in COLUNAS.items()}
+                self._mapeados['ultima'] = _Mapeado(self.diretorio / ARQUIVO_ULTIMA, 'i', len(self.chaves))
+                self._colunas = {nome: mapeado.valores for nome, mapeado in self._mapeados.items()}
+
+        def __enter__(self) -> 'Historico':
+                return self
+
+        def __exit__(self, *excecao) -> None:
+                self.fechar()
+
+        def __len__(self) -> int:
+                return self.linhas
+
+        def _observacao(self, linha: int) -> Observacao:
+                c = self._colunas
+                return Observacao(c['tempo'][linha], c['vagas'][linha], c['inscritos'][linha], c['pendentes'][linha], c['matriculados'][linha])
+
+        def tempo(self, linha: int) -> int:
+                return self._colunas['tempo'][linha]
+
+        # Linhas [inicial, final) com tempo em [inicio, fim]
+        def intervalo(self, inicio: Optional[int] = None, fim: Optional[int] = None) -> range:
+                tempos = self._colunas['tempo']
+                inicial = 0 if inicio is None else bisect_left(tempos, inicio)
+                final = self.linhas if fim is None else bisect_right(tempos, fim)
+                return range(inicial, max(inicial, final))
+
+        # Chaves das turmas de uma matéria (ou de uma turma), na ordem em que apareceram
+        def chaves_de(self, materia: str, turma: Optional[str] = None) -> List[Chave]:
+                return [chave for chave in self.chaves if chave.materia == materia and (turma is None or chave.turma == turma)]
+
+        # Observações da chave em [inicio, fim], em ordem de tempo. A primeira é a que estava valendo em inicio, que
+        # pode ter sido observada antes, já que só as mudanças são gravadas.
+        def serie(self, chave: Chave, inicio: Optional[int] = None, fim: Optional[int] = None) -> List[Observacao]:
+                i = self.ids.get(chave)
+                if i is None:
+                        return []
+                c = self._colunas
+                resultado = []
+                linha = c['ultima'][i]
+                while linha >= 0:
+                        tempo = c['tempo'][linha]
+                        if fim is None or tempo <= fim:
+                                resultado.append(self._observacao(linha))
+                        if inicio is not None and tempo <= inicio:
+                                break
+                        linha = c['anterior'][linha]
+                resultado.reverse()
+                return resultado
+
+        # Chaves que lotaram no período, da mais rápida para a mais lenta: o tempo entre a primeira observação da
+        # chave no período e a primeira em que campo (inscritos, por padrão) chegou às vagas. Chaves que já estavam
+        # lotadas na primeira observação não contam, já que não se sabe quando lotaram. Sem grupos, só os totais de
+        # cada tipo de vaga. Só as linhas do período são lidas.
+        def mais_rapidas(self, n: Optional[int] = None, inicio: Optional[int] = None, fim: Optional[int] = None, campo: str = 'inscritos',
+                         grupos: bool = False) -> List[Lotacao]:
+                c = self._colunas
+                chaves, vagas, ocupadas, tempos = c['chave'], c['vagas'], c[campo], c['tempo']
+                primeira: Dict[int, int] = {}
+                lotacoes: Dict[int, int] = {}
+                for linha in self.intervalo(inicio, fim):
+                        i = chaves[linha]
+                        if i in lotacoes or (not grupos and self.chaves[i].grupo):
+                                continue
+                        lotada = vagas[linha] > 0 and ocupadas[linha] >= vagas[linha]
+                        if i not in primeira:
+                                primeira[i] = -1 if lotada else tempos[linha]
+                        elif lotada and primeira[i] >= 0:
+                                lotacoes[i] = tempos[linha]
+                resultado = sorted((Lotacao(self.chaves[i], primeira[i], lotacao, lotacao - primeira[i]) for i, lotacao in lotacoes.items()),
+                                   key=lambda l: (l.segundos, l.chave))
+                return resultado if n is None else resultado[:n]
+
+        def fechar(self) -> None:
+                for mapeado in self._mapeados.values():
+                        mapeado.fechar()
+                self._colunas = {}
+
+# Acrescenta observações ao histórico. As linhas novas ficam na memória até concluir, que as grava: primeiro as
+# colunas, as chaves e ultima.i32, depois historico.json. Um acréscimo interrompido é descartado ao abrir de novo.
+class EscritorHistorico(Historico):
+        def __init__(self, diretorio: Union[str, Path]):
+                Path(diretorio).mkdir(parents=True, exist_ok=True)
+                super().__init__(diretorio)
+                if len(self.chaves) and max(self._colunas['ultima']) >= self.linhas:
+                        self._reconstruir_ultima()
+                self._novas: Dict[str, array.array] = {nome: array.array(typecode) for nome, typecode in COLUNAS.items()}
+                self._novas_chaves: List[Chave] = []
+                # Linha mais recente, já contando as linhas novas, das chaves que mudaram nesta execução
+                self._ultimas: Dict[int, int] = {}
+                self._tempo = self._colunas['tempo'][-1] if self.linhas else 0
+
+        # Descarta o que um acréscimo interrompido deixou além do descrito em historico.json, antes de mapear as colunas
+        def _preparar(self, tamanho_chaves: int) -> None:
+                tamanhos = {_arquivo_coluna(nome): self.linhas * array.array(typecode).itemsize for nome, typecode in COLUNAS.items()}
+                tamanhos[ARQUIVO_ULTIMA] = len(self.chaves) * 4
+                tamanhos[ARQUIVO_CHAVES] = tamanho_chaves
+                for nome, tamanho in tamanhos.items():
+                        with open(self.diretorio / nome, 'ab') as f:
+                                if f.tell() != tamanho:
+                                        f.truncate(tamanho)
+
+        # ultima.i32 aponta para linhas descartadas se o acréscimo foi interrompido depois de atualizá-lo: é refeito a
+        # partir da coluna das chaves (só nesse caso o histórico inteiro é lido)
+        def _reconstruir_ultima(self) -> None:
+                logger.warning(f" -   {self.diretorio / ARQUIVO_ULTIMA} desatualizado, refazendo a partir de {_arquivo_coluna('chave')}")
+                ultima = array.array('i', [-1]) * len(self.chaves)
+                for linha, chave in enumerate(self._colunas['chave']):
+                        ultima[chave] = linha
+                self.fechar()
+                with open(self.diretorio / ARQUIVO_ULTIMA, 'wb') as f:
+                        ultima.tofile(f)
+                self._abrir()
+
+        def _valores(self, linha: int) -> Tuple[int, int, int, int]:
+                if linha < self.linhas:
+                        c = self._colunas
+                        return c['vagas'][linha], c['inscritos'][linha], c['pendentes'][linha], c['matriculados'][linha]
+                novas = self._novas
+                linha -= self.linhas
+                return novas['vagas'][linha], novas['inscritos'][linha], novas['pendentes'][linha], novas['matriculados'][linha]
+
+        # Registra as vagas das turmas de uma matéria, observadas agora. Devolve o número de linhas acrescentadas.
+        def registrar(self, codigo: str, turmas: Iterable[modelo.Turma]) -> int:
+                # O tempo nunca volta, para que a coluna continue ordenada mesmo se o relógio for ajustado
+                self._tempo = max(self._tempo, int(time.time()))
+                acrescentadas = 0
+                for chave, valores in observacoes(codigo, turmas):
+                        i = self.ids.get(chave)
+                        if i is None:
+                                i = self.ids[chave] = len(self.chaves) + len(self._novas_chaves)
+                                self._novas_chaves.append(chave)
+                                anterior = -1
+                        else:
+                                anterior = self._ultimas.get(i, self._colunas['ultima'][i] if i < len(self.chaves) else -1)
+                        if anterior >= 0 and self._valores(anterior) == valores:
+                                continue
+                        self._ultimas[i] = self.linhas + len(self._novas['tempo'])
+                        for nome, valor in zip(COLUNAS, (self._tempo, i, anterior) + valores):
+                                self._novas[nome].append(valor)
+                        acrescentadas += 1
+                return acrescentadas
+
+        # Grava as linhas e as chaves registradas
+        def concluir(self) -> None:
+                novas_linhas = len(self._novas['tempo'])
+                self.fechar()
+                for nome, valores in self._novas.items():
+                        with open(self.diretorio / _arquivo_coluna(nome), 'ab') as f:
+                                valores.tofile(f)
+                with open(self.diretorio / ARQUIVO_CHAVES, 'ab') as f:
+                        f.writelines(json.dumps(list(chave), ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+                                     for chave in self._novas_chaves)
+                # Só as posições das chaves que mudaram são regravadas; as das chaves novas são acrescentadas
+                existentes = len(self.chaves)
+                with open(self.diretorio / ARQUIVO_ULTIMA, 'r+b') as f:
+                        for i, linha in sorted(self._ultimas.items()):
+                                if i < existentes:
+                                        f.seek(i * 4)
+                                        f.write(array.array('i', [linha]).tobytes())
+                        f.seek(existentes * 4)
+                        f.write(array.array('i', (self._ultimas[i] for i in range(existentes, existentes + len(self._novas_chaves)))).tobytes())
+                self.linhas += novas_linhas
+                self.chaves.extend(self._novas_chaves)
+                saida.gravar_atomico(self.diretorio / ARQUIVO_DESCRICAO, json.dumps(
+                        {'formato': FORMATO, 'versao': VERSAO, 'linhas': self.linhas, 'chaves': len(self.chaves)}, indent=1).encode('utf-8'))
+                logger.info(f" -   Histórico de vagas: {novas_linhas} linhas ({len(self._novas_chaves)} chaves novas) acrescentadas, "
+                            f"{self.linhas} no total")
+                self._novas = {nome: array.array(typecode) for nome, typecode in COLUNAS.items()}
+                self._novas_chaves = []
+                self._ultimas = {}
+                self._abrir()
+
+def _data(texto: str) -> int:
+        return int(datetime.fromisoformat(texto).timestamp())
+
+def _formatar(tempo: int) -> str:
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(tempo))
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Consulta ao histórico de vagas")
+        parser.add_argument('diretorio', help="diretório do histórico (gravado por parse_usp.py --historico)")
+        parser.add_argument('--serie', help="séries das turmas da matéria (ou só da turma)", nargs='+', metavar=('MATERIA', 'TURMA'))
+        parser.add_argument('--mais-rapidas', help="as N chaves que lotaram mais rápido", nargs='?', const=20, type=int, metavar='N')
+        parser.add_argument('--grupos', help="com --mais-rapidas, considerar também os grupos de cada tipo de vaga", action='store_true')
+        parser.add_argument('--campo', help="com --mais-rapidas, o campo que, ao chegar às vagas, lota a turma", choices=VALORES[1:], default='inscritos')
+        parser.add_argument('--desde', help="início do período (data ISO, ex.: 2026-07-01T08:00)", type=_data)
+        parser.add_argument('--ate', help="fim do período (data ISO)", type=_data)
+        args = parser.parse_args()
+        if args.serie is not None and len(args.serie) > 2:
+                parser.error("--serie recebe a matéria e, opcionalmente, a turma")
+
+        with Historico(args.diretorio) as historico:
+                if args.serie:
+                        for chave in historico.chaves_de(*args.serie):
+                                print(f"{chave.materia} {chave.turma} {chave.tipo}" + (f" / {chave.grupo}" if chave.grupo else ''))
+                                for observacao in historico.serie(chave, args.desde, args.ate):
+                                        print(f"  {_formatar(observacao.tempo)}  " + "  ".join(f"{campo} {getattr(observacao, campo)}" for campo in VALORES))
+                elif args.mais_rapidas:
+                        for lotacao in historico.mais_rapidas(args.mais_rapidas, args.desde, args.ate, args.campo, args.grupos):
+                                chave = lotacao.chave
+                                print(f"{lotacao.segundos / 3600:>8.1f} h  {chave.materia} {chave.turma} {chave.tipo}" + (f" / {chave.grupo}" if chave.grupo else '') +
+                                      f"  ({_formatar(lotacao.inicio)} -> {_formatar(lotacao.lotacao)})")
+                else:
+                        print(f"{len(historico)} linhas, {len(historico.chaves)} chaves, {len({(c.materia, c.turma) for c in historico.chaves})} turmas")
+                        if len(historico):
+                                print(f"de {_formatar(historico.tempo(0))} a {_formatar(historico.tempo(len(historico) - 1))}")
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Ocupação semanal das turmas em máscaras de bits, para verificar conflitos de horário com operações inteiras em vez
+# de comparar strings de dia e hora.
+#
+# A semana é dividida em intervalos de 5 minutos, de segunda a domingo (e não só até sábado: há aulas aos domingos
+# no JupiterWeb, poucas, mas que também conflitam): o bit dia * 288 + minuto_do_dia // 5 indica
+# que o intervalo está ocupado (bit 0: segunda, 00:00-00:05). Um horário ocupa do intervalo que contém o início
+# até o que contém o último minuto antes do fim, então aulas que terminam às 10:00 não conflitam com aulas que
+# começam às 10:00.
+#
+# A máscara não vai para db.json: com até 504 dígitos hexadecimais por turma, aumentaria o arquivo que todo cliente
+# baixa, e pode ser calculada do horário (ocupacao). Só o banco SQLite (banco_sqlite.py) a guarda, na coluna
+# turmas.ocupacao, em hexadecimal (ver para_hex).
+import itertools
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+DIAS = ('seg', 'ter', 'qua', 'qui', 'sex', 'sab', 'dom')
+MINUTOS_POR_INTERVALO = 5
+INTERVALOS_POR_DIA = 24 * 60 // MINUTOS_POR_INTERVALO
+INTERVALOS_POR_SEMANA = len(DIAS) * INTERVALOS_POR_DIA
+
+MASCARA_DIA = (1 << INTERVALOS_POR_DIA) - 1
+
+# Índice do intervalo de 5 minutos de uma hora "HH:MM" no dia. Com fim=True, arredonda para cima, de forma que
+# intervalo(inicio) até intervalo(fim, fim=True) cubra todos os minutos do horário.
+def intervalo(hora: str, fim: bool = False) -> int:
+        horas, minutos = hora.split(':')
+        minuto = int(horas) * 60 + int(minutos)
+        if fim:
+                minuto += MINUTOS_POR_INTERVALO - 1
+        return min(INTERVALOS_POR_DIA, minuto // MINUTOS_POR_INTERVALO)
+
+# Máscara de um horário (dia, "HH:MM", "HH:MM"). Levanta ValueError se o dia ou as horas forem inválidos.
+def mascara_horario(dia: str, inicio: str, fim: str) -> int:
+        primeiro, ultimo = intervalo(inicio), intervalo(fim, fim=True)
+        if dia not in DIAS:
+                raise ValueError(f"Dia inválido: {dia!r}")
+        if ultimo <= primeiro:
+                return 0
+        return ((1 << (ultimo - primeiro)) - 1) << (DIAS.index(dia) * INTERVALOS_POR_DIA + primeiro)
+
+# Máscara da lista de horários de uma turma, como gerada por parsear_horario (modelo.Horario) ou lida do JSON
+# (dicionários). Horários sem início ou fim (que existem no JupiterWeb) são ignorados.
+def mascara(horario: Optional[Iterable[Any]]) -> int:
+        resultado = 0
+        for h in horario or []:
+                try:
+                        if isinstance(h, dict):
+                                resultado |= mascara_horario(h['dia'], h['inicio'], h['fim'])
+                        else:
+                                resultado |= mascara_horario(h.dia, h.inicio, h.fim)
+                except (ValueError, KeyError):
+                        continue
+        return resultado
+
+def para_hex(mascara: int) -> str:
+        return format(mascara, 'x')
+
+def de_hex(texto: str) -> int:
+        return int(texto, 16)
+
+# Máscara de uma turma: do campo 'ocupacao', se houver (como no db.json de versões anteriores), ou calculada a partir
+# do horário
+def ocupacao(turma: Dict[str, Any]) -> int:
+        if turma.get('ocupacao') is not None:
+                return de_hex(turma['ocupacao'])
+        return mascara(turma.get('horario'))
+
+def conflita(a: int, b: int) -> bool:
+        return a & b != 0
+
+# Pares (i, j) de máscaras que conflitam entre si
+def conflitos(mascaras: Sequence[int]) -> List[Tuple[int, int]]:
+        return [(i, j) for i, j in itertools.combinations(range(len(mascaras)), 2) if mascaras[i] & mascaras[j]]
+
+# Enumera as combinações sem conflito com um elemento de cada grupo. Cada grupo é uma lista de (item, máscara),
+# por exemplo as turmas de uma matéria. A busca acumula a ocupação numa única máscara e descarta um ramo assim que
+# um item conflita com ela, então cada teste é um único AND.
+def combinacoes(grupos: Sequence[Sequence[Tuple[Any, int]]], ocupado: int = 0) -> Iterator[List[Any]]:
+        escolhidos: List[Any] = []
+
+        def buscar(indice: int, ocupado: int) -> Iterator[List[Any]]:
+                if indice == len(grupos):
+                        yield list(escolhidos)
+                        return
+                for item, m in grupos[indice]:
+                        if not m & ocupado:
+                                escolhidos.append(item)
+                                yield from buscar(indice + 1, ocupado | m)
+                                escolhidos.pop()
+
+        return buscar(0, ocupado)
+
+# Itens de (item, máscara) que cabem nos intervalos livres de uma ocupação
+def compativeis(itens: Iterable[Tuple[Any, int]], ocupado: int) -> List[Any]:
+        return [item for item, m in itens if not m & ocupado]
+
+# Se o horário (dia, "HH:MM", "HH:MM") está livre na ocupação
+def livre(ocupado: int, dia: str, inicio: str, fim: str) -> bool:
+        return not ocupado & mascara_horario(dia, inicio, fim)
+
+def _hora(indice: int) -> str:
+        minuto = indice * MINUTOS_POR_INTERVALO
+        return f"{minuto // 60:02d}:{minuto % 60:02d}"
+
+# Intervalos contínuos de bits ligados de uma máscara, como (dia, "HH:MM", "HH:MM"). Intervalos que passam da
+# meia-noite são divididos por dia.
+def intervalos(mascara: int) -> List[Tuple[str, str, str]]:
+        resultado = []
+        for d, dia in enumerate(DIAS):
+                bits = (mascara >> (d * INTERVALOS_POR_DIA)) & MASCARA_DIA
+                while bits:
+                        primeiro = (bits & -bits).bit_length() - 1
+                        ultimo = primeiro
+                        while bits >> ultimo & 1:
+                                ultimo += 1
+                        resultado.append((dia, _hora(primeiro), _hora(ultimo)))
+                        bits &= ~(((1 << (ultimo - primeiro)) - 1) << primeiro)
+        return resultado
+
+# Intervalos livres de uma ocupação, nos dias e entre os horários dados (por padrão, de segunda a sábado, das
+# 07:00 às 23:00), com duração mínima em minutos
+def intervalos_livres(ocupado: int, dias: Iterable[str] = DIAS[:6], inicio: str = '07:00', fim: str = '23:00',
+                      duracao_minima: int = 0) -> List[Tuple[str, str, str]]:
+        janela = 0
+        for dia in dias:
+                janela |= mascara_horario(dia, inicio, fim)
+        resultado = []
+        for dia, comeco, termino in intervalos(janela & ~ocupado):
+                if intervalo(termino) - intervalo(comeco) >= duracao_minima / MINUTOS_POR_INTERVALO:
+                        resultado.append((dia, comeco, termino))
+        return resultado
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Índice de busca pré-calculado (db/busca.json), com o mesmo conteúdo que loadLectures (js/dbupdate.js) calcula
+# no navegador a partir de db.json:
+#   trigramas: {trigrama: {codigo: peso}}, com o peso sqrt(log(total / ocorrências do trigrama)) * log(1 + n)
+#   periodos:  {codigo: ["matutino", "vespertino", "noturno"]}, a partir dos horários das turmas
+#   unidades:  {unidade: [departamento, ...]}
+# Os objetos são gravados no formato das tabelas do IndexedDB, para que o cliente só precise de bulkPut.
+#
+# Os trigramas seguem trigramsFromString e changingSpecialCharacters (js/dbhelpers.js), inclusive nos detalhes
+# herdados do JavaScript: índices em unidades UTF-16, \b e \s do JS, e isNaN/parseInt na conversão do número
+# final do nome para algarismos romanos. verificar_indice_busca.py compara o resultado com o do próprio JS.
+import re
+import math
+from typing import Any, Dict, Iterable, List, Optional
+
+STOPWORDS = {"DE", "DA", "DO", "DAS", "DOS", "A", "EM", "NO", "NA", "NOS", "NAS", "E", "O", "AO", "AS", "OS", "AOS",
+             "PARA", "POR"}
+
+SUBSTITUICOES = [(re.compile("[ÀÁÂÃÄÅ]"), "A"), (re.compile("Ç"), "C"), (re.compile("[ÈÉÊË]"), "E"),
+                 (re.compile("[ÌÎÍÏ]"), "I"), (re.compile("Ð"), "D"), (re.compile("Ñ"), "N"),
+                 (re.compile("[ÒÓÔÕÖØ]"), "O"), (re.compile("[ÙÚÛÜ]"), "U"), (re.compile("Ý"), "Y"),
+                 (re.compile("ß"), "SS")]
+
+ROMANOS = [("M", 1000), ("CM", 900), ("D", 500), ("CD", 400), ("C", 100), ("XC", 90), ("L", 50), ("XL", 40),
+           ("X", 10), ("IX", 9), ("V", 5), ("IV", 4), ("I", 1)]
+
+# Espaços de \s e de Number()/parseInt() no JavaScript
+ESPACOS_JS = "\t\n\v\f\r \u00a0\u1680" + "".join(map(chr, range(0x2000, 0x200b))) + "\u2028\u2029\u202f\u205f\u3000\ufeff"
+
+# Junta algarismos romanos separados por espaços ("CALCULO II I" vira "CALCULO III"); \b do JS só considera [A-Za-z0-9_]
+re_romanos = re.compile(f"(?<![A-Za-z0-9_])([IVXLCM]+)[{ESPACOS_JS}]+(?=[IVXLCM])")
+re_numero_js = re.compile(r"[+-]?(Infinity|(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?)|0[xX][0-9a-fA-F]+|0[oO][0-7]+|0[bB][01]+")
+re_parseint_js = re.compile(r"([+-]?)(0x([0-9a-f]+)|(\d+))", re.IGNORECASE)
+
+def normalizar(texto: str) -> str:
+        texto = texto.upper()
+        for padrao, substituto in SUBSTITUICOES:
+                texto = padrao.sub(substituto, texto)
+        return texto
+
+def romanizar(numero: float) -> str:
+        romano = ''
+        if math.isnan(numero):
+                return romano
+        for simbolo, valor in ROMANOS:
+                while numero >= valor:
+                        romano += simbolo
+                        numero -= valor
+        return romano
+
+# isNaN(texto) do JavaScript
+def nao_numerico(texto: str) -> bool:
+        texto = texto.strip(ESPACOS_JS)
+        return bool(texto) and not re_numero_js.fullmatch(texto)
+
+# parseInt(texto) do JavaScript (sem base): inteiro do prefixo numérico, ou nan
+def parse_int(texto: str) -> float:
+        r = re_parseint_js.match(texto.lstrip(ESPACOS_JS))
+        if not r:
+                return math.nan
+        numero = int(r.group(3), 16) if r.group(3) else int(r.group(4))
+        return -numero if r.group(1) == '-' else numero
+
+# Strings do JS são indexadas em unidades UTF-16: caracteres fora do BMP viram pares substitutos
+def _utf16(texto: str) -> str:
+        if not texto or max(texto) <= '\uffff':
+                return texto
+        return ''.join(c if c <= '\uffff' else chr(0xd800 + ((ord(c) - 0x10000) >> 10)) + chr(0xdc00 + ((ord(c) - 0x10000) & 0x3ff))
+                       for c in texto)
+
+# Recompõe os pares substitutos que continuaram juntos (os separados continuam isolados, como no JS)
+def _de_utf16(texto: str) -> str:
+        return texto.encode('utf-16-le', 'surrogatepass').decode('utf-16-le', 'surrogatepass')
+
+# trigramsFromString(texto) de js/dbhelpers.js, sem asAcronym (que só é usado na busca)
+def trigramas(texto: str) -> List[str]:
+        texto = re_romanos.sub(r"\1", texto)
+        palavras = texto.split(" ")
+        if len(palavras) > 1 and not nao_numerico(palavras[-1]):
+                palavras[-1] = romanizar(parse_int(palavras[-1]))
+        palavras = [_utf16(p) for i, p in enumerate(palavras) if p != "" and (i == 0 or p not in STOPWORDS)]
+
+        resultado = []
+        for i, palavra in enumerate(palavras):
+                resultado.append(palavra[0] + "#")
+                if i == 0 and len(palavra) > 2:
+                        resultado.append(palavra[:3] + "!")
+                resultado.append(palavra + "$")
+                resultado.extend(palavra[j:j + 3] for j in range(len(palavra) - 2))
+                if i > 0:
+                        resultado.append(palavras[i - 1][0] + palavra[0] + "%")
+        return [_de_utf16(t) for t in resultado] if palavras and max(max(p) for p in palavras) >= '\ud800' else resultado
+
+# Períodos do dia (matutino, vespertino, noturno) em que a matéria tem aula, na ordem em que aparecem.
+# None se a matéria não tiver turmas, como no JS, que então não define lecture.periodos.
+def periodos(materia: Dict[str, Any]) -> Optional[List[str]]:
+        if not materia.get('turmas'):
+                return None
+        resultado: Dict[str, None] = {}
+        for turma in materia['turmas']:
+                if not turma or not turma.get('horario'):
+                        continue
+                for horario in turma['horario']:
+                        if not horario:
+                                continue
+                        inicio = parse_int(horario['inicio'][:2])
+                        resultado['matutino' if inicio < 12 else 'vespertino' if inicio < 18 else 'noturno'] = None
+                        fim = parse_int(horario['fim'][:2])
+                        resultado['noturno' if fim > 19 else 'vespertino' if fim > 13 else 'matutino'] = None
+        return list(resultado)
+
+# Gera o índice a partir das matérias, na ordem de db.json
+def gerar(materias: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        contagens: Dict[str, Dict[str, int]] = {}
+        ocorrencias: Dict[str, int] = {}
+        total = 0
+        indice_periodos: Dict[str, List[str]] = {}
+        unidades: Dict[str, Dict[Any, None]] = {}
+
+        for materia in materias:
+                codigo = materia['codigo']
+                p = periodos(materia)
+                if p is not None:
+                        indice_periodos[codigo] = p
+
+                for trigrama in trigramas(normalizar(materia['nome'])) + trigramas(codigo):
+                        por_materia = contagens.setdefault(trigrama, {})
+                        por_materia[codigo] = por_materia.get(codigo, 0) + 1
+                        ocorrencias[trigrama] = ocorrencias.get(trigrama, 0) + 1
+                        total += 1
+
+                unidades.setdefault(materia.get('unidade'), {})[materia.get('departamento')] = None
+
+        pesos = {}
+        for trigrama, por_materia in contagens.items():
+                peso = math.sqrt(math.log(total / ocorrencias[trigrama]))
+                pesos[trigrama] = {codigo: peso * math.log(1 + n) for codigo, n in por_materia.items()}
+
+        return {'trigramas': pesos, 'periodos': indice_periodos,
+                'unidades': {unidade: list(departamentos) for unidade, departamentos in unidades.items()}}
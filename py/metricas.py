@@ -0,0 +1,342 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Métricas de desempenho dos crawlers: contadores, valores instantâneos e histogramas de duração de cada fase
+# (lista de unidades, pedidos ao JupiterWeb por página, análise do HTML, cada parsear_*, serialização e gravação),
+# para saber se uma execução lenta se deve à latência do JupiterWeb, à CPU dos parsers ou ao disco.
+#
+# Com --metricas DIRETORIO, são exportadas periodicamente durante a execução e ao fim dela, em dois arquivos:
+#   {crawler}.json   relatório: para cada métrica e rótulos, o valor, ou número, soma, mínimo, máximo e percentis
+#                    aproximados (p50, p90, p99) das durações
+#   {crawler}.prom   as mesmas métricas no formato texto do Prometheus, para o textfile collector do node_exporter
+#                    (--collector.textfile.directory=DIRETORIO)
+# Os dois são substituídos de forma atômica, de forma que o coletor nunca lê um arquivo pela metade.
+#
+# Métricas (todas com o prefixo matrusp_):
+#   fase_segundos{fase}                   histograma da duração de cada fase: lista_unidades, unidade (lista de
+#                                         matérias ou cursos da unidade), materia, curso, html, serializacao, gravacao
+#   saida_segundos{arquivo}               duração da gravação de cada arquivo agregado (db.json, busca.json, ...)
+#   parser_segundos{funcao}               histograma de cada parsear_* (inclusivo: parsear_turmas inclui parsear_horario)
+#   http_segundos{pagina}                 histograma de cada obtenção de página, com repetições e esperas
+#   http_pedidos_total{pagina,resultado}  pedidos HTTP por página e status (ou timeout/erro)
+#   http_repeticoes_total{pagina}, http_falhas_total{pagina}, http_bytes_total{pagina}
+#   materias_total{estado}, atualizacoes_total{tipo}, cursos_total{estado}, gravacao_bytes_total, pacote_bytes_total
+#   arquivos{resultado}                   arquivos de saída gravados, inalterados e removidos até agora
+#   http_limite, http_em_uso              limite de pedidos simultâneos (AIMD) e pedidos em andamento
+#   execucao_segundos, inicio_timestamp_segundos
+#
+# Com --profile [ARQUIVO], a execução é também perfilada com cProfile, para saber, dentro da CPU, que funções dominam
+# (ver perfil).
+#
+# As métricas são registradas no registro global `registro`, de qualquer thread. Nos processos de análise
+# (--workers), cada chamada devolve as suas com Metricas.retirar, e o processo principal as combina.
+import json
+import math
+import time
+import bisect
+import asyncio
+import logging
+import threading
+import functools
+import cProfile
+import pstats
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
+
+import saida
+
+logger = logging.getLogger('log')
+
+PREFIXO = 'matrusp_'
+
+# Limites superiores (segundos) dos intervalos dos histogramas: de 100µs (um parsear_* pequeno) a 2 minutos (um
+# pedido HTTP com todas as repetições)
+LIMITES = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Descrição de cada métrica, para o # HELP do Prometheus
+DESCRICOES = {
+        'fase_segundos': "Duração de cada fase do crawler",
+        'saida_segundos': "Duração da gravação de cada arquivo agregado",
+        'parser_segundos': "Duração de cada função parsear_*",
+        'http_segundos': "Duração da obtenção de cada página do JupiterWeb, com repetições",
+        'http_pedidos_total': "Pedidos HTTP ao JupiterWeb, por página e resultado",
+        'http_repeticoes_total': "Pedidos HTTP repetidos após uma falha temporária",
+        'http_falhas_total': "Páginas que não puderam ser obtidas",
+        'http_bytes_total': "Bytes recebidos do JupiterWeb",
+        'materias_total': "Matérias processadas, por estado",
+        'atualizacoes_total': "Matérias obtidas por completo e só com as vagas (--vagas)",
+        'cursos_total': "Cursos processados, por estado",
+        'pacote_bytes_total': "Bytes gravados no pacote de páginas (--arquivar)",
+        'gravacao_bytes_total': "Bytes gravados nos arquivos de matérias (sem compactação)",
+        'arquivos': "Arquivos de saída gravados, inalterados e removidos",
+        'http_limite': "Limite atual de pedidos HTTP simultâneos",
+        'http_em_uso': "Pedidos HTTP em andamento",
+        'execucao_segundos': "Tempo desde o início da execução",
+        'inicio_timestamp_segundos': "Início da execução (Unix)",
+}
+
+Rotulos = Tuple[Tuple[str, str], ...]
+
+def _rotulos(rotulos: Dict[str, Any]) -> Rotulos:
+        return tuple(sorted((k, str(v)) for k, v in rotulos.items()))
+
+class Histograma:
+        __slots__ = ('contagens', 'soma', 'minimo', 'maximo')
+
+        def __init__(self):
+                self.contagens = [0] * (len(LIMITES) + 1) # O último intervalo é +Inf
+                self.soma = 0.0
+                self.minimo = math.inf
+                self.maximo = 0.0
+
+        @property
+        def numero(self) -> int:
+                return sum(self.contagens)
+
+        def observar(self, valor: float) -> None:
+                self.contagens[bisect.bisect_left(LIMITES, valor)] += 1
+                self.soma += valor
+                self.minimo = min(self.minimo, valor)
+                self.maximo = max(self.maximo, valor)
+
+        def combinar(self, contagens: List[int], soma: float, minimo: float, maximo: float) -> None:
+                self.contagens = [a + b for a, b in zip(self.contagens, contagens)]
+                self.soma += soma
+                self.minimo = min(self.minimo, minimo)
+                self.maximo = max(self.maximo, maximo)
+
+        # Percentil aproximado, por interpolação linear dentro do intervalo em que cai, limitado ao mínimo e máximo
+        def percentil(self, p: float) -> float:
+                alvo = p * self.numero
+                acumulado = 0
+                for i, contagem in enumerate(self.contagens):
+                        if contagem and acumulado + contagem >= alvo:
+                                inferior = LIMITES[i - 1] if i else 0.0
+                                superior = LIMITES[i] if i < len(LIMITES) else self.maximo
+                                valor = inferior + (superior - inferior) * (alvo - acumulado) / contagem
+                                return min(max(valor, self.minimo), self.maximo)
+                        acumulado += contagem
+                return self.maximo
+
+class Metricas:
+        def __init__(self):
+                self.inicio = time.time()
+                self._contadores: Dict[str, Dict[Rotulos, float]] = {}
+                self._valores: Dict[str, Dict[Rotulos, float]] = {}
+                self._histogramas: Dict[str, Dict[Rotulos, Histograma]] = {}
+                self._coletores: List[Callable[['Metricas'], None]] = []
+                self._trava = threading.Lock()
+
+        def contar(self, nome: str, valor: float = 1, **rotulos: Any) -> None:
+                chave = _rotulos(rotulos)
+                with self._trava:
+                        serie = self._contadores.setdefault(nome, {})
+                        serie[chave] = serie.get(chave, 0) + valor
+
+        def definir(self, nome: str, valor: float, **rotulos: Any) -> None:
+                with self._trava:
+                        self._valores.setdefault(nome, {})[_rotulos(rotulos)] = valor
+
+        def observar(self, nome: str, valor: float, **rotulos: Any) -> None:
+                chave = _rotulos(rotulos)
+                with self._trava:
+                        serie = self._histogramas.setdefault(nome, {})
+                        if chave not in serie:
+                                serie[chave] = Histograma()
+                        serie[chave].observar(valor)
+
+        # with registro.medir('fase_segundos', fase='html'): ...
+        @contextmanager
+        def medir(self, nome: str, **rotulos: Any) -> Iterator[None]:
+                inicio = time.perf_counter()
+                try:
+                        yield
+                finally:
+                        self.observar(nome, time.perf_counter() - inicio, **rotulos)
+
+        # Funções chamadas antes de cada exportação, para atualizar valores instantâneos (ex.: o limite do cliente HTTP)
+        def coletor(self, funcao: Callable[['Metricas'], None]) -> None:
+                self._coletores.append(funcao)
+
+        # Estado serializável (pickle) das métricas, para combinar as de outro processo
+        def estado(self) -> Dict[str, Any]:
+                with self._trava:
+                        return {'contadores': {n: dict(s) for n, s in self._contadores.items()},
+                                'histogramas': {n: {r: (h.contagens, h.soma, h.minimo, h.maximo) for r, h in s.items()}
+                                                for n, s in self._histogramas.items()}}
+
+        # Devolve o estado e zera as métricas (usado nos processos de análise, a cada página)
+        def retirar(self) -> Dict[str, Any]:
+                estado = self.estado()
+                with self._trava:
+                        self._contadores.clear()
+                        self._histogramas.clear()
+                return estado
+
+        def combinar(self, estado: Dict[str, Any]) -> None:
+                with self._trava:
+                        for nome, serie in estado['contadores'].items():
+                                destino = self._contadores.setdefault(nome, {})
+                                for chave, valor in serie.items():
+                                        destino[chave] = destino.get(chave, 0) + valor
+                        for nome, serie in estado['histogramas'].items():
+                                destino = self._histogramas.setdefault(nome, {})
+                                for chave, dados in serie.items():
+                                        if chave not in destino:
+                                                destino[chave] = Histograma()
+                                        destino[chave].combinar(*dados)
+
+        def _coletar(self) -> None:
+                self.definir('execucao_segundos', round(time.time() - self.inicio, 3))
+                self.definir('inicio_timestamp_segundos', round(self.inicio, 3))
+                for funcao in self._coletores:
+                        funcao(self)
+
+        def relatorio(self) -> Dict[str, Any]:
+                self._coletar()
+                with self._trava:
+                        return {
+                                'contadores': {n: [dict(rotulos=dict(r), valor=v) for r, v in sorted(s.items())]
+                                               for n, s in sorted(self._contadores.items())},
+                                'valores': {n: [dict(rotulos=dict(r), valor=v) for r, v in sorted(s.items())]
+                                            for n, s in sorted(self._valores.items())},
+                                'histogramas': {n: [dict(rotulos=dict(r), numero=h.numero, soma=round(h.soma, 6),
+                                                         minimo=round(h.minimo, 6), maximo=round(h.maximo, 6),
+                                                         p50=round(h.percentil(0.5), 6), p90=round(h.percentil(0.9), 6),
+                                                         p99=round(h.percentil(0.99), 6))
+                                                    for r, h in sorted(s.items())]
+                                                for n, s in sorted(self._histogramas.items())},
+                        }
+
+        def prometheus(self) -> str:
+                self._coletar()
+                linhas = []
+
+                def cabecalho(nome: str, tipo: str) -> None:
+                        linhas.append(f"# HELP {PREFIXO}{nome} {DESCRICOES.get(nome, nome)}")
+                        linhas.append(f"# TYPE {PREFIXO}{nome} {tipo}")
+
+                with self._trava:
+                        for nome, serie in sorted(self._contadores.items()):
+                                cabecalho(nome, 'counter')
+                                linhas += [f"{PREFIXO}{nome}{_formatar_rotulos(r)} {_numero(v)}" for r, v in sorted(serie.items())]
+                        for nome, serie in sorted(self._valores.items()):
+                                cabecalho(nome, 'gauge')
+                                linhas += [f"{PREFIXO}{nome}{_formatar_rotulos(r)} {_numero(v)}" for r, v in sorted(serie.items())]
+                        for nome, serie in sorted(self._histogramas.items()):
+                                cabecalho(nome, 'histogram')
+                                for r, h in sorted(serie.items()):
+                                        acumulado = 0
+                                        for limite, contagem in zip(LIMITES + ('+Inf',), h.contagens):
+                                                acumulado += contagem
+                                                linhas.append(f"{PREFIXO}{nome}_bucket{_formatar_rotulos(r + (('le', str(limite)),))} {acumulado}")
+                                        linhas.append(f"{PREFIXO}{nome}_sum{_formatar_rotulos(r)} {_numero(h.soma)}")
+                                        linhas.append(f"{PREFIXO}{nome}_count{_formatar_rotulos(r)} {acumulado}")
+                return '\n'.join(linhas) + '\n'
+
+        # Grava {nome}.json e {nome}.prom no diretório, de forma atômica
+        def exportar(self, diretorio: Union[str, Path], nome: str) -> None:
+                diretorio = Path(diretorio)
+                diretorio.mkdir(parents=True, exist_ok=True)
+                saida.gravar_atomico(diretorio / f"{nome}.json",
+                                     json.dumps(dict(crawler=nome, **self.relatorio()), indent=1, ensure_ascii=False).encode('utf-8'))
+                saida.gravar_atomico(diretorio / f"{nome}.prom", self.prometheus().encode('utf-8'))
+
+        # Exporta a cada `intervalo` segundos, até ser cancelada; a exportação final é feita por quem a cancela
+        async def exportar_periodicamente(self, diretorio: Union[str, Path], nome: str, intervalo: float) -> None:
+                while True:
+                        await asyncio.sleep(intervalo)
+                        try:
+                                self.exportar(diretorio, nome)
+                        except OSError:
+                                logger.exception(f" -   Não foi possível exportar as métricas para {diretorio}")
+
+        # Linhas do log com o tempo total e o número de medições de cada fase, das mais demoradas para as menos
+        def resumo(self, nome: str = 'fase_segundos') -> List[str]:
+                with self._trava:
+                        serie = sorted(self._histogramas.get(nome, {}).items(), key=lambda x: -x[1].soma)
+                        return [f"{', '.join(v for _, v in r)}: {h.soma:.2f} s em {h.numero} (p50 {h.percentil(0.5)*1000:.1f} ms, "
+                                f"p99 {h.percentil(0.99)*1000:.1f} ms)" for r, h in serie]
+
+def _numero(valor: float) -> str:
+        return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+def _formatar_rotulos(rotulos: Rotulos) -> str:
+        if not rotulos:
+                return ''
+        escapar = lambda v: v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{k}="{escapar(v)}"' for k, v in rotulos) + '}'
+
+# Registro global, usado pelo cliente HTTP, pelos crawlers e pelos parsers
+registro = Metricas()
+
+# Decorador: mede cada chamada da função no histograma parser_segundos{funcao=...}
+def medida(funcao: Callable) -> Callable:
+        @functools.wraps(funcao)
+        def medir(*argumentos, **nomeados):
+                inicio = time.perf_counter()
+                try:
+                        return funcao(*argumentos, **nomeados)
+                finally:
+                        registro.observar('parser_segundos', time.perf_counter() - inicio, funcao=funcao.__name__)
+        return medir
+
+# Executa funcao(*argumentos) num processo de análise e devolve também as métricas registradas nele
+def executar_com_metricas(funcao: Callable, *argumentos: Any) -> Tuple[Any, Dict[str, Any]]:
+        registro.retirar()
+        resultado = funcao(*argumentos)
+        return resultado, registro.retirar()
+
+# Argumentos de linha de comando comuns aos crawlers
+def adicionar_argumentos(parser) -> None:
+        parser.add_argument('--metricas', help="diretório em que as métricas da execução são exportadas (JSON e textfile do Prometheus)", metavar='DIRETORIO')
+        parser.add_argument('--intervalo-metricas', help="intervalo (segundos) entre as exportações das métricas durante a execução", type=float, default=30)
+        parser.add_argument('--profile', help="perfilar a execução com cProfile e gravar o perfil (pstats, para snakeviz, flameprof ou gprof2dot) neste arquivo, por padrão {crawler}_{data}.prof no diretório atual, e um resumo em ARQUIVO.txt",
+                            nargs='?', const='', metavar='ARQUIVO', dest='perfil')
+
+LINHAS_PERFIL = 40
+
+# Arquivo do perfil de --profile: o dado, ou {crawler}_{data}.prof
+def arquivo_perfil(arquivo: str, nome: str) -> Path:
+        return Path(arquivo or time.strftime(f'{nome}_%Y-%m-%d_%H-%M-%S.prof'))
+
+# Com --profile, perfila o bloco com cProfile e grava, ao fim dele (mesmo se interrompido), o perfil e um resumo com as
+# funções de maior tempo acumulado e de maior tempo próprio. Só a thread principal é perfilada: o event loop e a
+# análise das páginas fora do pool de processos (--workers 0).
+@contextmanager
+def perfil(args, nome: str) -> Iterator[None]:
+        if getattr(args, 'perfil', None) is None:
+                yield
+                return
+        arquivo = arquivo_perfil(args.perfil, nome)
+        if getattr(args, 'workers', 0):
+                logger.warning(" - Com --workers, a análise nos processos do pool não entra no perfil (use -w 0)")
+        perfilador = cProfile.Profile()
+        perfilador.enable()
+        try:
+                yield
+        finally:
+                perfilador.disable()
+                perfilador.dump_stats(arquivo)
+                with open(f"{arquivo}.txt", 'w', encoding='utf-8') as f:
+                        estatisticas = pstats.Stats(perfilador, stream=f).strip_dirs()
+                        estatisticas.sort_stats('cumulative').print_stats(LINHAS_PERFIL)
+                        estatisticas.sort_stats('tottime').print_stats(LINHAS_PERFIL)
+                logger.info(f" -   Perfil gravado em {arquivo} (resumo em {arquivo}.txt)")
+
+# Exporta as métricas periodicamente durante o bloco (se --metricas foi dado) e uma última vez ao fim dele, mesmo
+# se interrompido. O resumo por fase vai sempre para o log.
+@contextmanager
+def exportacao(args, nome: str) -> Iterator[None]:
+        tarefa = None
+        if args.metricas:
+                tarefa = asyncio.get_running_loop().create_task(registro.exportar_periodicamente(args.metricas, nome, args.intervalo_metricas))
+        try:
+                yield
+        finally:
+                if tarefa is not None:
+                        tarefa.cancel()
+                        registro.exportar(args.metricas, nome)
+                        logger.info(f" -   Métricas exportadas em {Path(args.metricas) / nome}.json e .prom")
+                for linha in registro.resumo():
+                        logger.info(f" -   {linha}")
@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Modelo em memória das matérias e dos cursos analisados pelos crawlers: dataclasses com __slots__ (sem o dicionário
+# de atributos de cada objeto), com os textos repetidos (unidades, departamentos, campi, professores, dias, horas,
+# datas, tipos e grupos de vaga) internados, de forma que cada um exista uma única vez na memória e vá uma única vez
+# no pickle que traz o resultado dos processos de análise (--workers).
+#
+# serializar produz o JSON de db/{codigo}.json, db.json e cursos.json: os mesmos campos, na mesma ordem, sem os
+# opcionais ausentes, em UTF-8 e sem espaços. Com o orjson instalado, a serialização é feita por ele; sem ele, por
+# json.dumps, com exatamente os mesmos bytes. carregar é o json.loads correspondente.
+import sys
+import json
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+        import orjson
+except ImportError:
+        orjson = None
+
+# Base das classes do modelo: no pickle, cada objeto vai como a classe e a tupla dos campos, em vez do estado padrão
+# dos objetos com __slots__ (um dicionário com o nome de cada campo)
+class _Modelo:
+        __slots__ = ()
+
+        def __reduce__(self):
+                return type(self), tuple(getattr(self, campo) for campo in self.__slots__)
+
+@dataclass
+class Horario(_Modelo):
+        __slots__ = ('dia', 'inicio', 'fim', 'professores')
+        dia: str
+        inicio: str
+        fim: str
+        professores: List[str]
+
+@dataclass
+class GrupoVagas(_Modelo):
+        __slots__ = ('vagas', 'inscritos', 'pendentes', 'matriculados')
+        vagas: int
+        inscritos: int
+        pendentes: int
+        matriculados: int
+
+# Vagas de um tipo de vaga (Obrigatória, Optativa, ...), detalhadas por grupo (IME - Matemática Bacharelado, ...)
+@dataclass
+class Vagas(_Modelo):
+        __slots__ = ('vagas', 'inscritos', 'pendentes', 'matriculados', 'grupos')
+        vagas: int
+        inscritos: int
+        pendentes: int
+        matriculados: int
+        grupos: Dict[str, GrupoVagas]
+
+# Os campos de informação ausentes na página (None) não são gravados, como nos dicionários de antes
+@dataclass
+class Turma(_Modelo):
+        __slots__ = ('codigo', 'inicio', 'fim', 'tipo', 'codigo_teorica', 'observacoes', 'horario', 'vagas')
+        codigo: Optional[str]
+        inicio: Optional[str]
+        fim: Optional[str]
+        tipo: Optional[str]
+        codigo_teorica: Optional[str]
+        observacoes: Optional[str]
+        horario: Optional[List[Horario]]
+        vagas: Optional[Dict[str, Vagas]]
+
+@dataclass
+class Materia(_Modelo):
+        __slots__ = ('unidade', 'departamento', 'campus', 'codigo', 'nome', 'creditos_aula', 'creditos_trabalho', 'objetivos',
+                     'programa_resumido', 'turmas')
+        unidade: Optional[str]
+        departamento: Optional[str]
+        campus: Optional[str]
+        codigo: Optional[str]
+        nome: Optional[str]
+        creditos_aula: Optional[int]
+        creditos_trabalho: Optional[int]
+        objetivos: Optional[str]
+        programa_resumido: Optional[str]
+        turmas: List[Turma]
+
+# Matéria na grade de um curso, com seus requisitos
+@dataclass
+class MateriaCurso(_Modelo):
+        __slots__ = ('codigo', 'tipo', 'req_fraco', 'req_forte', 'ind_conjunto')
+        codigo: str
+        tipo: str
+        req_fraco: List[str]
+        req_forte: List[str]
+        ind_conjunto: List[str]
+
+@dataclass
+class Curso(_Modelo):
+        __slots__ = ('periodo', 'codigo', 'nome', 'unidade', 'periodos')
+        periodo: str
+        codigo: str
+        nome: str
+        unidade: str
+        periodos: Optional[Dict[str, List[MateriaCurso]]]
+
+# Campos omitidos quando None, por classe; os demais são sempre gravados (horario e vagas da turma podem ser null)
+OPCIONAIS = {
+        Turma: {'codigo', 'inicio', 'fim', 'tipo', 'codigo_teorica', 'observacoes'},
+        Materia: {'unidade', 'departamento', 'campus', 'codigo', 'nome', 'creditos_aula', 'creditos_trabalho', 'objetivos',
+                  'programa_resumido'},
+        Curso: {'periodos'},
+}
+
+CLASSES = {Horario, GrupoVagas, Vagas, Turma, Materia, MateriaCurso, Curso}
+
+def _campos(objeto: Any) -> Dict[str, Any]:
+        tipo = type(objeto)
+        if tipo not in CLASSES:
+                raise TypeError(f"{tipo.__name__} não é serializável")
+        opcionais = OPCIONAIS.get(tipo, ())
+        resultado = {}
+        for campo in objeto.__slots__:
+                valor = getattr(objeto, campo)
+                if valor is not None or campo not in opcionais:
+                        resultado[campo] = valor
+        return resultado
+
+# Para o orjson, que serializa as dataclasses sem campos opcionais por conta própria (e muito mais rápido), só as que
+# têm campos opcionais são convertidas em dicionários
+def _preparar(objeto: Any) -> Any:
+        tipo = type(objeto)
+        if tipo is Materia:
+                resultado = _campos(objeto)
+                resultado['turmas'] = [_campos(turma) for turma in objeto.turmas]
+                return resultado
+        if tipo in OPCIONAIS:
+                return _campos(objeto)
+        if tipo is list:
+                return [_preparar(elemento) for elemento in objeto]
+        return objeto
+
+def _serializar_json(objeto: Any) -> bytes:
+        return json.dumps(objeto, default=_campos, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def _serializar_orjson(objeto: Any) -> bytes:
+        return orjson.dumps(_preparar(objeto))
+
+# Serializa objetos do modelo, ou dicionários e listas que os contenham (como as matérias lidas de db.json)
+serializar: Callable[[Any], bytes] = _serializar_orjson if orjson is not None else _serializar_json
+carregar: Callable[[Any], Any] = orjson.loads if orjson is not None else json.loads
+
+def texto(valor: Optional[str]) -> Optional[str]:
+        return sys.intern(valor) if valor is not None else None
+
+# Objetos do modelo a partir do JSON já gravado (por exemplo, db/{codigo}.json de uma execução anterior)
+def horario_de_dict(d: Dict[str, Any]) -> Horario:
+        return Horario(texto(d['dia']), texto(d['inicio']), texto(d['fim']), [texto(p) for p in d['professores']])
+
+def vagas_de_dict(vagas: Optional[Dict[str, Any]]) -> Optional[Dict[str, Vagas]]:
+        if vagas is None:
+                return None
+        return {texto(tipo): Vagas(v['vagas'], v['inscritos'], v['pendentes'], v['matriculados'],
+                                   {texto(g): GrupoVagas(**gv) for g, gv in v.get('grupos', {}).items()})
+                for tipo, v in vagas.items()}
+
+def turma_de_dict(d: Dict[str, Any]) -> Turma:
+        horario = d.get('horario')
+        return Turma(d.get('codigo'), texto(d.get('inicio')), texto(d.get('fim')), texto(d.get('tipo')), d.get('codigo_teorica'),
+                     d.get('observacoes'), None if horario is None else [horario_de_dict(h) for h in horario],
+                     vagas_de_dict(d.get('vagas')))
+
+def materia_de_dict(d: Dict[str, Any]) -> Materia:
+        return Materia(texto(d.get('unidade')), texto(d.get('departamento')), texto(d.get('campus')), d.get('codigo'), d.get('nome'),
+                       d.get('creditos_aula'), d.get('creditos_trabalho'), d.get('objetivos'), d.get('programa_resumido'),
+                       [turma_de_dict(t) for t in d.get('turmas', [])])
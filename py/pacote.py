@@ -0,0 +1,253 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Pacote de páginas brutas do JupiterWeb: todas as páginas obtidas numa execução do crawler (parse_usp.py
+# --arquivar), compactadas uma a uma num único arquivo com índice, para que o banco de dados possa ser reconstruído
+# sem a rede (parse_usp.py --reparse) depois de uma correção nos parsers, ou a partir de uma coleta antiga.
+#
+# Formato (inteiros little-endian):
+#   MAGIA                                        cabeçalho, 16 bytes
+#   registros, um por página:
+#     codec (B), tamanho do caminho (H), tamanho da codificação (B), tamanho compactado (I), tamanho original (I),
+#     caminho (utf-8), codificação (ascii), conteúdo compactado
+#   índice: JSON compactado com zlib, {"metadados": {...}, "paginas": {caminho: [posição, tamanho compactado,
+#           tamanho original, codec, codificação]}}
+#   posição do índice (Q), MAGIA_FIM                                               rodapé, 16 bytes
+#
+# O caminho é o mesmo pedido ao JupiterWeb ('obterTurma?print=true&sgldis=MAC0110'), de forma que uma nova análise
+# pede as mesmas páginas. O pacote é escrito em {arquivo}.parcial e só recebe o índice e o nome final ao fim da
+# execução; um pacote parcial (execução interrompida) é lido registro a registro e continuado por --resume.
+#
+# Uso: python pacote.py ARQUIVO              resumo do pacote: metadados, páginas e tamanhos por tipo de página
+#      python pacote.py ARQUIVO CAMINHO      conteúdo de uma página, decodificado
+import os
+import sys
+import json
+import mmap
+import zlib
+import time
+import struct
+import logging
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+try:
+        import zstandard
+except ImportError:
+        zstandard = None
+
+import metricas
+
+logger = logging.getLogger('log')
+
+MAGIA = b'MATRUSP-PAGINAS1'
+MAGIA_FIM = b'FIM-PAG1'
+REGISTRO = struct.Struct('<BHBII')
+RODAPE = struct.Struct('<Q8s')
+
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+
+# As páginas do JupiterWeb são muito parecidas entre si e compactam bem já nos níveis rápidos, que não atrasam o
+# event loop (cada página é compactada assim que chega)
+NIVEL_ZLIB = 6
+NIVEL_ZSTD = 3
+
+Caminho = Union[str, Path]
+
+def caminho_parcial(caminho: Caminho) -> Path:
+        return Path(f"{caminho}.parcial")
+
+# Lê os registros a partir de `inicio`, até o índice (limite) ou até um registro incompleto. Devolve o índice das
+# páginas e a posição do fim do último registro completo.
+def _ler_registros(dados: Union[bytes, mmap.mmap], inicio: int, limite: int) -> Tuple[Dict[str, List[Any]], int]:
+        paginas: Dict[str, List[Any]] = {}
+        posicao = inicio
+        while posicao + REGISTRO.size <= limite:
+                codec, n_caminho, n_codificacao, tamanho, original = REGISTRO.unpack_from(dados, posicao)
+                inicio_dados = posicao + REGISTRO.size + n_caminho + n_codificacao
+                if inicio_dados + tamanho > limite:
+                        break
+                caminho = bytes(dados[posicao + REGISTRO.size:posicao + REGISTRO.size + n_caminho]).decode('utf-8')
+                codificacao = bytes(dados[inicio_dados - n_codificacao:inicio_dados]).decode('ascii')
+                paginas[caminho] = [inicio_dados, tamanho, original, codec, codificacao]
+                posicao = inicio_dados + tamanho
+        return paginas, posicao
+
+class EscritorPacote:
+        # Com continuar, um pacote parcial existente (de uma execução interrompida) é continuado; senão, é recriado
+        def __init__(self, caminho: Caminho, metadados: Optional[Dict[str, Any]] = None, continuar: bool = False):
+                self.caminho = Path(caminho)
+                self.metadados = dict(metadados or {})
+                self.paginas: Dict[str, List[Any]] = {}
+                self._compactador = zstandard.ZstdCompressor(level=NIVEL_ZSTD) if zstandard else None
+                self.caminho.parent.mkdir(parents=True, exist_ok=True)
+                parcial = caminho_parcial(self.caminho)
+
+                if continuar and parcial.exists():
+                        with open(parcial, 'rb') as f:
+                                dados = f.read()
+                        if dados[:len(MAGIA)] == MAGIA:
+                                self.paginas, fim = _ler_registros(dados, len(MAGIA), len(dados))
+                                self._arquivo = open(parcial, 'r+b')
+                                self._arquivo.truncate(fim)
+                                self._arquivo.seek(fim)
+                                self.posicao = fim
+                                logger.info(f" - Continuando o pacote {parcial}, com {len(self.paginas)} páginas")
+                                return
+
+                self._arquivo = open(parcial, 'wb')
+                self._arquivo.write(MAGIA)
+                self.posicao = len(MAGIA)
+
+        def __len__(self) -> int:
+                return len(self.paginas)
+
+        # Acrescenta uma página ao pacote; se o caminho já foi guardado, a versão nova prevalece
+        def guardar(self, caminho: str, conteudo: bytes, codificacao: str) -> None:
+                if self._compactador is not None:
+                        codec, dados = CODEC_ZSTD, self._compactador.compress(conteudo)
+                else:
+                        codec, dados = CODEC_ZLIB, zlib.compress(conteudo, NIVEL_ZLIB)
+                chave = caminho.encode('utf-8')
+                codificacao_ascii = (codificacao or 'utf-8').encode('ascii')
+                cabecalho = REGISTRO.pack(codec, len(chave), len(codificacao_ascii), len(dados), len(conteudo))
+                self._arquivo.write(cabecalho + chave + codificacao_ascii + dados)
+                inicio_dados = self.posicao + len(cabecalho) + len(chave) + len(codificacao_ascii)
+                self.paginas[caminho] = [inicio_dados, len(dados), len(conteudo), codec, codificacao or 'utf-8']
+                self.posicao = inicio_dados + len(dados)
+                metricas.registro.contar('pacote_bytes_total', len(dados))
+
+        # Grava o índice e o rodapé e dá ao pacote o nome final
+        def concluir(self) -> None:
+                indice = zlib.compress(json.dumps({'metadados': self.metadados, 'paginas': self.paginas},
+                                                  separators=(',', ':')).encode('utf-8'), 9)
+                self._arquivo.write(indice + RODAPE.pack(self.posicao, MAGIA_FIM))
+                self._arquivo.flush()
+                os.fsync(self._arquivo.fileno())
+                self._arquivo.close()
+                os.replace(caminho_parcial(self.caminho), self.caminho)
+                logger.info(f" -   {len(self.paginas)} páginas arquivadas em {self.caminho} ({self.caminho.stat().st_size} bytes)")
+
+        # Fecha sem concluir: o pacote parcial fica para --resume
+        def fechar(self) -> None:
+                self._arquivo.flush()
+                self._arquivo.close()
+
+class Pacote:
+        def __init__(self, caminho: Caminho):
+                self.caminho = Path(caminho)
+                self._arquivo = open(self.caminho, 'rb')
+                self._dados = mmap.mmap(self._arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+                self._descompactador = zstandard.ZstdDecompressor() if zstandard else None
+                if self._dados[:len(MAGIA)] != MAGIA:
+                        self.fechar()
+                        raise ValueError(f"{self.caminho} não é um pacote de páginas")
+
+                posicao, magia = RODAPE.unpack_from(self._dados, len(self._dados) - RODAPE.size) if len(self._dados) >= len(MAGIA) + RODAPE.size else (0, b'')
+                if magia == MAGIA_FIM:
+                        indice = json.loads(zlib.decompress(self._dados[posicao:len(self._dados) - RODAPE.size]))
+                        self.metadados: Dict[str, Any] = indice['metadados']
+                        self.paginas: Dict[str, List[Any]] = indice['paginas']
+                else:
+                        # Pacote parcial: sem índice, os registros são percorridos
+                        self.metadados = {}
+                        self.paginas, _ = _ler_registros(self._dados, len(MAGIA), len(self._dados))
+
+        def __enter__(self) -> 'Pacote':
+                return self
+
+        def __exit__(self, *excecao) -> None:
+                self.fechar()
+
+        def __len__(self) -> int:
+                return len(self.paginas)
+
+        def __contains__(self, caminho: str) -> bool:
+                return caminho in self.paginas
+
+        # Conteúdo bruto e codificação da página, como ClienteJupiter.obter, ou None se não está no pacote
+        def obter(self, caminho: str) -> Optional[Tuple[bytes, str]]:
+                pagina = self.paginas.get(caminho)
+                if pagina is None:
+                        return None
+                inicio, tamanho, original, codec, codificacao = pagina
+                dados = self._dados[inicio:inicio + tamanho]
+                if codec == CODEC_ZSTD:
+                        if self._descompactador is None:
+                                raise RuntimeError(f"{self.caminho} foi compactado com zstd, mas o módulo zstandard não está instalado")
+                        return self._descompactador.decompress(dados, max_output_size=original), codificacao
+                return zlib.decompress(dados), codificacao
+
+        def fechar(self) -> None:
+                self._dados.close()
+                self._arquivo.close()
+
+# Substitui requisicoes.ClienteJupiter numa nova análise (--reparse): as páginas vêm do pacote, sem rede. Uma
+# página ausente é tratada como um pedido que falhou.
+class ClientePacote:
+        def __init__(self, caminho: Caminho):
+                self.pacote = Pacote(caminho)
+                logger.info(f" - Páginas obtidas do pacote {caminho}: {len(self.pacote)} páginas, coletadas em "
+                            f"{self.pacote.metadados.get('data', '?')} de {self.pacote.metadados.get('url_base', '?')}")
+                self.estatisticas: Dict[str, int] = {'pedidos': 0, 'repeticoes': 0, 'falhas': 0, 'bytes': 0}
+
+        # Quando (Unix) a coleta do pacote começou: as páginas foram obtidas a partir daí. None num pacote parcial, que
+        # não tem os metadados.
+        @property
+        def data(self) -> Optional[int]:
+                try:
+                        return int(time.mktime(time.strptime(self.pacote.metadados['data'], '%Y-%m-%dT%H:%M:%S')))
+                except (KeyError, ValueError):
+                        return None
+
+        async def __aenter__(self) -> 'ClientePacote':
+                return self
+
+        async def __aexit__(self, *excecao) -> None:
+                self.pacote.fechar()
+
+        def coletar_metricas(self, registro: metricas.Metricas) -> None:
+                pass
+
+        # verificar_certificado existe só para que a interface seja a de requisicoes.ClienteJupiter
+        async def obter(self, caminho: str, descricao: Optional[str] = None,
+                        verificar_certificado: bool = True) -> Optional[Tuple[bytes, str]]:
+                self.estatisticas['pedidos'] += 1
+                pagina = self.pacote.obter(caminho)
+                if pagina is None:
+                        self.estatisticas['falhas'] += 1
+                        logger.error(f" -      {descricao or caminho} não está no pacote {self.pacote.caminho}")
+                        return None
+                self.estatisticas['bytes'] += len(pagina[0])
+                return pagina
+
+        async def obter_texto(self, caminho: str, descricao: Optional[str] = None,
+                              verificar_certificado: bool = True) -> Optional[str]:
+                pagina = await self.obter(caminho, descricao)
+                return pagina[0].decode(pagina[1], errors='replace') if pagina else None
+
+# Resumo do pacote: número de páginas e tamanhos, por tipo de página
+def resumo(pacote: Pacote) -> Dict[str, Any]:
+        tipos: Dict[str, Dict[str, int]] = {}
+        for caminho, (_, tamanho, original, _, _) in pacote.paginas.items():
+                tipo = tipos.setdefault(caminho.split('?', 1)[0].rsplit('/', 1)[-1], {'paginas': 0, 'bytes': 0, 'bytes_originais': 0})
+                tipo['paginas'] += 1
+                tipo['bytes'] += tamanho
+                tipo['bytes_originais'] += original
+        return {'metadados': pacote.metadados, 'paginas': len(pacote), 'bytes': pacote.caminho.stat().st_size, 'tipos': tipos}
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Pacote de páginas brutas do JupiterWeb")
+        parser.add_argument('arquivo', help="pacote gravado por parse_usp.py --arquivar")
+        parser.add_argument('caminho', nargs='?', help="mostrar o conteúdo desta página (ex.: 'obterTurma?print=true&sgldis=MAC0110')")
+        args = parser.parse_args()
+
+        with Pacote(args.arquivo) as pacote:
+                if args.caminho is None:
+                        print(json.dumps(resumo(pacote), indent=1, ensure_ascii=False))
+                else:
+                        pagina = pacote.obter(args.caminho)
+                        if pagina is None:
+                                sys.exit(f"{args.caminho} não está no pacote")
+                        sys.stdout.write(pagina[0].decode(pagina[1], errors='replace'))
@@ -0,0 +1,235 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Banco de matérias empacotado: o JSON de cada matéria (o mesmo de db/{codigo}.json) e suas variantes
+# pré-compactadas num único arquivo, com um índice ordenado pelo código, em vez de milhares de arquivos soltos em db/.
+# Cada matéria é lida por mmap e busca binária no índice, sem ler o resto do pacote.
+#
+# Formato (inteiros little-endian):
+#   MAGIA (16 bytes), número de formatos compactados (B), nome de cada um (4 bytes, completado com zeros)
+#   conteúdo de cada matéria, seguido das suas variantes compactadas
+#   índice, ordenado pelo código: código (8 bytes, completado com zeros), e para o JSON e cada formato, a posição (Q)
+#   e o tamanho (I)
+#   rodapé: posição do índice (Q), número de matérias (I), MAGIA_FIM (4 bytes)
+#
+# Gravado por parse_usp.py --pacote-materias; com --sem-arquivos-materias, db/{codigo}.json não são mais gravados.
+#
+# Uso: python pacote_materias.py PACOTE [CODIGO]                    resumo do pacote, ou o JSON de uma matéria
+#      python pacote_materias.py PACOTE --servir [--raiz DIR] [--porta N]
+#           servidor HTTP local: /db/{codigo}.json vem do pacote (compactado conforme Accept-Encoding); os demais
+#           caminhos são arquivos de --raiz (padrão: a raiz do repositório, com index.html)
+import os
+import sys
+import mmap
+import json
+import struct
+import logging
+import argparse
+import itertools
+import http.server
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import saida
+
+logger = logging.getLogger('log')
+
+MAGIA = b'MATRUSP-MATERIA1'
+MAGIA_FIM = b'FIM1'
+FORMATO_NOME = struct.Struct('<4s')
+RODAPE = struct.Struct('<QI4s')
+TAMANHO_CODIGO = 8
+
+ARQUIVO_PADRAO = 'materias.pack'
+TAMANHO_LOTE = 256
+
+# Content-Encoding de cada formato de saida.FORMATOS, na ordem de preferência do servidor (como em db/.htaccess)
+CODIFICACOES = {'br': 'br', 'zst': 'zstd', 'gz': 'gzip'}
+
+def _codigo(codigo: str) -> bytes:
+        return codigo.encode('ascii').ljust(TAMANHO_CODIGO, b'\0')
+
+class PacoteMaterias:
+        def __init__(self, caminho: Union[str, Path]):
+                self.caminho = Path(caminho)
+                self._arquivo = open(self.caminho, 'rb')
+                try:
+                        self._dados = mmap.mmap(self._arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                        self._arquivo.close()
+                        raise ValueError(f"{self.caminho} não é um pacote de matérias")
+                if self._dados[:len(MAGIA)] != MAGIA or self._dados[-len(MAGIA_FIM):] != MAGIA_FIM:
+                        self.fechar()
+                        raise ValueError(f"{self.caminho} não é um pacote de matérias")
+                n_formatos = self._dados[len(MAGIA)]
+                inicio = len(MAGIA) + 1
+                self.formatos: List[str] = [FORMATO_NOME.unpack_from(self._dados, inicio + i * FORMATO_NOME.size)[0].rstrip(b'\0').decode('ascii')
+                                            for i in range(n_formatos)]
+                self._entrada = struct.Struct(f'<{TAMANHO_CODIGO}s' + 'QI' * (1 + n_formatos))
+                self._indice, self._numero, _ = RODAPE.unpack_from(self._dados, len(self._dados) - RODAPE.size)
+
+        def __enter__(self) -> 'PacoteMaterias':
+                return self
+
+        def __exit__(self, *excecao) -> None:
+                self.fechar()
+
+        def __len__(self) -> int:
+                return self._numero
+
+        def __contains__(self, codigo: str) -> bool:
+                return self._procurar(codigo) is not None
+
+        def _codigo_em(self, i: int) -> bytes:
+                inicio = self._indice + i * self._entrada.size
+                return self._dados[inicio:inicio + TAMANHO_CODIGO]
+
+        # Busca binária no índice; devolve a entrada da matéria (código, posição, tamanho, ...) ou None
+        def _procurar(self, codigo: str) -> Optional[tuple]:
+                chave = _codigo(codigo)
+                inferior, superior = 0, self._numero
+                while inferior < superior:
+                        meio = (inferior + superior) // 2
+                        if self._codigo_em(meio) < chave:
+                                inferior = meio + 1
+                        else:
+                                superior = meio
+                if inferior < self._numero and self._codigo_em(inferior) == chave:
+                        return self._entrada.unpack_from(self._dados, self._indice + inferior * self._entrada.size)
+                return None
+
+        # JSON da matéria, ou sua variante no formato dado ('gz', 'br', 'zst'); None se não está no pacote
+        def obter(self, codigo: str, formato: Optional[str] = None) -> Optional[bytes]:
+                entrada = self._procurar(codigo)
+                if entrada is None:
+                        return None
+                i = 0 if formato is None else 1 + self.formatos.index(formato)
+                posicao, tamanho = entrada[1 + 2 * i], entrada[2 + 2 * i]
+                return self._dados[posicao:posicao + tamanho]
+
+        def codigos(self) -> List[str]:
+                return [self._codigo_em(i).rstrip(b'\0').decode('ascii') for i in range(self._numero)]
+
+        def fechar(self) -> None:
+                self._dados.close()
+                self._arquivo.close()
+
+# Grava o pacote com as matérias dadas como (codigo, JSON), em qualquer ordem. As variantes das matérias que não
+# mudaram são copiadas do pacote anterior (se houver, e com os mesmos formatos); as demais são compactadas no
+# executor, se houver, em paralelo. O pacote é substituído de forma atômica.
+def gravar(caminho: Union[str, Path], materias: Iterable[Tuple[str, bytes]], compactar: Union[bool, saida.Compressao] = True,
+           executor: Optional[Executor] = None) -> int:
+        caminho = Path(caminho)
+        compressao = saida.Compressao.de(compactar)
+        formatos = compressao.formatos()
+        anterior = None
+        try:
+                anterior = PacoteMaterias(caminho)
+                if anterior.formatos != formatos:
+                        anterior.fechar()
+                        anterior = None
+        except (FileNotFoundError, ValueError):
+                pass
+
+        def variantes(materia: Tuple[str, bytes]) -> Tuple[str, List[bytes]]:
+                codigo, dados = materia
+                if anterior is not None and anterior.obter(codigo) == dados:
+                        return codigo, [dados] + [anterior.obter(codigo, formato) for formato in formatos]
+                return codigo, [dados] + [compressao.compactar(formato, dados) for formato in formatos]
+
+        mapear: Callable = executor.map if executor is not None else map
+        temporario = saida._temporario(caminho)
+        indice: Dict[bytes, List[int]] = {}
+        try:
+                with open(temporario, 'wb') as f:
+                        f.write(MAGIA + bytes([len(formatos)]) + b''.join(FORMATO_NOME.pack(nome.encode('ascii')) for nome in formatos))
+                        posicao = f.tell()
+                        # Em lotes, para que as matérias compactadas e ainda não gravadas não se acumulem na memória
+                        materias = iter(materias)
+                        while True:
+                                lote = list(itertools.islice(materias, TAMANHO_LOTE))
+                                if not lote:
+                                        break
+                                for codigo, partes in mapear(variantes, lote):
+                                        entrada = []
+                                        for parte in partes:
+                                                f.write(parte)
+                                                entrada += [posicao, len(parte)]
+                                                posicao += len(parte)
+                                        indice[_codigo(codigo)] = entrada
+                        entrada_struct = struct.Struct(f'<{TAMANHO_CODIGO}s' + 'QI' * (1 + len(formatos)))
+                        f.write(b''.join(entrada_struct.pack(chave, *indice[chave]) for chave in sorted(indice)))
+                        f.write(RODAPE.pack(posicao, len(indice), MAGIA_FIM))
+                if anterior is not None:
+                        anterior.fechar()
+                        anterior = None
+                os.replace(temporario, caminho)
+        except BaseException:
+                Path(temporario).unlink(missing_ok=True)
+                raise
+        finally:
+                if anterior is not None:
+                        anterior.fechar()
+        logger.info(f" -   Pacote de matérias {caminho}: {len(indice)} matérias, {caminho.stat().st_size} bytes")
+        return len(indice)
+
+# Servidor HTTP local: /db/{codigo}.json vem do pacote, os demais caminhos são arquivos do diretório raiz
+class ServidorPacote(http.server.SimpleHTTPRequestHandler):
+        pacote: PacoteMaterias
+
+        def do_GET(self) -> None:
+                self._responder(True)
+
+        def do_HEAD(self) -> None:
+                self._responder(False)
+
+        def _responder(self, corpo: bool) -> None:
+                caminho = self.path.split('?', 1)[0]
+                nome = caminho.rsplit('/', 1)[-1]
+                if not (caminho.startswith('/db/') and nome.endswith('.json') and caminho.count('/') == 2):
+                        return super().do_GET() if corpo else super().do_HEAD()
+                aceitas = self.headers.get('Accept-Encoding', '')
+                formato = next((f for f, codificacao in CODIFICACOES.items()
+                                if f in self.pacote.formatos and codificacao in aceitas), None)
+                dados = self.pacote.obter(nome[:-len('.json')], formato)
+                if dados is None:
+                        # Não é uma matéria (db.json, busca.json, ...): arquivo do diretório
+                        return super().do_GET() if corpo else super().do_HEAD()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(dados)))
+                self.send_header('Vary', 'Accept-Encoding')
+                if formato:
+                        self.send_header('Content-Encoding', CODIFICACOES[formato])
+                self.end_headers()
+                if corpo:
+                        self.wfile.write(dados)
+
+def servir(pacote: PacoteMaterias, raiz: Union[str, Path], porta: int) -> None:
+        classe = type('Servidor', (ServidorPacote,), {'pacote': pacote})
+        tratador = lambda *a, **k: classe(*a, directory=str(raiz), **k)
+        with http.server.ThreadingHTTPServer(('127.0.0.1', porta), tratador) as servidor:
+                print(f"Servindo {raiz} e {pacote.caminho} em http://127.0.0.1:{porta}/")
+                servidor.serve_forever()
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Pacote de matérias do MatrUSP")
+        parser.add_argument('pacote', help="pacote gravado por parse_usp.py --pacote-materias")
+        parser.add_argument('codigo', nargs='?', help="mostrar o JSON desta matéria")
+        parser.add_argument('--servir', help="servir o pacote em /db/{codigo}.json", action='store_true')
+        parser.add_argument('--raiz', help="diretório dos demais arquivos servidos (padrão: a raiz do repositório)",
+                            default=str(Path(__file__).resolve().parent.parent))
+        parser.add_argument('--porta', type=int, default=8000)
+        args = parser.parse_args()
+
+        with PacoteMaterias(args.pacote) as pacote:
+                if args.servir:
+                        servir(pacote, args.raiz, args.porta)
+                elif args.codigo:
+                        dados = pacote.obter(args.codigo)
+                        if dados is None:
+                                sys.exit(f"{args.codigo} não está no pacote")
+                        sys.stdout.write(dados.decode('utf-8'))
+                else:
+                        print(json.dumps({'materias': len(pacote), 'formatos': pacote.formatos, 'bytes': pacote.caminho.stat().st_size},
+                                         indent=1))
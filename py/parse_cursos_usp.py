@@ -5,156 +5,179 @@ import re
 from pprint import pprint
 import sys
 import aiohttp
-import urllib
 import locale
 import json
 import codecs
 import asyncio
-from bs4 import BeautifulSoup
-import html5lib
 import dateutil
 import dateutil.parser
 import argparse
 import time
 import logging
-import gzip
 from multi_key_dict import multi_key_dict
-
+import analise_html
+import requisicoes
+import saida
+import metricas
+import requisitos
+import modelo
+
+# Dicionário de unidades: a cada código de unidade (chave) é atribuído o nome correspondente
 codigos_unidades = {}
 
-def main():
-	t = time.perf_counter() # Contador de tempo de execução
-
-	logger.info(" - Obtendo a lista de todas as unidades de ensino - ")
-
-	response = urllib.request.urlopen('https://uspdigital.usp.br/jupiterweb/jupColegiadoLista?tipo=T')
-	soup = BeautifulSoup(response.read(), "html5lib")
-
-	# Lista de tags do BeautifulSoup da forma [<a
-	# href="jupColegiadoMenu.jsp?codcg=33&amp;tipo=D&amp;nomclg=Museu+Paulista">Museu
-	# Paulista</a>, ...]
-	links_unidades = soup.find_all('a', href=re.compile("jupColegiadoMenu"))
-
-	# Popular o dicionário de unidades a partir dos links encontrados
-	global codigos_unidades
-	codigos_unidades = {key:value for (key, value) in map(lambda x: (re.search("codcg=(\d+)", x.get('href')).group(1),x.string), links_unidades)}
-	
-	logger.info(" - %d unidades de ensino encontradas - " % (len(codigos_unidades)))
+# Cliente HTTP utilizado por todas as iterações. Quando os cursos são obtidos junto com as disciplinas
+# (parse_usp.py), é o mesmo cliente do parse_usp.
+cliente = None
 
-	# Iniciar a iteração das unidades de acordo com as unidades encontradas ou fornecidas por argumento opcional, de forma assíncrona.
-	if not args.unidades:
-		cursos = loop.run_until_complete(iterar_unidades(codigos_unidades.keys()))
-	else:
-		cursos = loop.run_until_complete(iterar_unidades(args.unidades))
+# Unidades cuja lista de cursos não pôde ser obtida nesta execução. Os cursos dessas unidades no arquivo anterior são
+# mantidos (ver completar_com_anteriores), em vez de sumirem do arquivo.
+unidades_com_falha = set()
 
-	# Salvar em arquivo json
-	cursos_json = json.dumps(cursos)
-	
-	arq = open(os.path.join(args.db_dir, args.out) ,"w")
-	arq.write(cursos_json)
-	arq.close()
+logger = logging.getLogger('log')
 
-	if not args.nogzip:
-		arq = open(os.path.join(args.db_dir, args.out + ".gz") ,"wb")
-		arq.write(gzip.compress(bytes(cursos_json,'utf-8')))
-		arq.close()
+async def main():
+	t = time.perf_counter() # Contador de tempo de execução
 
-	logger.info(f" -   {len(cursos)} cursos salvos")
+	global cliente
+	async with requisicoes.ClienteJupiter(args.url_base, args.simultaneidade, args.timeout, args.tentativas, args.conexoes) as cliente:
+		metricas.registro.coletor(cliente.coletar_metricas)
+		with metricas.perfil(args, 'parse_cursos_usp'), metricas.exportacao(args, 'parse_cursos_usp'):
+			logger.info(" - Obtendo a lista de todas as unidades de ensino - ")
+			texto = await cliente.obter_texto('jupColegiadoLista?tipo=T', "lista de unidades")
+			if texto is None:
+				return 1
+
+			# Popular o dicionário de unidades a partir dos links da forma
+			# ("jupColegiadoMenu.jsp?codcg=33&tipo=D&nomclg=Museu+Paulista", "Museu Paulista")
+			global codigos_unidades
+			codigos_unidades = {re.search(r"codcg=(\d+)", href).group(1): nome for href, nome in analise_html.analisar(texto).links("jupColegiadoMenu")}
+
+			logger.info(" - %d unidades de ensino encontradas - " % (len(codigos_unidades)))
+
+			# Iniciar a iteração das unidades de acordo com as unidades encontradas ou fornecidas por argumento opcional, de forma assíncrona.
+			unidades_com_falha.clear()
+			with saida.Acumulador(args.db_dir, 'cursos') as cursos:
+				await iterar_unidades(args.unidades or list(codigos_unidades.keys()), cursos)
+				with metricas.registro.medir('saida_segundos', arquivo=args.out):
+					gravar(cursos, args.db_dir, args.out, saida.compressao_dos_argumentos(args))
 
 	logger.info(" - FIM! -")
-	logger.info(f" - \n - Tempo de execução: {time.perf_counter() - t} segundos")
-	return 0
-
-async def iterar_unidades(codigos_unidades):
-	# Sessão HTTP global utilizada por todas as iterações
-	global session
-	session = aiohttp.ClientSession()
+	logger.info(f" - \n - Tempo de execução: {time.perf_counter() - t:.2f} segundos")
+	return 0 if relatar_falhas() else 1
+
+# Informa as unidades cuja lista de cursos falhou. False se houve alguma.
+def relatar_falhas():
+	if not unidades_com_falha:
+		return True
+	logger.error(f" - A lista de cursos de {len(unidades_com_falha)} unidades não pôde ser obtida ({', '.join(sorted(unidades_com_falha))}); "
+	             "seus cursos foram mantidos da execução anterior")
+	return False
+
+# Salvar em arquivo json, apenas se mudou desde a última execução. Os cursos (saida.Acumulador) são gravados ordenados
+# pelo código para que a ordem de chegada das respostas não altere o arquivo, um a um, sem montar o arquivo em memória.
+def gravar(cursos, db_dir, nome="cursos.json", compactar=True, executor=None):
+	completar_com_anteriores(cursos, os.path.join(db_dir, nome))
+	manifesto = saida.Manifesto(db_dir, compactar=compactar, arquivo='manifesto_cursos.json', executor=executor)
+	manifesto.gravar_partes(nome, lambda: saida.lista_json(curso for _, curso in cursos.itens()))
+	# Grafo de requisitos e índice de currículos (ver requisitos.py), para consultas sem percorrer todos os cursos
+	requisitos.gravar(manifesto, (modelo.carregar(curso) for _, curso in cursos.itens()))
+	manifesto.salvar()
+	logger.info(f" -   {len(cursos)} cursos salvos")
 
+# Numa execução em que a lista de cursos de alguma unidade falhou, acrescenta aos cursos os dessa unidade que estão no
+# arquivo anterior, para que cursos.json e os arquivos derivados não percam a unidade inteira. Os cursos mantidos não
+# têm o link na chave, que não é gravado no arquivo.
+def completar_com_anteriores(cursos, caminho):
+	if not unidades_com_falha:
+		return
+	nomes = {codigos_unidades[codigo] for codigo in unidades_com_falha if codigo in codigos_unidades}
+	try:
+		with open(caminho, 'rb') as f:
+			anteriores = modelo.carregar(f.read())
+	except (OSError, ValueError) as e:
+		logger.warning(f" -   Os cursos anteriores não puderam ser lidos de {caminho} ({e})")
+		return
+	mantidos = 0
+	for curso in anteriores:
+		if curso.get('unidade') in nomes:
+			cursos.acrescentar((curso.get('codigo') or '', curso.get('periodo') or '', ''), modelo.serializar(curso))
+			mantidos += 1
+	logger.info(f" -   {mantidos} cursos mantidos da execução anterior, por falha ao obter a lista de cursos")
+
+# Obtém os cursos das unidades e os acrescenta, já serializados, ao acumulador cursos
+async def iterar_unidades(codigos_unidades, cursos):
 	#Chamar todas as unidades simultaneamente, de forma assíncrona
-	logger.info(" - Iniciando processamento de unidades")
-	unidade_tasks = (await asyncio.wait([iterar_unidade(i) for i in codigos_unidades]))[0]
+	logger.info(" - Iniciando processamento de unidades (cursos)")
+	cursos_unidades = await asyncio.gather(*[iterar_unidade(i) for i in codigos_unidades])
 
-	logger.info(f" -   {len(unidade_tasks)} unidades processadas")
+	logger.info(f" -   {len(cursos_unidades)} unidades processadas (cursos)")
 	logger.info(" - Iniciando processamento de cursos")
 
-	# Criar uma corotina para cada curso encontrado, de todas as unidades
-	coros = []
-	for cursos_unidade in unidade_tasks:
-		for (curso_link,curso_periodo) in cursos_unidade.result():
-			coros.append(parsear_curso(curso_link,curso_periodo))
-
-	# Chamar todas as matérias simultaneamente, de forma assíncrona
-	#logger.info(f" -   {len(coros)} materias encontradas")
-	cursos_tasks = (await asyncio.wait(tuple(coros)))[0]
-
-	#Fechar a sessão e retornar os resultados.
-	await session.close()
-	#logger.info(f" -   {len(materias_tasks)} materias processadas")
-	return [i.result() for i in cursos_tasks if i.result()]
+	# Chamar todos os cursos, de todas as unidades, simultaneamente
+	await asyncio.gather(*[processar_curso(link, periodo, cursos) for cursos_unidade in cursos_unidades for (link, periodo) in cursos_unidade])
+	logger.info(f" -   {len(cursos)} cursos processados")
 
 async def iterar_unidade(codigo):
-	#logger.debug(" -    Obtendo as materias da unidade %s - " % (codigo))
-	response = await session.get('https://uspdigital.usp.br/jupiterweb/jupCursoLista?tipo=N&codcg=' + codigo, timeout = 120)
-	assert response.status == 200
-	soup = BeautifulSoup(await response.text(), "html5lib")
-	links_cursos = soup.find_all('a', href=re.compile("listarGradeCurricular"))
-
-	cursos = [(link['href'], next(link.find_parent('tr').contents[-2].stripped_strings,'')) for link in links_cursos]
-	#logger.debug(f" -   {len(materias)} materias encontradas na unidade {codigo} - ")
-	
-	#return [i['href'] for i in links_cursos] # Retorna uma lista de matérias para serem buscadas
+	logger.debug(f" -    Obtendo os cursos da unidade {codigo} - ")
+	with metricas.registro.medir('fase_segundos', fase='unidade'):
+		response = await cliente.obter_texto('jupCursoLista?tipo=N&codcg=' + codigo, f"cursos da unidade {codigo}")
+		if response is None:
+			unidades_com_falha.add(codigo)
+			return []
+		try:
+			# O período é a primeira string da penúltima célula da linha do link
+			links_cursos = analise_html.analisar(response).links_com_linha("listarGradeCurricular")
+			cursos = [(href, next(iter(celulas[-2]), '') if len(celulas) > 1 else '') for href, celulas in links_cursos]
+		except Exception:
+			logger.exception(f" -    Não foi possível obter os cursos da unidade {codigo}")
+			unidades_com_falha.add(codigo)
+			return []
+	logger.debug(f" -   {len(cursos)} cursos encontrados na unidade {codigo} - ")
 	return cursos # Retorna uma lista de (link, periodo) para serem buscadas
 
-#Tabelas sem tabelas dentro
-def eh_tabela_folha(tag):
-	return tag.name == "table" and tag.table == None
+# Um curso que não pôde ser processado não interrompe os demais
+async def processar_curso(link, periodo, cursos):
+	try:
+		with metricas.registro.medir('fase_segundos', fase='curso'):
+			curso = await parsear_curso(link, periodo)
+	except Exception:
+		logger.exception(f" -      Não foi possível processar o curso {link}")
+		metricas.registro.contar('cursos_total', estado='falha')
+		return
+	metricas.registro.contar('cursos_total', estado='ok' if curso else 'ignorado')
+	if curso:
+		cursos.acrescentar((curso.codigo, curso.periodo, link), modelo.serializar(curso))
 
 async def parsear_curso(link,periodo):
 	if not link:
 		return
 
-	link = 'https://uspdigital.usp.br/jupiterweb/' + link
+	logger.debug(f" -      Obtendo informações de {link}")
+	response = await cliente.obter_texto(link, f"informações de {link}", verificar_certificado=False)
+	if response is None:
+		return
 
-	async with semaforo:
-		logger.debug(f" -      Obtendo informações de {link}")
-		try:
-			response = await session.get(link, timeout=args.timeout, verify_ssl=False)
-			assert response.status == 200
-			response = await response.text()
-		except asyncio.TimeoutError: # Tentar acessar o jupiterWeb novamente, caso o pedido falhe.
-			try:
-				logger.warn(f" -      O pedido de {link} excedeu o tempo limite do pedido. Tentando novamente...")
-				response = await session.get(link, timeout=args.timeout*2, verify_ssl=False)
-				assert response.status == 200
-				response = await response.text()
-			except asyncio.TimeoutError:
-				logger.error(f" -      O pedido de {link} excedeu o tempo limite do pedido")
-				return
-		except:
-			logger.exception(f" -      Não foi possível obter informações de {link}")
-			return
-
-		soup = BeautifulSoup(response, "html5lib")
-		tabelas_folha = soup.find_all(eh_tabela_folha)
-		
+	with metricas.registro.medir('fase_segundos', fase='html'):
+		documento = analise_html.analisar(response)
+		tabelas_folha = documento.tabelas_folha()
 
-		curso = {'periodo': periodo}
-		re_codigo = re.search("codcur=(.+?)&codhab=(.+?)(&|$)",link)
-		curso['codigo'] = f"{re_codigo.group(1)}-{re_codigo.group(2)}"
-		curso['nome'] = ' - '.join(x.group(1) for x in re.finditer("Curso:\s*(.+)\s*", soup.get_text()))
-		curso['unidade'] = codigos_unidades[re.search("codcg=([1-9]+)",link).group(1)]
-		
-		re_disciplinas = re.compile("Disciplinas\s+Obrigatórias")
-		for folha in tabelas_folha:
-			if folha.find(text=re_disciplinas):
-				curso['periodos'] = parsear_periodos(folha)
-				break
+	re_codigo = re.search("codcur=(.+?)&codhab=(.+?)(&|$)",link)
+	curso = modelo.Curso(modelo.texto(periodo), f"{re_codigo.group(1)}-{re_codigo.group(2)}",
+		' - '.join(x.group(1) for x in re.finditer("Curso:\s*(.+)\s*", documento.texto())),
+		modelo.texto(codigos_unidades[re.search(r"codcg=(\d+)",link).group(1)]), None)
+	
+	re_disciplinas = re.compile("Disciplinas\s+Obrigatórias")
+	for folha in tabelas_folha:
+		if folha.contem(re_disciplinas):
+			curso.periodos = parsear_periodos(folha)
+			break
 
-		return curso
+	return curso
 
 
+@metricas.medida
 def parsear_periodos(folha):
-	trs = folha.find_all('tr')
+	trs = folha.linhas
 	periodos = {}
 
 	switch_tipos = {
@@ -168,30 +191,29 @@ def parsear_periodos(folha):
 	tipo = ''
 	periodo = ''
 	for tr in trs:
-		str = re.sub("\s+"," ",next(tr.stripped_strings,''))
+		str = re.sub("\s+"," ",next(iter(tr.textos),''))
 
 		if str and switch_tipos.get(str):
 			tipo = switch_tipos[str]
 			continue
 		elif str and re_periodo.search(str):
 			periodo = re_periodo.search(str).group(1)
-			if not periodo in periodos: periodos[periodo] = []
+			if not periodo in periodos: periodos[modelo.texto(periodo)] = []
 			continue
 		else:
-			try: tds = [next(td.stripped_strings, '') for td in tr.find_all('td')]
-			except AttributeError as e: continue
+			tds = [next(iter(td), '') for td in tr.celulas]
 			if len(tds[0]) == 7:
-				periodos[periodo].append({'codigo': tds[0], 'tipo': tipo, 'req_fraco': [], 'req_forte': [], 'ind_conjunto': []})
+				periodos[periodo].append(modelo.MateriaCurso(modelo.texto(tds[0]), tipo, [], [], []))
 				continue
 			else:
 				if len(tds) < 2:
 					continue
 				if tds[1] == "Requisito fraco":
-					periodos[periodo][-1]['req_fraco'].append(tds[0][0:7])
+					periodos[periodo][-1].req_fraco.append(modelo.texto(tds[0][0:7]))
 				elif tds[1] == "Requisito":
-					periodos[periodo][-1]['req_forte'].append(tds[0][0:7])
+					periodos[periodo][-1].req_forte.append(modelo.texto(tds[0][0:7]))
 				elif tds[1] == "Indicação de Conjunto":
-					periodos[periodo][-1]['ind_conjunto'].append(tds[0][0:7])
+					periodos[periodo][-1].ind_conjunto.append(modelo.texto(tds[0][0:7]))
 				continue
 
 	return periodos
@@ -204,11 +226,23 @@ if __name__ == "__main__":
 	parser.add_argument('diretorio_destino', help="diretório que irá conter os arquivos resultantes")
 	parser.add_argument('-v','--verbosidade',action = 'count', default = 0)
 	parser.add_argument('-u','--unidades', help=  "iterar apenas estes códigos de unidade", nargs = '+')
-	parser.add_argument('-s','--simultaneidade',help = "número de pedidos HTTP simultâneos", type=int, default=10)
+	parser.add_argument('-s','--simultaneidade',help = "número máximo de pedidos HTTP simultâneos (o número efetivo é ajustado conforme a resposta do servidor)", type=int, default=10)
+	parser.add_argument('--conexoes',help = "número máximo de conexões abertas com o JupiterWeb (padrão: --simultaneidade)", type=int)
+	parser.add_argument('--tentativas',help = "número de tentativas de cada pedido HTTP", type=int, default=5)
 	parser.add_argument('-t','--timeout',help = "tempo máximo (segundos) do pedido HTTP", type=int, default=120)
 	parser.add_argument('-o','--out',help="arquivo de saída do banco de dados completo", type=str, default="cursos.json")
 	parser.add_argument('--nogzip',help = "não compactar os arquivos de saída", action='store_true')
+	saida.adicionar_argumentos(parser)
+	metricas.adicionar_argumentos(parser)
+	parser.add_argument('--url-base',help = "endereço base do JupiterWeb", type=str, default=requisicoes.URL_BASE_PADRAO)
+	parser.add_argument('--parser',help = "backend de análise de HTML", choices=list(analise_html.BACKENDS), default=analise_html.backend_atual)
 	args = parser.parse_args()
+	args.url_base = args.url_base.rstrip('/')
+	analise_html.definir_backend(args.parser)
+	try:
+		saida.compressao_dos_argumentos(args)
+	except ValueError as e:
+		parser.error(str(e))
 
 	if not args.diretorio_destino:
 		parser.print_help()
@@ -219,7 +253,6 @@ if __name__ == "__main__":
 		parser.print_help()
 		exit(1)
 
-	logger = logging.getLogger('log')
 	logger.setLevel(logging.DEBUG)
 
 	# Enviar log para o console
@@ -236,7 +269,7 @@ if __name__ == "__main__":
 
 	sys.excepthook = lambda e, v, tb : logger.exception("Uncaught exception", exc_info = (e, v, tb))
 
-	loop = asyncio.get_event_loop()
-	semaforo = asyncio.Semaphore(args.simultaneidade, loop = loop)
+	if sys.platform == 'win32':
+		asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-	exit(main())
\ No newline at end of file
+	exit(asyncio.run(main()))
\ No newline at end of file
@@ -10,19 +10,37 @@ import urllib
 import locale
 import json
 import codecs
+import zlib
 import asyncio
-from bs4 import BeautifulSoup
-import html5lib
 import dateutil
 import dateutil.parser
 import argparse
 import time
 import logging
-import gzip
+import shutil
+import multiprocessing
 from multi_key_dict import multi_key_dict
-from typing import Dict, List, Tuple, Any, Optional
-from dataclasses import dataclass
+from typing import Dict, List, Tuple, Optional, Set, AsyncIterator, Iterator, Union
+from dataclasses import replace
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
+import analise_html
+import requisicoes
+import saida
+import versoes
+import indice_busca
+import fragmentos
+import diario
+import metricas
+import pacote
+import banco_sqlite
+import pacote_materias
+import compacto
+import modelo
+import particoes
+import historico
+import parse_cursos_usp
+from requisicoes import URL_BASE_PADRAO
 
 # Criar um dicionário onde as chaves são as unidades, e o valor de cada chave é o campus correspondente.
 # Essa lista é atualizada manualmente dada a baixa frequência de criação de novas unidades.
@@ -39,24 +57,286 @@ campus_por_unidade[30] = "São Sebastião"
 # Dicionario de unidades. A cada nome de unidade (chave) é atribuído o código correspondente.
 codigos_unidades: Dict[str, str] = {}
 
+# TraceConfigs adicionais repassados às sessões HTTP (usados pelo benchmark_crawler.py para medir latências)
+configuracoes_trace: List[aiohttp.TraceConfig] = []
+
+# Cliente HTTP da execução, compartilhado com parse_cursos_usp
+_cliente: Optional[requisicoes.ClienteJupiter] = None
+
+# Pool de processos usado na análise das páginas (None: análise no próprio event loop)
+_executor: Optional[ProcessPoolExecutor] = None
+
+# Pool de threads que serializa, compacta e grava os arquivos de saída (None: no próprio event loop)
+_escritores: Optional[ThreadPoolExecutor] = None
+
+# Manifesto com o hash de cada arquivo de saída: só arquivos com conteúdo novo são regravados
+_manifesto: Optional[saida.Manifesto] = None
+
+# Diário de progresso da execução, para --resume (ver diario.py)
+_diario: Optional[diario.Diario] = None
+
+# Pacote em que as páginas obtidas são guardadas, com --arquivar (ver pacote.py)
+_pacote: Optional[pacote.EscritorPacote] = None
+
+# Pacote de matérias da execução anterior, com --pacote-materias (ver pacote_materias.py): com
+# --sem-arquivos-materias, é de onde as matérias já conhecidas são lidas
+_pacote_materias: Optional[pacote_materias.PacoteMaterias] = None
+
+# Histórico das vagas, com --historico (ver historico.py): as vagas de cada página obterTurma analisada são
+# acrescentadas ao fim da execução
+_historico: Optional[historico.EscritorHistorico] = None
+
+# Quando (Unix) as informações de obterDisciplina de cada matéria foram obtidas pela última vez, para --vagas
+_atualizacoes: Dict[str, int] = {}
+ARQUIVO_ATUALIZACOES = 'atualizacoes.json'
+
+# Matérias e unidades que não puderam ser obtidas nesta execução. Seus arquivos anteriores são mantidos, em vez de
+# removidos como os de matérias que deixaram de ser oferecidas.
+materias_com_falha: Set[str] = set()
+unidades_com_falha: Set[str] = set()
+
+logger = logging.getLogger('log')
+
 async def main() -> int:
         t = time.perf_counter() # Contador de tempo de execução
 
-        logger.info(" - Obtendo a lista de todas as unidades de ensino - ")
+        db_path = Path(args.db_dir)
+        db_path.mkdir(parents=True, exist_ok=True)
+
+        saida.remover_temporarios(db_path)
+        if args.particao:
+                particoes.descartar(db_path)
+
+        # Os arquivos são compactados e gravados pelas threads de escrita, para que o event loop não pare no disco
+        global _manifesto, _escritores
+        compressao = saida.compressao_dos_argumentos(args)
+        logger.info(f" - Compressão dos arquivos de saída: {compressao}")
+        if args.escritores:
+                _escritores = ThreadPoolExecutor(args.escritores, thread_name_prefix='escritor')
+        _manifesto = saida.Manifesto(db_path, compactar=compressao, executor=_escritores)
+        materias_com_falha.clear()
+        unidades_com_falha.clear()
+        parse_cursos_usp.unidades_com_falha.clear()
+        carregar_atualizacoes(db_path)
+
+        # Com --resume, as matérias concluídas antes da interrupção são lidas do disco e só o resto é baixado
+        global _diario
+        _diario = diario.Diario(db_path, retomar=args.retomar, url_base=args.url_base, unidades=args.unidades, reparse=args.reparse)
+        if _diario.estados or _diario.unidades:
+                resumo = _diario.resumo()
+                logger.info(f" - Retomando a execução interrompida: {len(_diario.unidades)} unidades listadas, {resumo[diario.CONCLUIDA]} materias "
+                            f"concluídas, {resumo[diario.IGNORADA]} ignoradas, {resumo[diario.FALHA]} com falha")
+
+        # Com --arquivar, cada página obtida é guardada no pacote, para uma nova análise sem a rede (--reparse)
+        global _pacote
+        if args.arquivar:
+                _pacote = pacote.EscritorPacote(args.arquivar, continuar=args.retomar, metadados={
+                        'data': time.strftime('%Y-%m-%dT%H:%M:%S'), 'url_base': args.url_base, 'unidades': args.unidades})
+
+        global _pacote_materias
+        if args.pacote_materias and (db_path / args.pacote_materias).exists():
+                try:
+                        _pacote_materias = pacote_materias.PacoteMaterias(db_path / args.pacote_materias)
+                except ValueError as e:
+                        logger.warning(f" - {e}; o pacote será recriado")
+
+        global _historico
+        if args.historico:
+                _historico = historico.EscritorHistorico(db_path / args.historico)
+
+        metricas.registro.coletor(coletar_metricas)
+
+        # As matérias e os cursos são serializados assim que chegam e guardados em disco até o fim, de forma que a
+        # memória usada depende só das matérias em processamento, e não do tamanho do catálogo (ver saida.Acumulador)
+        with metricas.perfil(args, 'parse_usp'), metricas.exportacao(args, 'parse_usp'), saida.Acumulador(db_path, 'materias') as materias, saida.Acumulador(db_path, 'cursos') as cursos:
+                # Cliente HTTP global, compartilhado pela lista de unidades, pelas matérias e pelos cursos: uma única
+                # sessão, um único pool de conexões e um único limite de pedidos simultâneos para todo o JupiterWeb
+                global _cliente
+                try:
+                        if args.particoes:
+                                localizacao = await coletar_particoes(materias, cursos)
+                        elif args.juntar:
+                                localizacao = juntar_entregas([particoes.ler(d) for d in args.juntar], materias, cursos)
+                        else:
+                                async with criar_cliente() as _cliente:
+                                        localizacao = await coletar(materias, cursos)
+                                        logger.info(f" -   {_cliente.estatisticas['pedidos']} pedidos HTTP, {_cliente.estatisticas['repeticoes']} repetições, "
+                                                    f"{_cliente.estatisticas['falhas']} falhas")
+                        if _pacote is not None:
+                                _pacote.concluir()
+                        if localizacao is not None and args.particao:
+                                particoes.gravar(db_path, materias, cursos, particoes.Entrega(
+                                        db_path, codigos_unidades, args.unidades or list(codigos_unidades.values()), sorted(unidades_com_falha), sorted(materias_com_falha),
+                                        _atualizacoes, localizacao, sorted(parse_cursos_usp.unidades_com_falha)))
+                        elif localizacao is not None:
+                                gravar_saidas(db_path, materias, localizacao, cursos)
+                        if localizacao is not None and _historico is not None:
+                                _historico.concluir()
+                except BaseException:
+                        _diario.fechar()
+                        if _pacote is not None:
+                                _pacote.fechar()
+                        raise
+                finally:
+                        if _escritores is not None:
+                                _escritores.shutdown()
+                                _escritores = None
+                        if _pacote_materias is not None:
+                                _pacote_materias.fechar()
+                                _pacote_materias = None
+                        if _historico is not None:
+                                _historico.fechar()
+                                _historico = None
+                if localizacao is None:
+                        _diario.fechar()
+                        return 1
+
+        # Sem falhas, não há o que retomar; com falhas, --resume tenta de novo só as matérias e unidades que falharam
+        _diario.fechar(remover=not materias_com_falha and not unidades_com_falha)
+
+        logger.info(f" -   {_manifesto.estatisticas['gravados']} arquivos gravados, {_manifesto.estatisticas['inalterados']} inalterados, "
+                    f"{_manifesto.estatisticas['removidos']} removidos")
+
+        # A falha na lista de cursos de uma unidade não aparece nos arquivos (os cursos anteriores são mantidos), então
+        # é informada no código de saída. Numa partição, vai na entrega, e quem a informa é a junção.
+        cursos_completos = args.sem_cursos or args.vagas or args.particao or parse_cursos_usp.relatar_falhas()
+
+        logger.info(" - FIM! -")
+        logger.info(f" - \n - Tempo de execução: {time.perf_counter() - t:.2f} segundos")
+        return 0 if cursos_completos else 1
+
+# Métricas instantâneas da execução, atualizadas a cada exportação
+def coletar_metricas(registro: metricas.Metricas) -> None:
+        if _cliente is not None:
+                _cliente.coletar_metricas(registro)
+        if _manifesto is not None:
+                for resultado in ('gravados', 'inalterados', 'removidos'):
+                        registro.definir('arquivos', _manifesto.estatisticas[resultado], resultado=resultado)
+
+# Grava os arquivos agregados a partir das matérias e dos cursos acumulados
+def gravar_saidas(db_path: Path, materias: saida.Acumulador, localizacao: Dict[str, Tuple[str, str]], cursos: saida.Acumulador) -> None:
+        # Salvar em arquivo json (a lista das matérias, como serializadas por modelo.serializar). As matérias chegam na ordem
+        # em que são processadas; ordená-las pelo código faz com que o arquivo só mude quando alguma matéria mudar.
+        medir = metricas.registro.medir
+        completar_com_anteriores(materias, localizacao)
+        codigos = materias.chaves()
+        with medir('saida_segundos', arquivo=args.out):
+                _manifesto.gravar_partes(args.out, lambda: saida.lista_json(materias.ler(c) for c in codigos))
+
+        # O mesmo conteúdo no formato compacto (ver compacto.py), que também vai para as versões, onde o cliente o prefere
+        # ao snapshot. Só com --compacto: compacto.codificar monta as colunas do catálogo inteiro em memória, o que o
+        # acumulador evita no resto da gravação. Sem ele, o arquivo de uma execução anterior é removido, para que não
+        # fique um catálogo desatualizado.
+        compacto_json = None
+        if args.compacto:
+                with medir('saida_segundos', arquivo=compacto.ARQUIVO):
+                        compacto_json = compacto.serializar(compacto.codificar(modelo.carregar(materias.ler(c)) for c in codigos))
+                        _manifesto.gravar(compacto.ARQUIVO, compacto_json)
+        else:
+                _manifesto.remover(compacto.ARQUIVO)
+
+        # Índice de busca pré-calculado, para que os clientes não precisem recalculá-lo a partir de db.json
+        with medir('saida_segundos', arquivo='busca.json'):
+                busca_json = json.dumps(indice_busca.gerar(modelo.carregar(materias.ler(c)) for c in codigos), separators=(',', ':'))
+                _manifesto.gravar('busca.json', busca_json)
+
+        if args.fragmentos or args.fragmentos_unidades:
+                with medir('saida_segundos', arquivo='fragmentos'):
+                        fragmentos.Fragmentos(_manifesto, por_unidade=args.fragmentos_unidades).gravar(
+                                materias, localizacao, codigos_unidades, remover_antigos=not args.unidades and not unidades_com_falha)
+
+        if args.pacote_materias:
+                with medir('saida_segundos', arquivo=args.pacote_materias):
+                        pacote_materias.gravar(db_path / args.pacote_materias, materias_do_pacote(materias, codigos),
+                                               compactar=_manifesto.compressao, executor=_escritores)
+
+        remover_materias_antigas(set(codigos))
+        _manifesto.salvar()
+        salvar_atualizacoes(db_path, set(codigos))
+
+        if not args.sem_cursos and not args.vagas:
+                with medir('saida_segundos', arquivo='cursos.json'):
+                        parse_cursos_usp.gravar(cursos, db_path, compactar=_manifesto.compressao, executor=_escritores)
+
+        # Versões e patches para a atualização incremental dos clientes. Assim como a remoção de matérias antigas, só
+        # quando todas as unidades foram percorridas: numa execução parcial, as matérias ausentes seriam removidas.
+        if args.versoes and not args.unidades and not unidades_com_falha:
+                with medir('saida_segundos', arquivo='versoes'):
+                        versoes.Versoes(db_path, compactar=_manifesto.compressao, manter=args.versoes, executor=_escritores).publicar(materias, busca_json, compacto_json)
+
+        # Banco SQLite para consultas no servidor. Sem os cursos desta execução (--vagas, --sem-cursos), usa os de
+        # cursos.json.
+        if args.sqlite:
+                with medir('saida_segundos', arquivo='sqlite'):
+                        lista_cursos = ((modelo.carregar(c) for _, c in cursos.itens()) if len(cursos)
+                                        else banco_sqlite.carregar_json(db_path / 'cursos.json'))
+                        banco_sqlite.exportar(db_path / args.sqlite, (modelo.carregar(materias.ler(c)) for c in codigos), lista_cursos,
+                                              metadados={'url_base': args.url_base, 'unidades': args.unidades})
+
+        logger.info(f" -   {len(materias)} materias salvas")
+
+# Obtém a lista de unidades e, a partir dela, as matérias e os cursos, ao mesmo tempo e na mesma sessão, e os
+# acrescenta, já serializados, aos acumuladores. Devolve o campus e a unidade de cada matéria, ou None se a lista de
+# unidades não pôde ser obtida.
+async def coletar(materias: saida.Acumulador, cursos: saida.Acumulador) -> Optional[Dict[str, Tuple[str, str]]]:
+        if not await obter_unidades():
+                return None
+        # Numa partição, campi.json é gravado na junção, a partir da lista de unidades da entrega
+        if not args.particao:
+                gravar_campi()
+        unidades = args.unidades or list(codigos_unidades.values())
+
+        # Os cursos são obtidos por parse_cursos_usp.py, com o mesmo cliente, enquanto as matérias são processadas
+        tarefa_cursos = None
+        if not args.sem_cursos and not args.vagas:
+                parse_cursos_usp.cliente = _cliente
+                parse_cursos_usp.codigos_unidades = {codigo: unidade for unidade, codigo in codigos_unidades.items()}
+                tarefa_cursos = asyncio.create_task(parse_cursos_usp.iterar_unidades(unidades, cursos))
 
-        async with aiohttp.ClientSession() as temp_session:
-            async with temp_session.get('https://uspdigital.usp.br/jupiterweb/jupColegiadoLista?tipo=T') as response:
-                soup = BeautifulSoup(await response.text(), "html5lib")
+        # Pool de processos para a análise das páginas, de forma que o event loop só cuide da rede
+        global _executor
+        if args.workers:
+                _executor = ProcessPoolExecutor(args.workers, initializer=inicializar_worker,
+                                                initargs=(codigos_unidades, analise_html.backend_atual))
+        try:
+                # Iniciar a iteração das unidades de acordo com as unidades encontradas ou fornecidas por argumento opcional, de forma assíncrona.
+                # Cada matéria chega já codificada (os mesmos bytes de db/{codigo}.json), e é guardada só no acumulador até
+                # o fim, para os arquivos completos.
+                localizacao = {} # Campus e unidade de cada matéria, para os fragmentos
+                async for materia, dados in iterar_unidades(unidades):
+                        materias.acrescentar(materia.codigo, dados)
+                        localizacao[materia.codigo] = (materia.campus, materia.unidade)
+                if tarefa_cursos:
+                        await tarefa_cursos
+        finally:
+                if tarefa_cursos and not tarefa_cursos.done():
+                        tarefa_cursos.cancel()
+                if _executor is not None:
+                        _executor.shutdown()
+                        _executor = None
+
+        return localizacao
 
-        # Lista de tags do BeautifulSoup da forma [<a
-        # href="jupColegiadoMenu.jsp?codcg=33&amp;tipo=D&amp;nomclg=Museu+Paulista">Museu
-        # Paulista</a>, ...]
-        links_unidades = soup.find_all('a', href=re.compile("jupColegiadoMenu"))
+# Obtém a lista de unidades do JupiterWeb, em codigos_unidades. False se não pôde ser obtida.
+async def obter_unidades() -> bool:
+        logger.info(" - Obtendo a lista de todas as unidades de ensino - ")
+        with metricas.registro.medir('fase_segundos', fase='lista_unidades'):
+                texto = await _cliente.obter_texto('jupColegiadoLista?tipo=T', "lista de unidades")
+                if texto is None:
+                        return False
+                documento = analise_html.analisar(texto)
+
+                # Lista de (href, texto) dos links da forma [("jupColegiadoMenu.jsp?codcg=33&tipo=D&nomclg=Museu+Paulista",
+                # "Museu Paulista"), ...]
+                links_unidades = documento.links("jupColegiadoMenu")
 
         # Popular o dicionário de unidades a partir dos links encontrados
         global codigos_unidades
-        codigos_unidades = {x.string: re.search(r"codcg=(\d+)", x.get('href')).group(1) for x in links_unidades}
+        codigos_unidades = {texto: re.search(r"codcg=(\d+)", href).group(1) for href, texto in links_unidades}
+        logger.info(f" - {len(codigos_unidades)} unidades de ensino encontradas - ")
+        return True
 
+def gravar_campi() -> None:
         campi = {}
         for unidade, codigo in codigos_unidades.items():
                 campus = campus_por_unidade.get(int(codigo), 'Outro')
@@ -64,212 +344,518 @@ async def main() -> int:
                     campi[campus] = []
                 campi[campus].append(unidade)
 
-        campi_json = json.dumps(campi)
-        
-        db_path = Path(args.db_dir)
-        db_path.mkdir(parents=True, exist_ok=True)
-        
-        campi_file = db_path / 'campi.json'
-        campi_file.write_text(campi_json)
+        _manifesto.gravar('campi.json', json.dumps(campi))
 
-        if not args.nogzip:
-                with gzip.open(db_path / 'campi.json.gz', 'wb') as f:
-                    f.write(campi_json.encode('utf-8'))
+# Com --particoes, as unidades são divididas entre processos, cada um com sua sessão HTTP, que gravam suas entregas em
+# db/.particoes/{i} (ver particoes.py); as entregas são então juntadas como com --juntar. As unidades de uma partição
+# que falhou são tratadas como unidades com falha: seus arquivos anteriores são mantidos.
+async def coletar_particoes(materias: saida.Acumulador, cursos: saida.Acumulador) -> Optional[Dict[str, Tuple[str, str]]]:
+        global _cliente
+        async with criar_cliente() as _cliente:
+                if not await obter_unidades():
+                        return None
+        unidades = args.unidades or list(codigos_unidades.values())
+        divisao = particoes.dividir(unidades, args.particoes)
+        raiz = Path(args.db_dir) / particoes.DIRETORIO_PARTICOES
+        shutil.rmtree(raiz, ignore_errors=True)
 
-        logger.info(f" - {len(codigos_unidades)} unidades de ensino encontradas - ")
+        # Processos novos (spawn), e não cópias deste: cada partição tem seu próprio event loop, sessão e pool de análise
+        contexto = multiprocessing.get_context('spawn')
+        processos = []
+        for i, particao in enumerate(divisao):
+                diretorio = raiz / str(i)
+                diretorio.mkdir(parents=True)
+                argumentos = argparse.Namespace(**vars(args))
+                argumentos.diretorio_destino = argumentos.db_dir = str(diretorio)
+                argumentos.unidades = particao
+                argumentos.particoes = None
+                argumentos.particao = True
+                argumentos.metricas = None
+                if args.perfil is not None:
+                        argumentos.perfil = str(metricas.arquivo_perfil(args.perfil, 'parse_usp').with_suffix(f".particao-{i}.prof"))
+                processo = contexto.Process(target=executar_particao, args=(argumentos,), name=f"particao-{i}")
+                processo.start()
+                processos.append(processo)
+        logger.info(f" - {len(unidades)} unidades divididas em {len(processos)} partições")
+        try:
+                await asyncio.gather(*[asyncio.to_thread(processo.join) for processo in processos])
+        finally:
+                for processo in processos:
+                        if processo.is_alive():
+                                processo.terminate()
 
-        # Iniciar a iteração das unidades de acordo com as unidades encontradas ou fornecidas por argumento opcional, de forma assíncrona.
-        materias = await iterar_unidades(args.unidades or list(codigos_unidades.values()))
+        entregas = []
+        for i, (processo, particao) in enumerate(zip(processos, divisao)):
+                try:
+                        if processo.exitcode != 0:
+                                raise ValueError(f"código de saída {processo.exitcode}")
+                        entregas.append(particoes.ler(raiz / str(i)))
+                except (OSError, ValueError) as e:
+                        logger.error(f" -   A partição {i} (unidades {', '.join(particao)}) falhou ({e}); log em {raiz / str(i) / ARQUIVO_LOG_PARTICAO}")
+                        unidades_com_falha.update(particao)
+                        parse_cursos_usp.unidades_com_falha.update(particao)
+        if not entregas:
+                return None
+        localizacao = juntar_entregas(entregas, materias, cursos)
+        if not unidades_com_falha:
+                shutil.rmtree(raiz, ignore_errors=True)
+        return localizacao
 
-        # Salvar em arquivo json
-        materias_json = json.dumps(materias)
-        
-        output_file = db_path / args.out
-        output_file.write_text(materias_json)
+# Junta as entregas das partições (--particoes ou --juntar) nos acumuladores, com o estado de cada uma: unidades e
+# matérias com falha e datas de atualização. As unidades que nenhuma partição percorreu contam como unidades com falha.
+def juntar_entregas(entregas: List[particoes.Entrega], materias: saida.Acumulador, cursos: saida.Acumulador) -> Dict[str, Tuple[str, str]]:
+        global codigos_unidades
+        for entrega in entregas:
+                codigos_unidades = codigos_unidades or entrega.unidades
+                unidades_com_falha.update(entrega.unidades_com_falha)
+                parse_cursos_usp.unidades_com_falha.update(entrega.unidades_cursos_com_falha)
+                materias_com_falha.update(entrega.materias_com_falha)
+                _atualizacoes.update(entrega.atualizacoes)
+        localizacao, percorridas = particoes.juntar(entregas, materias, cursos)
+        # db/{codigo}.json, que as partições não gravam
+        codigos = materias.chaves()
+        list((_escritores.map if _escritores is not None else map)(gravar_arquivo_materia, codigos, [materias.ler(c) for c in codigos]))
+        nao_percorridas = set(args.unidades or codigos_unidades.values()).difference(percorridas)
+        unidades_com_falha.update(nao_percorridas)
+        parse_cursos_usp.unidades_com_falha.update(nao_percorridas)
+        parse_cursos_usp.codigos_unidades = {codigo: unidade for unidade, codigo in codigos_unidades.items()}
+        if codigos_unidades:
+                gravar_campi()
+        return localizacao
 
-        if not args.nogzip:
-                with gzip.open(output_file.with_suffix('.json.gz'), 'wb') as f:
-                    f.write(materias_json.encode('utf-8'))
+# Remove os arquivos das matérias que deixaram de ser oferecidas. Só é feito quando todas as unidades foram
+# percorridas com sucesso: com -u, ou se a lista de alguma unidade falhou, não há como saber quais matérias sumiram.
+# Com --sem-arquivos-materias, as matérias já estão no pacote e os arquivos soltos de execuções anteriores são todos
+# removidos.
+def remover_materias_antigas(codigos: Set[str]) -> None:
+        if not args.sem_arquivos_materias and (args.unidades or unidades_com_falha):
+                return
+        for nome in list(_manifesto.hashes):
+                codigo = nome[:-len('.json')]
+                if not re_arquivo_materia.fullmatch(nome):
+                        continue
+                if args.sem_arquivos_materias:
+                        _manifesto.remover(nome)
+                elif codigo not in codigos and codigo not in materias_com_falha:
+                        logger.debug(f" -      Removendo {codigo}, que não é mais oferecida")
+                        _manifesto.remover(nome)
 
-        logger.info(f" -   {len(materias)} materias salvas")
+# Numa execução com falhas, acrescenta às matérias as já gravadas que não puderam ser obtidas agora: as das unidades
+# cuja lista falhou e as que falharam. Assim db.json, os arquivos derivados e as versões continuam com as mesmas
+# matérias dos arquivos de cada matéria, que são mantidos, em vez de publicar um catálogo menor.
+def completar_com_anteriores(materias: saida.Acumulador, localizacao: Dict[str, Tuple[str, str]]) -> None:
+        if not unidades_com_falha and not materias_com_falha:
+                return
+        anteriores = set(_pacote_materias.codigos()) if _pacote_materias is not None else set()
+        anteriores.update(nome[:-len('.json')] for nome in _manifesto.hashes if re_arquivo_materia.fullmatch(nome))
+        mantidas = 0
+        for codigo in sorted(anteriores):
+                if codigo in materias:
+                        continue
+                try:
+                        dados = ler_materia_gravada(codigo)
+                        materia = modelo.carregar(dados) if dados is not None else None
+                except (OSError, ValueError):
+                        continue
+                if materia is None or (codigo not in materias_com_falha and codigos_unidades.get(materia.get('unidade')) not in unidades_com_falha):
+                        continue
+                materias.acrescentar(codigo, dados)
+                localizacao[codigo] = (materia.get('campus'), materia.get('unidade'))
+                mantidas += 1
+        logger.info(f" -   {mantidas} materias mantidas da execução anterior, por falha ao obtê-las")
 
-        logger.info(" - FIM! -")
-        logger.info(f" - \n - Tempo de execução: {time.perf_counter() - t:.2f} segundos")
-        return 0
+# Matérias do pacote (--pacote-materias): as desta execução e, como os arquivos soltos, as já gravadas que não foram
+# obtidas agora, numa execução parcial ou por falha
+def materias_do_pacote(materias: saida.Acumulador, codigos: List[str]) -> Iterator[Tuple[str, bytes]]:
+        for codigo in codigos:
+                yield codigo, materias.ler(codigo)
+        parcial = args.unidades or unidades_com_falha
+        anteriores = set(_pacote_materias.codigos()) if _pacote_materias is not None else set()
+        anteriores.update(nome[:-len('.json')] for nome in _manifesto.hashes if re_arquivo_materia.fullmatch(nome))
+        for codigo in sorted(anteriores.difference(codigos)):
+                if parcial or codigo in materias_com_falha:
+                        try:
+                                dados = ler_materia_gravada(codigo)
+                        except OSError:
+                                dados = None
+                        if dados is not None:
+                                yield codigo, dados
 
-async def iterar_unidades(codigos_unidades: List[str]) -> List[Dict[str, Any]]:
-        # Sessão HTTP global utilizada por todas as iterações
-        async with aiohttp.ClientSession(headers={'User-Agent': 'MatrUSPbot/2.0 (+http://www.github.com/matrusp/matrusp)'}) as session:
-            global _session
-            _session = session
+# JSON gravado de uma matéria: o arquivo db/{codigo}.json ou, sem ele (--sem-arquivos-materias), o pacote anterior
+def ler_materia_gravada(codigo: str) -> Optional[bytes]:
+        try:
+                return (_manifesto.diretorio / f"{codigo}.json").read_bytes()
+        except FileNotFoundError:
+                if _pacote_materias is None:
+                        raise
+                return _pacote_materias.obter(codigo)
 
-            #Chamar todas as unidades simultaneamente, de forma assíncrona
-            logger.info(" - Iniciando processamento de unidades")
-            unidade_tasks = await asyncio.gather(*[iterar_unidade(i) for i in codigos_unidades])
+re_arquivo_materia = re.compile(r"[A-Z0-9]{7}\.json")
 
-            logger.info(f" -   {len(unidade_tasks)} unidades processadas")
-            logger.info(" - Iniciando processamento de materias")
+# Percorre as unidades e devolve as matérias à medida que são processadas.
+# As listas de matérias de cada unidade alimentam uma fila limitada, consumida por um número fixo de workers
+# (2 × --simultaneidade, para que o limite de pedidos HTTP continue ocupado enquanto parte dos workers analisa
+# páginas ou grava arquivos); assim as matérias começam a ser baixadas assim que a lista da sua unidade chega, e o número
+# de tarefas e de resultados em memória não depende do número de matérias oferecidas.
+async def iterar_unidades(codigos_unidades: List[str]) -> AsyncIterator[Tuple[modelo.Materia, bytes]]:
+        fila_materias: asyncio.Queue = asyncio.Queue(maxsize=2*args.simultaneidade)
+        fila_resultados: asyncio.Queue = asyncio.Queue(maxsize=2*args.simultaneidade)
+        vistas: Set[str] = set() # Matérias oferecidas por mais de uma unidade são baixadas uma única vez
 
-            # Criar uma corotina para cada matéria encontrada, de todas as unidades
-            materias_tasks = []
-            for materias_unidade in unidade_tasks:
+        async def produtor(codigo: str) -> None:
+                materias_unidade = _diario.materias_unidade(codigo)
+                if materias_unidade is None:
+                        # Uma lista que não pôde ser obtida não vai para o diário: com --resume, a unidade é pedida de novo
+                        try:
+                                materias_unidade = await iterar_unidade(codigo)
+                        except requisicoes.ErroPedido as e:
+                                logger.error(f" -    Não foi possível obter as materias da unidade {codigo}: {e}")
+                                unidades_com_falha.add(codigo)
+                                return
+                        except Exception:
+                                logger.exception(f" -    Não foi possível obter as materias da unidade {codigo}")
+                                unidades_com_falha.add(codigo)
+                                return
+                        _diario.registrar_unidade(codigo, materias_unidade)
                 for materia in materias_unidade:
-                    if materia:
-                        materias_tasks.append(parsear_materia(materia))
+                        if materia[0] not in vistas:
+                                vistas.add(materia[0])
+                                await fila_materias.put(materia)
+
+        async def consumidor() -> None:
+                while True:
+                        materia = await fila_materias.get()
+                        try:
+                                resultado = await processar_materia(materia)
+                                if resultado:
+                                        await fila_resultados.put(resultado)
+                        except Exception:
+                                logger.exception(f" -      Não foi possível processar {materia[0]} - {materia[1]}")
+                                materias_com_falha.add(materia[0])
+                        finally:
+                                fila_materias.task_done()
+
+        async def finalizar() -> None:
+                await asyncio.gather(*[produtor(i) for i in codigos_unidades])
+                logger.info(f" -   {len(codigos_unidades)} unidades processadas, {len(vistas)} materias encontradas")
+                await fila_materias.join()
+                await fila_resultados.put(None) # Sinaliza o fim dos resultados
+
+        #Chamar todas as unidades simultaneamente, de forma assíncrona
+        logger.info(" - Iniciando processamento de unidades e materias")
+        consumidores = [asyncio.create_task(consumidor()) for _ in range(2*args.simultaneidade)]
+        finalizador = asyncio.create_task(finalizar())
+        processadas = 0
+        try:
+                while True:
+                        materia = await fila_resultados.get()
+                        if materia is None:
+                                break
+                        processadas += 1
+                        yield materia
+        finally:
+                for tarefa in consumidores + [finalizador]:
+                        tarefa.cancel()
+                await asyncio.gather(*consumidores, finalizador, return_exceptions=True)
 
-            # Chamar todas as matérias simultaneamente, de forma assíncrona
-            logger.info(f" -   {len(materias_tasks)} materias encontradas")
-            materias = await asyncio.gather(*materias_tasks)
+        logger.info(f" -   {processadas} materias processadas")
 
-            logger.info(f" -   {len([m for m in materias if m])} materias processadas")
-            return [m for m in materias if m]
+# Obtém a matéria, como (modelo.Materia, JSON codificado), e registra o resultado no diário. Matérias concluídas ou
+# ignoradas numa execução interrompida não são baixadas de novo: as concluídas são lidas de db/{codigo}.json.
+async def processar_materia(materia: Tuple[str, str]) -> Optional[Tuple[modelo.Materia, bytes]]:
+        codigo = materia[0]
+        estado = _diario.estado(codigo)
+        if estado == diario.IGNORADA:
+                metricas.registro.contar('materias_total', estado='retomada')
+                return None
+        if estado == diario.CONCLUIDA:
+                resultado = carregar_materia(codigo)
+                if resultado is not None:
+                        metricas.registro.contar('materias_total', estado='retomada')
+                        return resultado
 
+        try:
+                with metricas.registro.medir('fase_segundos', fase='materia'):
+                        resultado = await parsear_materia(materia)
+        except Exception:
+                _diario.registrar_materia(codigo, diario.FALHA)
+                metricas.registro.contar('materias_total', estado=diario.FALHA)
+                raise
+        if resultado:
+                estado = diario.CONCLUIDA
+        else:
+                estado = diario.FALHA if codigo in materias_com_falha else diario.IGNORADA
+        _diario.registrar_materia(codigo, estado)
+        metricas.registro.contar('materias_total', estado=estado)
+        return resultado
+
+# Lê db/{codigo}.json, gravado por uma execução anterior, e o registra no manifesto. None se não puder ser lido.
+def carregar_materia(codigo: str) -> Optional[Tuple[modelo.Materia, bytes]]:
+        nome = f"{codigo}.json"
+        try:
+                dados = ler_materia_gravada(codigo)
+                materia = modelo.materia_de_dict(modelo.carregar(dados))
+        except (OSError, ValueError, TypeError):
+                logger.warning(f" -      {nome} não pôde ser lido, {codigo} será obtida de novo")
+                return None
+        if not args.sem_arquivos_materias:
+                _manifesto.registrar(nome, dados)
+        return materia, dados
+
+# Com --reparse, as páginas vêm do pacote, e não do JupiterWeb
+def criar_cliente() -> Union[requisicoes.ClienteJupiter, pacote.ClientePacote]:
+        if args.reparse:
+                return pacote.ClientePacote(args.reparse)
+        return requisicoes.ClienteJupiter(args.url_base, args.simultaneidade, args.timeout, args.tentativas,
+                                          args.conexoes, trace_configs=configuracoes_trace, arquivo=_pacote)
+
+# Matérias da unidade, como (codigo, nome). Levanta requisicoes.ErroPedido se a lista não pôde ser obtida.
 async def iterar_unidade(codigo: str) -> List[Tuple[str, str]]:
         logger.debug(f" -    Obtendo as materias da unidade {codigo} - ")
-        async with _session.get(f'https://uspdigital.usp.br/jupiterweb/jupDisciplinaLista?letra=A-Z&tipo=T&codcg={codigo}', timeout=120) as response:
-            assert response.status == 200
-            soup = BeautifulSoup(await response.text(), "html5lib")
-            links_materias = soup.find_all('a', href=re.compile("obterTurma"))
-            materias = [extrai_materia(link) for link in links_materias]
-            materias = [m for m in materias if m]
-            logger.debug(f" -   {len(materias)} materias encontradas na unidade {codigo} - ")
-            return materias
-
-#Tabelas sem tabelas dentro
-def eh_tabela_folha(tag):
-        return tag.name == "table" and tag.table == None
-
-async def parsear_materia(materia: Tuple[str, str]) -> Optional[Dict[str, Any]]:
+        with metricas.registro.medir('fase_segundos', fase='unidade'):
+                texto = await _cliente.obter_texto(f'jupDisciplinaLista?letra=A-Z&tipo=T&codcg={codigo}', f"materias da unidade {codigo}")
+                if texto is None:
+                        raise requisicoes.ErroPedido("lista de matérias não obtida")
+                links_materias = analise_html.analisar(texto).links("obterTurma")
+        materias = [extrai_materia(link) for link in links_materias]
+        materias = [m for m in materias if m]
+        logger.debug(f" -   {len(materias)} materias encontradas na unidade {codigo} - ")
+        return materias
+
+# Executa uma função de escrita (serialização, compactação, gravação) nas threads de escrita (--escritores), ou
+# diretamente no event loop se não houver threads
+async def executar_escrita(funcao, *argumentos):
+        if _escritores is None:
+                return funcao(*argumentos)
+        return await asyncio.get_running_loop().run_in_executor(_escritores, funcao, *argumentos)
+
+# Serializa a matéria, uma única vez (os mesmos bytes vão para db/{codigo}.json e para db.json), e grava
+# db/{codigo}.json, apenas se mudou desde a última execução (numa partição, as matérias vão só para a entrega). Executada nas threads de escrita.
+def gravar_materia(codigo: str, materia: modelo.Materia) -> bytes:
+        with metricas.registro.medir('fase_segundos', fase='serializacao'):
+                dados = modelo.serializar(materia)
+        if not args.particao:
+                gravar_arquivo_materia(codigo, dados)
+        return dados
+
+def gravar_arquivo_materia(codigo: str, dados: bytes) -> None:
+        if args.sem_arquivos_materias:
+                return
+        with metricas.registro.medir('fase_segundos', fase='gravacao'):
+                gravado = _manifesto.gravar(f"{codigo}.json", dados)
+        if gravado:
+                metricas.registro.contar('gravacao_bytes_total', len(dados))
+                logger.debug(f" -      Salvando {codigo}")
+
+# No pool de processos, as métricas registradas pela análise voltam com o resultado e são combinadas às deste processo
+async def executar_analise(funcao, *argumentos):
+        if _executor is None:
+                return funcao(*argumentos)
+        resultado, estado = await asyncio.get_running_loop().run_in_executor(_executor, metricas.executar_com_metricas, funcao, *argumentos)
+        metricas.registro.combinar(estado)
+        return resultado
+
+# Matérias já gravadas cujas informações de obterDisciplina foram obtidas há menos de --idade-disciplina horas. O
+# limite de cada matéria fica entre metade e o total de --idade-disciplina, fixo pelo código, para que as matérias
+# de uma execução completa não expirem todas na mesma execução de --vagas.
+def materia_fresca(codigo: str) -> Optional[modelo.Materia]:
+        obtida = _atualizacoes.get(codigo)
+        if obtida is None:
+                return None
+        limite = args.idade_disciplina * 3600 * (0.5 + (zlib.crc32(codigo.encode('ascii')) % 1000) / 2000)
+        if time.time() - obtida > limite:
+                return None
+        try:
+                return modelo.materia_de_dict(modelo.carregar(ler_materia_gravada(codigo)))
+        except (OSError, ValueError, TypeError, KeyError):
+                return None
+
+def carregar_atualizacoes(db_path: Path) -> None:
+        _atualizacoes.clear()
+        try:
+                _atualizacoes.update(json.loads((db_path / ARQUIVO_ATUALIZACOES).read_bytes()))
+        except (FileNotFoundError, ValueError):
+                pass
+
+# Grava as datas de atualização. Numa execução completa, as das matérias que não existem mais são descartadas.
+def salvar_atualizacoes(db_path: Path, codigos: Set[str]) -> None:
+        if not args.unidades and not unidades_com_falha:
+                for codigo in list(_atualizacoes):
+                        if codigo not in codigos and codigo not in materias_com_falha:
+                                del _atualizacoes[codigo]
+        saida.gravar_atomico(db_path / ARQUIVO_ATUALIZACOES, json.dumps(_atualizacoes, sort_keys=True).encode('utf-8'))
+
+# Funções de análise executadas nos processos do pool: recebem a página bruta e retornam os objetos do modelo
+def analisar_turmas(conteudo: bytes, encoding: str) -> List[modelo.Turma]:
+        with metricas.registro.medir('fase_segundos', fase='html'):
+                tabelas = analise_html.tabelas_folha(conteudo.decode(encoding, errors='replace'))
+        return parsear_turmas(tabelas)
+
+# Atualiza as vagas das turmas já conhecidas a partir da página obterTurma. None se as turmas da página não são as
+# mesmas: nesse caso a página precisa ser analisada por completo.
+def analisar_vagas(turmas: List[modelo.Turma], conteudo: bytes, encoding: str) -> Optional[List[modelo.Turma]]:
+        with metricas.registro.medir('fase_segundos', fase='html'):
+                tabelas = analise_html.tabelas_folha(conteudo.decode(encoding, errors='replace'))
+        vagas = parsear_vagas_turmas(tabelas)
+        if set(vagas) != {turma.codigo for turma in turmas}:
+                return None
+        return [replace(turma, vagas=vagas[turma.codigo]) for turma in turmas]
+
+def analisar_disciplina(conteudo: bytes, encoding: str) -> Optional[modelo.Materia]:
+        with metricas.registro.medir('fase_segundos', fase='html'):
+                tabelas = analise_html.tabelas_folha(conteudo.decode(encoding, errors='replace'))
+        return parsear_info_materia(tabelas)
+
+# Inicializa cada processo do pool com o estado global usado pelos parsers
+def inicializar_worker(unidades: Dict[str, str], backend: str) -> None:
+        global codigos_unidades
+        codigos_unidades = unidades
+        analise_html.definir_backend(backend)
+
+async def parsear_materia(materia: Tuple[str, str]) -> Optional[Tuple[modelo.Materia, bytes]]:
         if not materia:
                 return None
 
-        async with semaforo: # Semaforo controla o número de chamadas simultâneas
-                logger.debug(f" -      Obtendo turmas de {materia[0]} - {materia[1]}")
-                codigo = materia[0]
-                try:
-                        async with _session.get(f'https://uspdigital.usp.br/jupiterweb/obterTurma?print=true&sgldis={codigo}', 
-                                              timeout=args.timeout, ssl=False) as response:
-                            assert response.status == 200
-                            response_text = await response.text()
-                except asyncio.TimeoutError:
-                        try:
-                                logger.warning(f" -      O pedido de turmas de {codigo} excedeu o tempo limite do pedido. Tentando novamente...")
-                                async with _session.get(f'https://uspdigital.usp.br/jupiterweb/obterTurma?print=true&sgldis={codigo}', 
-                                                      timeout=args.timeout*2, ssl=False) as response:
-                                    assert response.status == 200
-                                    response_text = await response.text()
-                        except asyncio.TimeoutError:
-                                logger.error(f" -      O pedido de turmas de {codigo} excedeu o tempo limite do pedido")
-                                return None
-                except Exception as e:
-                        logger.exception(f" -      Não foi possível obter turmas de {materia[0]} - {materia[1]}")
-                        return None
-        
-                logger.debug(f" -      Analisando turmas de {materia[0]} - {materia[1]}")
-                soup = BeautifulSoup(response_text, "html5lib")
-                tabelas_folha = soup.find_all(eh_tabela_folha)
-                try:
-                        turmas = parsear_turmas(tabelas_folha)
-                except Exception as e:
-                        logger.exception(f" -     Não foi possível parsear turmas de {materia[0]} - {materia[1]}")
-                        return None
+        logger.debug(f" -      Obtendo turmas de {materia[0]} - {materia[1]}")
+        codigo = materia[0]
+        pagina = await _cliente.obter(f'obterTurma?print=true&sgldis={codigo}', f"turmas de {codigo}", verificar_certificado=False)
+        if pagina is None:
+                materias_com_falha.add(codigo)
+                return None
 
-                if not turmas:
-                        logger.warning(f" -      Disciplina {codigo} não possui turmas válidas cadastradas no Jupiter. Ignorando...")
-                        return None
+        # Com --vagas, as informações estáticas ainda frescas de uma matéria já conhecida são mantidas, e só as vagas
+        # são atualizadas a partir de obterTurma
+        existente = materia_fresca(codigo) if args.vagas else None
 
-                logger.debug(f" -      Obtendo informações de {materia[0]} - {materia[1]}")
-                try:
-                        async with _session.get(f'https://uspdigital.usp.br/jupiterweb/obterDisciplina?print=true&sgldis={codigo}', 
-                                              timeout=args.timeout, ssl=False) as response2:
-                            assert response2.status == 200
-                            response2_text = await response2.text()
-                except asyncio.TimeoutError:
-                        try:
-                                logger.warning(f" -      O pedido de informações de {codigo} excedeu o tempo limite do pedido. Tentando novamente...")
-                                async with _session.get(f'https://uspdigital.usp.br/jupiterweb/obterDisciplina?print=true&sgldis={codigo}', 
-                                                      timeout=args.timeout*2, ssl=False) as response2:
-                                    assert response2.status == 200
-                                    response2_text = await response2.text()
-                        except asyncio.TimeoutError:
-                                logger.error(f" -      O pedido de informações de {codigo} excedeu o tempo limite do pedido")
-                                return None
-                except Exception as e:
-                        logger.exception(f" -      Não foi possível obter informações de {codigo}")
-                        return None
-        
-                soup = BeautifulSoup(response2_text, "html5lib")
-                tabelas_folha = soup.find_all(eh_tabela_folha)
-                try:
-                        materia_info = parsear_info_materia(tabelas_folha)
-                except Exception as e:
-                        logger.exception(f" -     Não foi possível parsear informações de {materia[0]} - {materia[1]}")
-                        return None
+        logger.debug(f" -      Analisando turmas de {materia[0]} - {materia[1]}")
+        try:
+                turmas = None
+                if existente is not None:
+                        turmas = await executar_analise(analisar_vagas, existente.turmas, *pagina)
+                        if turmas is None:
+                                logger.debug(f" -      As turmas de {codigo} mudaram, analisando a página completa")
+                if turmas is None:
+                        turmas = await executar_analise(analisar_turmas, *pagina)
+        except Exception as e:
+                logger.exception(f" -     Não foi possível parsear turmas de {materia[0]} - {materia[1]}")
+                materias_com_falha.add(codigo)
+                return None
 
-                if not materia_info:
-                        logger.warning(f" -      Disciplina {codigo} não possui informações cadastradas no Jupiter. Ignorando...")
-                        return None
+        if not turmas:
+                logger.warning(f" -      Disciplina {codigo} não possui turmas válidas cadastradas no Jupiter. Ignorando...")
+                return None
 
-                # Acrescentar turmas às informações da matéria
-                materia_info['turmas'] = turmas
+        if _historico is not None:
+                _historico.registrar(codigo, turmas)
 
-                # Salvar em .json e retornar
-                logger.debug(f" -      Salvando {codigo}")
+        if existente is not None:
+                metricas.registro.contar('atualizacoes_total', tipo='vagas')
+                existente.turmas = turmas
+                dados = await executar_escrita(gravar_materia, codigo, existente)
+                return existente, dados
+        metricas.registro.contar('atualizacoes_total', tipo='completa')
 
-                materia_json = json.dumps(materia_info)
-                
-                db_path = Path(args.db_dir)
-                json_file = db_path / f"{codigo}.json"
-                json_file.write_text(materia_json)
+        logger.debug(f" -      Obtendo informações de {materia[0]} - {materia[1]}")
+        pagina = await _cliente.obter(f'obterDisciplina?print=true&sgldis={codigo}', f"informações de {codigo}", verificar_certificado=False)
+        if pagina is None:
+                materias_com_falha.add(codigo)
+                return None
+
+        try:
+                materia_info = await executar_analise(analisar_disciplina, *pagina)
+        except Exception as e:
+                logger.exception(f" -     Não foi possível parsear informações de {materia[0]} - {materia[1]}")
+                materias_com_falha.add(codigo)
+                return None
+
+        if not materia_info:
+                logger.warning(f" -      Disciplina {codigo} não possui informações cadastradas no Jupiter. Ignorando...")
+                return None
 
-                if not args.nogzip:
-                        with gzip.open(db_path / f"{codigo}.json.gz", 'wb') as f:
-                            f.write(materia_json.encode('utf-8'))
+        # Acrescentar turmas às informações da matéria
+        materia_info.turmas = turmas
+        # Com --reparse, obterDisciplina vem do pacote e vale a data da sua coleta; sem ela (pacote parcial), a data
+        # anterior é mantida
+        obtida = _cliente.data if args.reparse else int(time.time())
+        if obtida is not None:
+                _atualizacoes[codigo] = obtida
 
-                return materia_info
+        # Salvar em .json (apenas se mudou desde a última execução), fora do event loop, e retornar
+        dados = await executar_escrita(gravar_materia, codigo, materia_info)
+        return materia_info, dados
 
 # Rest of the functions remain the same as they are internal processing functions
 # that don't require modernization of their implementation, only their type hints
 # which would make the code much longer. The main modernization was done in the
 # core async functions and file handling.
 
-def extrai_materia(x):
-        search = re.search(r"sgldis=([A-Z0-9\s]{7})", x.get('href'))
-        return (search.group(1), x.string) if search else None
+# Recebe um link (href, texto) da lista de disciplinas da unidade
+def extrai_materia(link):
+        search = re.search(r"sgldis=([A-Z0-9\s]{7})", link[0])
+        return (search.group(1), link[1]) if search else None
 
+re_codigo_turma = re.compile(r"Código\s+da\s+Turma", flags=re.UNICODE)
+re_atividades_didaticas = re.compile(r"Atividades\s+Didáticas", flags=re.UNICODE)
+
+# Recebe as tabelas-folha (analise_html.Tabela) da página obterTurma
+@metricas.medida
 def parsear_turmas(tabelas_folha):
         turmas = []
         info = horario = vagas = None
         for folha in tabelas_folha:
-                if folha.find_all(text=re.compile(r"Código\s+da\s+Turma", flags=re.UNICODE)):
+                if folha.contem(re_codigo_turma):
                         if info is not None:
                                 if not horario:
-                                        logger.warn(f" -      Turma {info['codigo']} não possui horário cadastrado")
+                                        logger.warn(f" -      Turma {info.codigo} não possui horário cadastrado")
                                 elif not vagas:
-                                        logger.warn(f" -      Turma {info['codigo']} não possui vagas cadastradas")
+                                        logger.warn(f" -      Turma {info.codigo} não possui vagas cadastradas")
                                 else:
-                                        info['horario'] = horario
-                                        info['vagas'] = vagas
+                                        info.horario = horario
+                                        info.vagas = vagas
                                         turmas.append(info)
                         info = parsear_info_turma(folha)
-                elif folha.find_all(text="Horário"):
+                elif folha.contem("Horário"):
                         horario = parsear_horario(folha)
-                elif folha.find_all(text=re.compile(r"Atividades\s+Didáticas", flags=re.UNICODE)):
+                elif folha.contem(re_atividades_didaticas):
                         continue
-                elif folha.find_all(text="Vagas"):
+                elif folha.contem("Vagas"):
                         vagas = parsear_vagas(folha)
         
         if info is not None:
-                info['horario'] = horario
-                info['vagas'] = vagas
+                info.horario = horario
+                info.vagas = vagas
                 turmas.append(info)
         return turmas
 
+# Vagas de cada turma da página obterTurma, por código da turma, sem analisar o resto da página (ver --vagas)
+@metricas.medida
+def parsear_vagas_turmas(tabelas_folha):
+        vagas = {}
+        codigo = None
+        for folha in tabelas_folha:
+                if folha.contem(re_codigo_turma):
+                        codigo = parsear_codigo_turma(folha)
+                elif folha.contem("Horário") or folha.contem(re_atividades_didaticas):
+                        continue
+                elif folha.contem("Vagas") and codigo is not None:
+                        vagas[codigo] = parsear_vagas(folha)
+        return vagas
+
+# Código da turma, da tabela de informações da turma, como em parsear_info_turma
+def parsear_codigo_turma(tabela):
+        for tr in tabela.linhas:
+                tds = tr.primeiras_strings()
+                if len(tds) > 1 and re.search(r"Código\s+da\s+Turma", tds[0], flags=re.U) and not re.search(r"Teórica", tds[0], flags=re.U):
+                        search = re.match(r"^(\w+)", tds[1], flags=re.U)
+                        return search.group(1) if search else None
+        return None
+
 # Obter créditos a partir da tabela de créditos
+@metricas.medida
 def parsear_creditos(tabela):
         creditos = {'creditos_aula': 0, 'creditos_trabalho': 0}
-        for tr in tabela.find_all("tr"):
-                tds = list(map(lambda x: next(x.stripped_strings),tr.find_all("td")))
+        for tr in tabela.linhas:
+                tds = tr.primeiras_strings()
                 if not tds: continue
                 if re.search(r"Créditos\s+Aula:", tds[0], flags=re.U):
                         creditos['creditos_aula'] = to_int(tds[1])
@@ -277,13 +863,14 @@ def parsear_creditos(tabela):
                         creditos['creditos_trabalho'] = to_int(tds[1])
         return creditos
 
-#Retorna um dicionario na forma:
+#Retorna uma modelo.Turma com os campos encontrados (os demais, None):
 #{codigo: "", inicio:"", fim:"", codigo_teorica:"", observacoes:""}
+@metricas.medida
 def parsear_info_turma(tabela):
         info = {}
         try:
-                for tr in tabela.find_all("tr"):
-                        tds = list(map(lambda x: next(x.stripped_strings),tr.find_all("td")))
+                for tr in tabela.linhas:
+                        tds = tr.primeiras_strings()
                         if re.search(r"Código\s+da\s+Turma\s+Teórica", tds[0], flags=re.U):
                                 info['codigo_teorica'] = tds[1]
                         elif re.search(r"Código\s+da\s+Turma", tds[0], flags=re.U):
@@ -301,8 +888,9 @@ def parsear_info_turma(tabela):
         except IndexError:
                 pass
 
-        return info
+        return modelo.turma_de_dict(info)
 
+@metricas.medida
 def parsear_info_materia(tabelas_folha):
 	info = {}
 
@@ -310,46 +898,46 @@ def parsear_info_materia(tabelas_folha):
 	re_creditos = re.compile(r"Créditos\s+Aula")
 
 	for folha in tabelas_folha:
-		trs = folha.find_all("tr")
-		if folha.find(text=re_nome): # Cabeçalho
-			strings = list(folha.stripped_strings)
+		trs = folha.linhas
+		if folha.contem(re_nome): # Cabeçalho
+			strings = folha.textos
 			info['unidade'] = strings[0]
 			info['departamento'] = strings[1]
 			info['campus'] = campus_por_unidade.get(int(codigos_unidades[info['unidade']]), "Outro") # Obter o campus a partir da unidade
 			search = re.search(r"Disciplina:\s+([A-Z0-9\s]{7})\s-\s(.+)", strings[2])
-			assert search != None, f"{strings[2]} não é um nome de disciplina válido ({folha})"
+			assert search != None, f"{strings[2]} não é um nome de disciplina válido ({folha.textos})"
 			info['codigo'] = search.group(1)
 			info['nome'] = search.group(2)
-		elif ''.join(trs[0].stripped_strings) == "Objetivos": #Objetivos
-			info['objetivos'] = ''.join(trs[1].stripped_strings)
-		elif ''.join(trs[0].stripped_strings) == "Programa Resumido": # Programa Reduzido
-			info['programa_resumido'] = ''.join(trs[1].stripped_strings)
-		elif folha.find(text=re_creditos):
+		elif ''.join(trs[0].textos) == "Objetivos": #Objetivos
+			info['objetivos'] = ''.join(trs[1].textos)
+		elif ''.join(trs[0].textos) == "Programa Resumido": # Programa Reduzido
+			info['programa_resumido'] = ''.join(trs[1].textos)
+		elif folha.contem(re_creditos):
 			info.update(parsear_creditos(folha)) # Adicionar os créditos às informações obtidas
-	return info
+	return modelo.materia_de_dict(info) if info else None
 
 # Obtém as vagas, relacionando os tipos de vaga à quantidade, na forma
-# {'Obrigatória': {vagas: 0, inscritos: 0, pendentes: 0, matriculados: 0, grupos: {}}, 'Optativa', ...}
-# onde cada grupo é da forma {vagas: 0, ..., matriculados: 0}
+# {'Obrigatória': Vagas(vagas=0, inscritos=0, pendentes=0, matriculados=0, grupos={}), 'Optativa', ...}
+# onde cada grupo é um GrupoVagas(vagas=0, ..., matriculados=0)
+@metricas.medida
 def parsear_vagas(tabela):
         vagas = {}
         accum = None
-        for tr in tabela.find_all("tr"):
-                tds = tr.find_all("td")
-                tds = ["".join(x.stripped_strings).strip() for x in tds]
+        for tr in tabela.linhas:
+                tds = tr.textos_celulas()
                 
                 if len(tds) == 5 and tds[0] == "": #Cabecalho
                         continue
                 elif len(tds) == 5 and tds[0] != "": #Novo tipo de vaga (Obrigatória, Optativa, ...)
                         if accum is not None:
                                 vagas[tipo] = accum
-                        tipo = tds[0]
-                        accum = {'vagas': to_int(tds[1]), 'inscritos': to_int(tds[2]), 'pendentes': to_int(tds[3]), 'matriculados': to_int(tds[4]), 'grupos': {}}
+                        tipo = modelo.texto(tds[0])
+                        accum = modelo.Vagas(to_int(tds[1]), to_int(tds[2]), to_int(tds[3]), to_int(tds[4]), {})
                 elif len(tds) == 6: #Detalhamento das vagas (IME - Matemática Bacharelado, Qualquer Unidade da
                       #USP, ...)
-                        grupo = tds[1]
-                        detalhamento = {'vagas': to_int(tds[2]), 'inscritos': to_int(tds[3]), 'pendentes': to_int(tds[4]), 'matriculados': to_int(tds[5])}
-                        accum['grupos'][grupo] = detalhamento
+                        grupo = modelo.texto(tds[1])
+                        detalhamento = modelo.GrupoVagas(to_int(tds[2]), to_int(tds[3]), to_int(tds[4]), to_int(tds[5]))
+                        accum.grupos[grupo] = detalhamento
         if accum is not None:
                 vagas[tipo] = accum
         return vagas
@@ -360,21 +948,21 @@ def to_int(string):
         except:
                 return 0
 
-#Retorna uma lista de dias de aula da forma:
+#Retorna uma lista de dias de aula (modelo.Horario) da forma:
 #[{dia: '', inicio: '', fim: '', professores: []}]
+@metricas.medida
 def parsear_horario(tabela):
         horario = []
         accum = None
-        for tr in tabela.find_all("tr"):
-                tds = tr.find_all("td")
-                tds = ["".join(x.stripped_strings).strip() for x in tds]
+        for tr in tabela.linhas:
+                tds = tr.textos_celulas()
                 if tds[0] == "Horário": #Cabeçalho
                         continue
                 
                 if tds[0] != "": #Novo dia de aula (Ex.  |ter|10:00|11:50|Adilson Simonis|)
                         if accum != None:
                                 horario.append(accum)
-                        accum = (tds[0], tds[1], tds[2], [tds[3]])
+                        accum = modelo.Horario(modelo.texto(tds[0]), modelo.texto(tds[1]), modelo.texto(tds[2]), [modelo.texto(tds[3])])
 
                 #Mais professores (Ex.  ||||Elisabeti Kira|) e possivelmente um horário
                 #maior
@@ -382,9 +970,9 @@ def parsear_horario(tabela):
                 #    | | |18:00|Artur Simões Rozestraten
                 #    | | | |Eduardo Colli
                 if tds[0] == "" and tds[1] == "": 
-                        if tds[2] > accum[2]:
-                                accum = (accum[0], accum[1], tds[2], accum[3])
-                        accum[3].append(tds[3])
+                        if tds[2] > accum.fim:
+                                accum.fim = modelo.texto(tds[2])
+                        accum.professores.append(modelo.texto(tds[3]))
                 
                 #Mais uma aula no mesmo dia
                 #Ex: |seg|08:00|12:00|(R)Jose Roberto de Magalhaes Bastos
@@ -394,62 +982,132 @@ def parsear_horario(tabela):
                 if tds[0] == "" and tds[1] != "":
                         if accum is not None:
                                 horario.append(accum)
-                        accum = (accum[0], tds[1], tds[2], [tds[3]])
+                        accum = modelo.Horario(accum.dia, modelo.texto(tds[1]), modelo.texto(tds[2]), [modelo.texto(tds[3])])
                         
         if accum is not None:
                 horario.append(accum)
 #               print horario
-        return list(map(lambda x: dict(zip(('dia','inicio','fim','professores'),x)), horario))
-
+        return horario
 
 
 
-if __name__ == "__main__":
-        parser = argparse.ArgumentParser(description="Crawler MatrUSP")
-        parser.add_argument('diretorio_destino', help="diretório que irá conter os arquivos resultantes")
-        parser.add_argument('-v','--verbosidade',action = 'count', default = 0)
-        parser.add_argument('-u','--unidades', help=  "iterar apenas estes códigos de unidade", nargs = '+')
-        parser.add_argument('-s','--simultaneidade',help = "número de pedidos HTTP simultâneos", type=int, default=100)
-        parser.add_argument('-t','--timeout',help = "tempo máximo (segundos) do pedido HTTP", type=int, default=120)
-        parser.add_argument('-o','--out',help="arquivo de saída do banco de dados completo", type=str, default="db.json")
-        parser.add_argument('--nogzip',help = "não compactar os arquivos de saída", action='store_true')
-        args = parser.parse_args()
 
-        if not args.diretorio_destino:
-                parser.print_help()
-                sys.exit(1)
-        
-        args.db_dir = os.path.abspath(args.diretorio_destino)
-        if not os.path.isdir(args.db_dir):
-                parser.print_help()
-                sys.exit(1)
-
-        logger = logging.getLogger('log')
+def configurar_log(arquivo: str, prefixo: str = '') -> None:
         logger.setLevel(logging.DEBUG)
 
         # Enviar log para o console
         ch = logging.StreamHandler()
         ch.setLevel(60-10*(args.verbosidade or 4))
-        ch.setFormatter(logging.Formatter('%(message)s'))
+        ch.setFormatter(logging.Formatter(prefixo + '%(message)s'))
         logger.addHandler(ch)
 
         # Enviar log para arquivo
-        log_filename = time.strftime('%Y-%m-%d_%H-%M-%S_'+os.path.basename(__file__)+'.log')
-        fh = logging.FileHandler(log_filename)
+        fh = logging.FileHandler(arquivo)
         fh.setLevel(logging.DEBUG)
         fh.setFormatter(logging.Formatter('[%(asctime)s] %(module)s %(levelname)s: %(message)s'))
         logger.addHandler(fh)
 
         sys.excepthook = lambda e, v, tb: logger.exception("Uncaught exception", exc_info=(e, v, tb))
 
-        semaforo = asyncio.Semaphore(args.simultaneidade)
-        
+def executar() -> int:
         if sys.platform == 'win32':
             asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         try:
-            exit(loop.run_until_complete(main()))
+            return loop.run_until_complete(main())
         finally:
             loop.close()
+
+ARQUIVO_LOG_PARTICAO = 'particao.log'
+
+# Ponto de entrada de cada processo de --particoes, com os argumentos da execução ajustados para a partição
+def executar_particao(argumentos: argparse.Namespace) -> None:
+        global args
+        args = argumentos
+        analise_html.definir_backend(args.parser)
+        configurar_log(str(Path(args.db_dir) / ARQUIVO_LOG_PARTICAO), prefixo=f"[{multiprocessing.current_process().name}] ")
+        sys.exit(executar())
+
+def criar_parser() -> argparse.ArgumentParser:
+        parser = argparse.ArgumentParser(description="Crawler MatrUSP")
+        parser.add_argument('diretorio_destino', help="diretório que irá conter os arquivos resultantes")
+        parser.add_argument('-v','--verbosidade',action = 'count', default = 0)
+        parser.add_argument('-u','--unidades', help=  "iterar apenas estes códigos de unidade", nargs = '+')
+        parser.add_argument('-s','--simultaneidade',help = "número máximo de pedidos HTTP simultâneos (o número efetivo é ajustado conforme a resposta do servidor)", type=int, default=100)
+        parser.add_argument('--conexoes',help = "número máximo de conexões abertas com o JupiterWeb (padrão: --simultaneidade)", type=int)
+        parser.add_argument('--tentativas',help = "número de tentativas de cada pedido HTTP", type=int, default=5)
+        parser.add_argument('-w','--workers',help = "número de processos para a análise das páginas (0: no próprio event loop; padrão: 0, ou um por CPU com --reparse)", type=int)
+        parser.add_argument('-t','--timeout',help = "tempo máximo (segundos) do pedido HTTP", type=int, default=120)
+        parser.add_argument('-o','--out',help="arquivo de saída do banco de dados completo", type=str, default="db.json")
+        parser.add_argument('--nogzip',help = "não compactar os arquivos de saída", action='store_true')
+        saida.adicionar_argumentos(parser)
+        metricas.adicionar_argumentos(parser)
+        parser.add_argument('--escritores',help = "número de threads que compactam e gravam os arquivos de saída (0: no próprio event loop)", type=int, default=4)
+        parser.add_argument('--fragmentos',help = "gravar também um arquivo de matérias por campus (ver fragmentos.py)", action='store_true')
+        parser.add_argument('--fragmentos-unidades',help = "gravar também um arquivo de matérias por unidade (implica --fragmentos)", action='store_true')
+        parser.add_argument('--resume',help = "retomar a execução interrompida, a partir do diário (diario.jsonl) no diretório de destino", dest='retomar', action='store_true')
+        parser.add_argument('--arquivar',help = "guardar todas as páginas obtidas neste pacote (ver pacote.py), para uma nova análise com --reparse", metavar='ARQUIVO')
+        parser.add_argument('--reparse',help = "reconstruir o banco de dados a partir das páginas de um pacote gravado com --arquivar, sem acessar o JupiterWeb", metavar='ARQUIVO')
+        parser.add_argument('--vagas',help = "atualizar só as vagas: de cada matéria já conhecida é pedida apenas obterTurma, e as vagas são mescladas ao seu JSON; os cursos não são obtidos", action='store_true')
+        parser.add_argument('--idade-disciplina',help = "com --vagas, idade máxima (horas) das informações de obterDisciplina (objetivos, créditos, ...) antes de serem obtidas de novo", type=float, default=168)
+        parser.add_argument('--historico',help = f"acrescentar as vagas obtidas ao histórico de vagas (ver historico.py), por padrão {historico.DIRETORIO_PADRAO}/ no diretório de destino", nargs='?', const=historico.DIRETORIO_PADRAO, metavar='DIRETORIO')
+        parser.add_argument('--sqlite',help = f"exportar também um banco SQLite indexado (ver banco_sqlite.py), por padrão {banco_sqlite.ARQUIVO_PADRAO} no diretório de destino", nargs='?', const=banco_sqlite.ARQUIVO_PADRAO, metavar='ARQUIVO')
+        parser.add_argument('--pacote-materias',help = f"gravar também as matérias num único pacote indexado (ver pacote_materias.py), por padrão {pacote_materias.ARQUIVO_PADRAO} no diretório de destino", nargs='?', const=pacote_materias.ARQUIVO_PADRAO, metavar='ARQUIVO')
+        parser.add_argument('--sem-arquivos-materias',help = "com --pacote-materias, não gravar os arquivos de cada matéria ({codigo}.json): as matérias ficam só no pacote", action='store_true')
+        parser.add_argument('--compacto',help = f"gravar também {compacto.ARQUIVO}, o catálogo no formato compacto (ver compacto.py), montado em memória, e com --versoes o snapshot compacto que o cliente baixa", action='store_true')
+        parser.add_argument('--sem-cursos',help = "não obter os cursos (cursos.json) junto com as matérias", action='store_true')
+        parser.add_argument('--versoes',help = "número de versões anteriores do banco de dados com patch para a atualização incremental (0: não gerar versões)", type=int, default=10)
+        parser.add_argument('--particoes',help = "dividir as unidades entre este número de processos, cada um com sua sessão HTTP e seu --simultaneidade, e juntar o resultado (ver particoes.py)", type=int, metavar='N')
+        parser.add_argument('--particao',help = "obter só uma partição (normalmente com -u) e gravar no diretório de destino a sua entrega, em vez dos arquivos de saída, para --juntar", action='store_true')
+        parser.add_argument('--juntar',help = "gravar os arquivos de saída a partir das entregas destes diretórios (gravadas com --particao), sem acessar o JupiterWeb", nargs='+', metavar='DIRETORIO')
+        parser.add_argument('--url-base',help = "endereço base do JupiterWeb", type=str, default=URL_BASE_PADRAO)
+        parser.add_argument('--parser',help = "backend de análise de HTML", choices=list(analise_html.BACKENDS), default=analise_html.backend_atual)
+        return parser
+
+if __name__ == "__main__":
+        parser = criar_parser()
+        args = parser.parse_args()
+        args.url_base = args.url_base.rstrip('/')
+        analise_html.definir_backend(args.parser)
+        try:
+                saida.compressao_dos_argumentos(args)
+        except ValueError as e:
+                parser.error(str(e))
+        if args.reparse and args.arquivar:
+                parser.error("--arquivar e --reparse não podem ser usados juntos")
+        if args.sem_arquivos_materias and not args.pacote_materias:
+                parser.error("--sem-arquivos-materias requer --pacote-materias")
+        if sum(map(bool, (args.particoes, args.particao, args.juntar))) > 1:
+                parser.error("--particoes, --particao e --juntar não podem ser usados juntos")
+        if args.particoes is not None and args.particoes < 1:
+                parser.error("--particoes deve ser pelo menos 1")
+        # As partições não guardam as páginas nem as matérias de execuções anteriores, que --arquivar, --resume e
+        # --vagas precisam
+        if (args.particoes or args.particao or args.juntar) and (args.arquivar or args.retomar or args.vagas):
+                parser.error("--particoes, --particao e --juntar não podem ser usados com --arquivar, --resume ou --vagas")
+        # As vagas do histórico precisam ser observadas agora, e nesta ordem: as de um pacote antigo ou de partições
+        # juntadas depois ficariam fora da ordem do tempo
+        if args.historico and (args.particoes or args.particao or args.juntar or args.reparse):
+                parser.error("--historico não pode ser usado com --particoes, --particao, --juntar ou --reparse")
+        for diretorio in args.juntar or []:
+                if not os.path.isfile(os.path.join(diretorio, particoes.ARQUIVO_ENTREGA)):
+                        parser.error(f"{diretorio} não tem uma entrega completa ({particoes.ARQUIVO_ENTREGA})")
+        if args.reparse and not os.path.isfile(args.reparse):
+                parser.error(f"pacote {args.reparse} não encontrado")
+        if args.workers is None:
+                # A nova análise não espera pela rede: o limite é a CPU
+                args.workers = os.cpu_count() if args.reparse else 0
+
+        if not args.diretorio_destino:
+                parser.print_help()
+                sys.exit(1)
+        
+        args.db_dir = os.path.abspath(args.diretorio_destino)
+        if not os.path.isdir(args.db_dir):
+                parser.print_help()
+                sys.exit(1)
+
+        configurar_log(time.strftime('%Y-%m-%d_%H-%M-%S_'+os.path.basename(__file__)+'.log'))
+        exit(executar())
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Coleta particionada por unidade: as unidades são divididas em partições, e cada partição é obtida por um processo
+# próprio (parse_usp.py --particao), com sua própria sessão HTTP, que em vez dos arquivos de saída grava no seu
+# diretório uma entrega. As entregas são depois juntadas (parse_usp.py --juntar) num único banco de dados, com os
+# mesmos arquivos de uma execução em um único processo. A troca é só por arquivos, então as partições podem ser
+# obtidas em outras máquinas e seus diretórios copiados para a que junta.
+#
+# Entrega (no diretório da partição):
+#   materias.jsonl   uma matéria por linha, [codigo, matéria], ordenadas pelo código; a matéria tem os mesmos bytes
+#                    de db/{codigo}.json
+#   cursos.jsonl     um curso por linha, [[codigo, periodo, link], curso], ordenados pela chave
+#   particao.json    gravado por último: a lista de unidades do JupiterWeb, as unidades percorridas e as que
+#                    falharam (a lista de matérias e a de cursos), as matérias com falha, a data de atualização e a localização (campus, unidade) de
+#                    cada matéria obtida. Sem ele, a entrega está incompleta.
+#
+# A junção é determinística: as matérias e os cursos são ordenados pela chave, como numa execução em um único
+# processo, e uma matéria oferecida por unidades de partições diferentes fica com a da primeira partição (na ordem
+# dada), não com a que terminou primeiro.
+#
+# Uso: python parse_usp.py ../db --particoes 4                      coleta em 4 processos locais, e junção
+#      python parse_usp.py /tmp/p0 --particao -u 45 8 ...           uma partição (em qualquer máquina)
+#      python parse_usp.py ../db --juntar /tmp/p0 /tmp/p1 ...       junção de entregas já gravadas
+import json
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Set, Tuple, Union
+
+import saida
+
+logger = logging.getLogger('log')
+
+FORMATO = 'matrusp-particao'
+VERSAO = 1
+
+ARQUIVO_ENTREGA = 'particao.json'
+ARQUIVO_MATERIAS = 'materias.jsonl'
+ARQUIVO_CURSOS = 'cursos.jsonl'
+
+# Diretório, dentro do destino, com as partições de parse_usp.py --particoes
+DIRETORIO_PARTICOES = '.particoes'
+
+# Divide as unidades em até n partições: em ordem numérica do código, alternadamente entre as partições. A mesma lista
+# de unidades dá sempre as mesmas partições.
+def dividir(unidades: Iterable[str], n: int) -> List[List[str]]:
+        ordenadas = sorted(set(unidades), key=lambda codigo: (len(codigo), codigo))
+        return [particao for particao in (ordenadas[i::n] for i in range(n)) if particao]
+
+@dataclass
+class Entrega:
+        diretorio: Path
+        unidades: Dict[str, str]
+        percorridas: List[str]
+        unidades_com_falha: List[str]
+        materias_com_falha: List[str]
+        atualizacoes: Dict[str, int]
+        localizacao: Dict[str, Tuple[str, str]]
+        unidades_cursos_com_falha: List[str] = field(default_factory=list)
+
+        # (chave, registro) de cada linha do arquivo, com o registro nos bytes em que foi gravado
+        def _linhas(self, arquivo: str) -> Iterator[Tuple[object, bytes]]:
+                decodificador = json.JSONDecoder()
+                with open(self.diretorio / arquivo, 'rb') as f:
+                        for linha in f:
+                                texto = linha.decode('utf-8').rstrip('\n')
+                                chave, fim = decodificador.raw_decode(texto, 1)
+                                yield chave, texto[fim + 1:-1].encode('utf-8')
+
+        def materias(self) -> Iterator[Tuple[str, bytes]]:
+                return self._linhas(ARQUIVO_MATERIAS)
+
+        def cursos(self) -> Iterator[Tuple[Tuple[str, str, str], bytes]]:
+                return ((tuple(chave), curso) for chave, curso in self._linhas(ARQUIVO_CURSOS))
+
+def _linha(chave: object, registro: bytes) -> bytes:
+        return b'[' + json.dumps(chave, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b',' + registro + b']\n'
+
+# Remove a entrega de uma execução anterior, antes de começar a partição
+def descartar(diretorio: Union[str, Path]) -> None:
+        (Path(diretorio) / ARQUIVO_ENTREGA).unlink(missing_ok=True)
+
+def gravar(diretorio: Union[str, Path], materias: saida.Acumulador, cursos: saida.Acumulador, entrega: Entrega) -> None:
+        diretorio = Path(diretorio)
+        saida.gravar_partes(diretorio / ARQUIVO_MATERIAS, lambda: (_linha(c, m) for c, m in materias.itens()), compactar=False)
+        saida.gravar_partes(diretorio / ARQUIVO_CURSOS, lambda: (_linha(list(c), curso) for c, curso in cursos.itens()), compactar=False)
+        descricao = {'formato': FORMATO, 'versao': VERSAO, 'unidades': entrega.unidades, 'percorridas': entrega.percorridas,
+                     'unidades_com_falha': entrega.unidades_com_falha, 'materias_com_falha': entrega.materias_com_falha,
+                     'atualizacoes': entrega.atualizacoes, 'localizacao': entrega.localizacao,
+                     'unidades_cursos_com_falha': entrega.unidades_cursos_com_falha}
+        saida.gravar_atomico(diretorio / ARQUIVO_ENTREGA, json.dumps(descricao, indent=1, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+        logger.info(f" -   Entrega da partição gravada em {diretorio}: {len(materias)} matérias, {len(cursos)} cursos")
+
+# Lê a entrega de uma partição. Levanta FileNotFoundError se a partição não terminou, ValueError se não é uma entrega.
+def ler(diretorio: Union[str, Path]) -> Entrega:
+        diretorio = Path(diretorio)
+        descricao = json.loads((diretorio / ARQUIVO_ENTREGA).read_bytes())
+        if descricao.get('formato') != FORMATO or descricao.get('versao') != VERSAO:
+                raise ValueError(f"{diretorio / ARQUIVO_ENTREGA}: formato desconhecido")
+        return Entrega(diretorio, descricao['unidades'], descricao['percorridas'], descricao['unidades_com_falha'],
+                       descricao['materias_com_falha'], descricao['atualizacoes'],
+                       {codigo: tuple(local) for codigo, local in descricao['localizacao'].items()},
+                       descricao.get('unidades_cursos_com_falha', []))
+
+# Acrescenta as matérias e os cursos das entregas aos acumuladores, na ordem das entregas: o que já foi acrescentado
+# por uma entrega anterior é descartado. Devolve a localização das matérias acrescentadas e as unidades percorridas.
+def juntar(entregas: List[Entrega], materias: saida.Acumulador, cursos: saida.Acumulador) -> Tuple[Dict[str, Tuple[str, str]], Set[str]]:
+        localizacao: Dict[str, Tuple[str, str]] = {}
+        percorridas: Set[str] = set()
+        repetidas = 0
+        for entrega in entregas:
+                percorridas.update(entrega.percorridas)
+                for codigo, dados in entrega.materias():
+                        if codigo in materias:
+                                repetidas += 1
+                                continue
+                        materias.acrescentar(codigo, dados)
+                        localizacao[codigo] = entrega.localizacao[codigo]
+                for chave, curso in entrega.cursos():
+                        if chave in cursos:
+                                repetidas += 1
+                                continue
+                        cursos.acrescentar(chave, curso)
+        logger.info(f" -   {len(entregas)} partições juntadas: {len(materias)} matérias, {len(cursos)} cursos, "
+                    f"{repetidas} repetidos descartados")
+        return localizacao, percorridas
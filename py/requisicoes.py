@@ -0,0 +1,223 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Camada de pedidos HTTP ao JupiterWeb compartilhada por parse_usp.py e parse_cursos_usp.py.
+#
+# - O número de pedidos simultâneos é ajustado por AIMD (aumento aditivo, redução multiplicativa): cresce aos
+#   poucos enquanto as respostas chegam rápidas e é reduzido por um fator fixo quando o servidor responde
+#   429/502/503/504, estoura o tempo limite ou a latência sobe muito acima da latência de base observada.
+# - Falhas temporárias são repetidas com espera exponencial com jitter ("full jitter"), respeitando Retry-After.
+# - Uma única sessão com TCPConnector limitado por host e conexões keep-alive é usada por todos os pedidos.
+import time
+import collections
+import random
+import asyncio
+import logging
+from typing import Deque, Dict, List, Optional, Tuple
+
+import aiohttp
+
+import metricas
+
+logger = logging.getLogger('log')
+
+URL_BASE_PADRAO = 'https://uspdigital.usp.br/jupiterweb'
+USER_AGENT = 'MatrUSPbot/2.0 (+http://www.github.com/matrusp/matrusp)'
+
+# Respostas que indicam falha temporária do servidor, e que portanto são repetidas
+STATUS_TEMPORARIOS = {429, 500, 502, 503, 504}
+# Dentre elas, as que indicam sobrecarga e reduzem o número de pedidos simultâneos. Um 500 isolado costuma ser
+# um erro da página, não da carga, e só é repetido.
+STATUS_SOBRECARGA = {429, 502, 503, 504}
+
+class ErroPedido(Exception):
+        pass
+
+# Limite de pedidos simultâneos ajustado por AIMD
+class LimiteAdaptativo:
+        def __init__(self, maximo: int, inicial: Optional[int] = None, minimo: int = 1, fator_latencia: float = 5.0,
+                     fator_reducao: float = 0.75):
+                self.maximo = maximo
+                self.minimo = min(minimo, maximo)
+                self.limite = float(inicial or maximo)
+                self.fator_latencia = fator_latencia
+                self.fator_reducao = fator_reducao
+                self.em_uso = 0
+                self.latencia_base: Optional[float] = None
+                self.latencia_media: float = 0.0
+                self._esperando: Deque[asyncio.Future] = collections.deque()
+                self._ultima_reducao = 0.0
+
+        # Sem lock: o event loop roda numa única thread. Uma vaga livre é tomada na hora; senão o pedido espera
+        # na fila, e quem libera a vaga já a transfere (em_uso não muda) para o próximo da fila.
+        async def adquirir(self) -> None:
+                if not self._esperando and self.em_uso < int(self.limite):
+                        self.em_uso += 1
+                        return
+                futuro = asyncio.get_running_loop().create_future()
+                self._esperando.append(futuro)
+                try:
+                        await futuro
+                except asyncio.CancelledError:
+                        # Cancelado depois de receber a vaga: devolvê-la
+                        if futuro.done() and not futuro.cancelled():
+                                self.liberar()
+                        raise
+
+        def liberar(self) -> None:
+                self.em_uso -= 1
+                self._acordar()
+
+        def _acordar(self) -> None:
+                while self._esperando and self.em_uso < int(self.limite):
+                        futuro = self._esperando.popleft()
+                        if not futuro.done():
+                                self.em_uso += 1
+                                futuro.set_result(None)
+
+        # Aumento aditivo: cerca de +1 no limite a cada "janela" de respostas bem-sucedidas e rápidas.
+        # Se a latência média passar de fator_latencia × latência de base, o servidor está enfileirando: reduzir.
+        # A média (e não cada resposta) é comparada para que respostas lentas isoladas não derrubem o limite.
+        def sucesso(self, latencia: float) -> None:
+                if self.latencia_base is None:
+                        self.latencia_base = self.latencia_media = latencia
+                self.latencia_media += (latencia - self.latencia_media) * 0.05
+                if latencia < self.latencia_base:
+                        self.latencia_base = latencia
+                else:
+                        # A latência de base sobe lentamente, para acompanhar mudanças permanentes do servidor
+                        self.latencia_base += (latencia - self.latencia_base) * 0.001
+
+                if self.latencia_media > self.fator_latencia * self.latencia_base:
+                        self.reduzir()
+                else:
+                        self.limite = min(self.maximo, self.limite + 1 / self.limite)
+                        self._acordar()
+
+        # Redução multiplicativa, no máximo uma vez a cada latência média, para que várias falhas de uma
+        # mesma rajada não derrubem o limite até o mínimo.
+        def reduzir(self) -> None:
+                agora = time.monotonic()
+                if agora - self._ultima_reducao < self.latencia_media:
+                        return
+                self._ultima_reducao = agora
+                anterior = self.limite
+                self.limite = max(self.minimo, self.limite * self.fator_reducao)
+                logger.debug(f" -      Reduzindo pedidos simultâneos de {int(anterior)} para {int(self.limite)}")
+
+class ClienteJupiter:
+        def __init__(self, url_base: str = URL_BASE_PADRAO, simultaneidade: int = 100, timeout: float = 120,
+                     tentativas: int = 5, conexoes_por_host: Optional[int] = None, espera_base: float = 0.5,
+                     espera_maxima: float = 60, trace_configs: Optional[List[aiohttp.TraceConfig]] = None,
+                     arquivo=None):
+                self.url_base = url_base.rstrip('/')
+                self.timeout = timeout
+                self.tentativas = tentativas
+                self.espera_base = espera_base
+                self.espera_maxima = espera_maxima
+                self.limite = LimiteAdaptativo(simultaneidade)
+                self.estatisticas: Dict[str, int] = {'pedidos': 0, 'repeticoes': 0, 'falhas': 0, 'bytes': 0}
+                self._conexoes = conexoes_por_host or simultaneidade
+                self._trace_configs = trace_configs or []
+                self.session: Optional[aiohttp.ClientSession] = None
+                # pacote.EscritorPacote em que as páginas obtidas são guardadas (--arquivar), ou None
+                self.arquivo = arquivo
+
+        async def __aenter__(self) -> 'ClienteJupiter':
+                connector = aiohttp.TCPConnector(limit=self._conexoes, limit_per_host=self._conexoes,
+                                                 keepalive_timeout=30, ttl_dns_cache=300)
+                self.session = aiohttp.ClientSession(connector=connector, headers={'User-Agent': USER_AGENT},
+                                                     trace_configs=self._trace_configs)
+                return self
+
+        async def __aexit__(self, *excecao) -> None:
+                await self.session.close()
+
+        def url(self, caminho: str) -> str:
+                return caminho if '://' in caminho else f'{self.url_base}/{caminho.lstrip("/")}'
+
+        # Nome da página, sem parâmetros, usado como rótulo das métricas: 'obterTurma', 'jupDisciplinaLista', ...
+        @staticmethod
+        def pagina(caminho: str) -> str:
+                return caminho.split('?', 1)[0].rsplit('/', 1)[-1]
+
+        # Atualiza as métricas instantâneas do limite de pedidos simultâneos (ver metricas.Metricas.coletor)
+        def coletar_metricas(self, registro: metricas.Metricas) -> None:
+                registro.definir('http_limite', int(self.limite.limite))
+                registro.definir('http_em_uso', self.limite.em_uso)
+
+        # Espera antes da tentativa seguinte: exponencial com jitter, ou o Retry-After enviado pelo servidor
+        def espera(self, tentativa: int, retry_after: Optional[str] = None) -> float:
+                if retry_after and retry_after.isdigit():
+                        return min(self.espera_maxima, float(retry_after))
+                return random.uniform(0, min(self.espera_maxima, self.espera_base * 2 ** tentativa))
+
+        # Obtém o conteúdo bruto (bytes, codificação) de uma página. Retorna None se a página não pôde ser obtida
+        # depois de todas as tentativas, ou se o servidor respondeu com um erro permanente. O certificado do servidor é
+        # verificado, exceto com verificar_certificado=False: só nas páginas de matérias e de cursos, que já eram
+        # obtidas assim.
+        async def obter(self, caminho: str, descricao: Optional[str] = None,
+                        verificar_certificado: bool = True) -> Optional[Tuple[bytes, str]]:
+                pagina = self.pagina(caminho)
+                with metricas.registro.medir('http_segundos', pagina=pagina):
+                        return await self._obter(caminho, pagina, descricao, verificar_certificado)
+
+        async def _obter(self, caminho: str, pagina: str, descricao: Optional[str],
+                         verificar_certificado: bool) -> Optional[Tuple[bytes, str]]:
+                url = self.url(caminho)
+                descricao = descricao or url
+                registro = metricas.registro
+                for tentativa in range(self.tentativas):
+                        if tentativa:
+                                self.estatisticas['repeticoes'] += 1
+                                registro.contar('http_repeticoes_total', pagina=pagina)
+                        retry_after = None
+                        await self.limite.adquirir()
+                        try:
+                                inicio = time.monotonic()
+                                self.estatisticas['pedidos'] += 1
+                                # O tempo limite dobra a cada tentativa, até 4 vezes o valor configurado
+                                timeout = aiohttp.ClientTimeout(total=self.timeout * min(4, 2 ** tentativa))
+                                async with self.session.get(url, timeout=timeout, ssl=None if verificar_certificado else False) as response:
+                                        registro.contar('http_pedidos_total', pagina=pagina, resultado=response.status)
+                                        if response.status == 200:
+                                                conteudo = await response.read()
+                                                self.limite.sucesso(time.monotonic() - inicio)
+                                                self.estatisticas['bytes'] += len(conteudo)
+                                                registro.contar('http_bytes_total', len(conteudo), pagina=pagina)
+                                                codificacao = response.get_encoding()
+                                                if self.arquivo is not None:
+                                                        self.arquivo.guardar(caminho, conteudo, codificacao)
+                                                return conteudo, codificacao
+                                        if response.status not in STATUS_TEMPORARIOS:
+                                                raise ErroPedido(f"status {response.status}")
+                                        retry_after = response.headers.get('Retry-After')
+                                        if response.status in STATUS_SOBRECARGA:
+                                                self.limite.reduzir()
+                                        logger.warning(f" -      O pedido de {descricao} retornou {response.status}. Tentando novamente...")
+                        except ErroPedido as e:
+                                self.estatisticas['falhas'] += 1
+                                registro.contar('http_falhas_total', pagina=pagina)
+                                logger.error(f" -      Não foi possível obter {descricao}: {e}")
+                                return None
+                        except asyncio.TimeoutError:
+                                registro.contar('http_pedidos_total', pagina=pagina, resultado='timeout')
+                                self.limite.reduzir()
+                                logger.warning(f" -      O pedido de {descricao} excedeu o tempo limite do pedido. Tentando novamente...")
+                        except aiohttp.ClientError as e:
+                                registro.contar('http_pedidos_total', pagina=pagina, resultado='erro')
+                                self.limite.reduzir()
+                                logger.warning(f" -      O pedido de {descricao} falhou ({e!r}). Tentando novamente...")
+                        finally:
+                                self.limite.liberar()
+
+                        await asyncio.sleep(self.espera(tentativa, retry_after))
+
+                self.estatisticas['falhas'] += 1
+                registro.contar('http_falhas_total', pagina=pagina)
+                logger.error(f" -      Não foi possível obter {descricao} após {self.tentativas} tentativas")
+                return None
+
+        async def obter_texto(self, caminho: str, descricao: Optional[str] = None,
+                              verificar_certificado: bool = True) -> Optional[str]:
+                pagina = await self.obter(caminho, descricao, verificar_certificado)
+                return pagina[0].decode(pagina[1], errors='replace') if pagina else None
@@ -0,0 +1,302 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Grafo de requisitos e índice de currículos pré-calculados a partir de cursos.json, para responder "o que a matéria X
+# libera", "quais são os requisitos (diretos ou não) de X" e "em quais currículos X aparece" sem percorrer todos os
+# cursos. Gravados por parse_cursos_usp.py (e por parse_usp.py, junto com os cursos) ao lado de cursos.json:
+#
+#   requisitos.json: o grafo, sem repetições: cada aresta (matéria, requisito, tipo) aparece uma vez, mesmo que
+#                    esteja em vários currículos
+#     {"materias": [codigo, ...],                       ordenadas; as arestas referem-se às matérias pela posição
+#      "tipos": ["forte", "fraco", "conjunto"],
+#      "requisitos": {"inicio": [...], "destinos": [...], "tipos": [...]},    requisitos de cada matéria
+#      "dependentes": {"inicio": [...], "destinos": [...], "tipos": [...]},   matérias que têm cada uma como requisito
+#      "niveis": [n, ...],                              nível topológico: 0 sem requisitos, senão 1 + o maior nível
+#                                                       dos seus requisitos (fortes e fracos)
+#      "ciclos": [[codigo, ...], ...]}                  matérias que são requisito umas das outras (mesmo nível)
+#   curriculos.json: o índice invertido, de cada matéria para os currículos em que aparece
+#     {"curriculos": [[codigo, periodo, nome], ...],
+#      "materias": [codigo, ...],
+#      "indice": {"inicio": [...], "curriculos": [...], "semestres": [...], "tipos": [...]},
+#      "tipos": ["obrigatoria", "optativa_eletiva", "optativa_livre"]}
+#
+# As listas de adjacência são gravadas em colunas (CSR): as arestas da matéria i são as posições de inicio[i] a
+# inicio[i + 1] de destinos e tipos. Carregado o arquivo, cada consulta custa o grau da matéria.
+# Os requisitos de "Indicação de Conjunto" (cursar junto) são arestas do tipo conjunto, mas não contam nos níveis.
+#
+# Uso: python requisitos.py gerar DIRETORIO_DB                     a partir de cursos.json
+#      python requisitos.py DIRETORIO_DB requisitos MAC0110 [--tipo forte] [--transitivo]
+#      python requisitos.py DIRETORIO_DB dependentes MAC0110 [--tipo forte] [--transitivo]
+#      python requisitos.py DIRETORIO_DB nivel MAC0110
+#      python requisitos.py DIRETORIO_DB curriculos MAC0110
+import sys
+import json
+import bisect
+import logging
+import argparse
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+import saida
+from banco_sqlite import TIPOS_REQUISITO
+
+logger = logging.getLogger('log')
+
+ARQUIVO_REQUISITOS = 'requisitos.json'
+ARQUIVO_CURRICULOS = 'curriculos.json'
+
+TIPOS = list(TIPOS_REQUISITO.values())
+TIPOS_MATERIA = ['obrigatoria', 'optativa_eletiva', 'optativa_livre']
+
+# Tipos de requisito que ordenam as matérias (os níveis); conjunto não
+TIPOS_NIVEL = {'forte', 'fraco'}
+
+# Listas de adjacência em colunas (CSR), a partir das arestas (origem, destino, tipo) já ordenadas por origem
+def _colunas(arestas: Sequence[Tuple[int, int, int]], n: int) -> Dict[str, List[int]]:
+        inicio = [0] * (n + 1)
+        for origem, _, _ in arestas:
+                inicio[origem + 1] += 1
+        for i in range(n):
+                inicio[i + 1] += inicio[i]
+        return {'inicio': inicio, 'destinos': [a[1] for a in arestas], 'tipos': [a[2] for a in arestas]}
+
+# Componentes fortemente conexas (Tarjan, sem recursão) do grafo dado por vizinhos. Cada componente sai depois de
+# todas as que são alcançáveis a partir dela: para as arestas matéria -> requisito, os requisitos vêm antes.
+def _componentes(n: int, vizinhos: List[List[int]]) -> List[List[int]]:
+        indices = [-1] * n
+        menores = [0] * n
+        na_pilha = [False] * n
+        pilha: List[int] = []
+        componentes: List[List[int]] = []
+        contador = 0
+        for raiz in range(n):
+                if indices[raiz] >= 0:
+                        continue
+                caminho = [(raiz, 0)]
+                indices[raiz] = menores[raiz] = contador
+                contador += 1
+                pilha.append(raiz)
+                na_pilha[raiz] = True
+                while caminho:
+                        v, i = caminho[-1]
+                        if i < len(vizinhos[v]):
+                                caminho[-1] = (v, i + 1)
+                                w = vizinhos[v][i]
+                                if indices[w] < 0:
+                                        indices[w] = menores[w] = contador
+                                        contador += 1
+                                        pilha.append(w)
+                                        na_pilha[w] = True
+                                        caminho.append((w, 0))
+                                elif na_pilha[w]:
+                                        menores[v] = min(menores[v], indices[w])
+                                continue
+                        caminho.pop()
+                        if caminho:
+                                pai = caminho[-1][0]
+                                menores[pai] = min(menores[pai], menores[v])
+                        if menores[v] == indices[v]:
+                                componente = []
+                                while True:
+                                        w = pilha.pop()
+                                        na_pilha[w] = False
+                                        componente.append(w)
+                                        if w == v:
+                                                break
+                                componentes.append(componente)
+        return componentes
+
+# Níveis topológicos das matérias; as de um mesmo ciclo ficam no mesmo nível. Devolve também os ciclos.
+def _niveis(n: int, requisitos: List[List[int]]) -> Tuple[List[int], List[List[int]]]:
+        niveis = [0] * n
+        componente_de = [0] * n
+        ciclos = []
+        for c, componente in enumerate(_componentes(n, requisitos)):
+                for v in componente:
+                        componente_de[v] = c
+                nivel = max((niveis[w] + 1 for v in componente for w in requisitos[v] if componente_de[w] != c), default=0)
+                for v in componente:
+                        niveis[v] = nivel
+                if len(componente) > 1 or componente[0] in requisitos[componente[0]]:
+                        ciclos.append(sorted(componente))
+        return niveis, ciclos
+
+# Monta o grafo de requisitos e o índice de currículos a partir dos cursos (dicionários, como em cursos.json)
+def gerar(cursos: Iterable[Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        arestas: Set[Tuple[str, str, str]] = set()
+        ocorrencias: Set[Tuple[str, Tuple[str, str], int, str]] = set()
+        curriculos: Dict[Tuple[str, str], str] = {}
+        for curso in cursos:
+                chave = (curso['codigo'], curso['periodo'])
+                curriculos[chave] = curso.get('nome', '')
+                for semestre, materias in (curso.get('periodos') or {}).items():
+                        for materia in materias:
+                                ocorrencias.add((materia['codigo'], chave, int(semestre) if semestre.isdigit() else -1, materia.get('tipo') or ''))
+                                for campo, tipo in TIPOS_REQUISITO.items():
+                                        arestas.update((materia['codigo'], requisito, tipo) for requisito in materia.get(campo, []))
+
+        materias = sorted({a for a, _, _ in arestas} | {b for _, b, _ in arestas} | {o[0] for o in ocorrencias})
+        posicao = {codigo: i for i, codigo in enumerate(materias)}
+        tipo_indice = {tipo: i for i, tipo in enumerate(TIPOS)}
+        diretas = sorted((posicao[a], posicao[b], tipo_indice[t]) for a, b, t in arestas)
+        reversas = sorted((b, a, t) for a, b, t in diretas)
+
+        requisitos_nivel: List[List[int]] = [[] for _ in materias]
+        for a, b, t in diretas:
+                if TIPOS[t] in TIPOS_NIVEL:
+                        requisitos_nivel[a].append(b)
+        niveis, ciclos = _niveis(len(materias), requisitos_nivel)
+        grafo = {'materias': materias, 'tipos': TIPOS, 'requisitos': _colunas(diretas, len(materias)),
+                 'dependentes': _colunas(reversas, len(materias)), 'niveis': niveis,
+                 'ciclos': [[materias[v] for v in ciclo] for ciclo in sorted(ciclos)]}
+
+        lista_curriculos = sorted(curriculos)
+        curriculo_indice = {chave: i for i, chave in enumerate(lista_curriculos)}
+        materias_curriculos = sorted({o[0] for o in ocorrencias})
+        materia_indice = {codigo: i for i, codigo in enumerate(materias_curriculos)}
+        tipos_materia = TIPOS_MATERIA + sorted({o[3] for o in ocorrencias} - set(TIPOS_MATERIA))
+        tipo_materia_indice = {tipo: i for i, tipo in enumerate(tipos_materia)}
+        entradas = sorted((materia_indice[m], curriculo_indice[c], s, tipo_materia_indice[t]) for m, c, s, t in ocorrencias)
+        inicio = _colunas([(m, c, 0) for m, c, _, _ in entradas], len(materias_curriculos))['inicio']
+        indice = {'materias': materias_curriculos,
+                  'curriculos': [[codigo, periodo, curriculos[(codigo, periodo)]] for codigo, periodo in lista_curriculos],
+                  'indice': {'inicio': inicio, 'curriculos': [e[1] for e in entradas], 'semestres': [e[2] for e in entradas],
+                             'tipos': [e[3] for e in entradas]},
+                  'tipos': tipos_materia}
+        return grafo, indice
+
+def serializar(dados: Dict[str, Any]) -> bytes:
+        return json.dumps(dados, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+# Grava requisitos.json e curriculos.json pelo manifesto (só se mudaram, com as versões compactadas)
+def gravar(manifesto: saida.Manifesto, cursos: Iterable[Dict[str, Any]]) -> None:
+        grafo, indice = gerar(cursos)
+        manifesto.gravar(ARQUIVO_REQUISITOS, serializar(grafo))
+        manifesto.gravar(ARQUIVO_CURRICULOS, serializar(indice))
+        logger.info(f" -   Grafo de requisitos: {len(grafo['materias'])} matérias, {len(grafo['requisitos']['destinos'])} arestas, "
+                    f"{max(grafo['niveis'], default=-1) + 1} níveis, {len(grafo['ciclos'])} ciclos")
+
+def _carregar(dados: Union[str, Path, Dict[str, Any]]) -> Dict[str, Any]:
+        return dados if isinstance(dados, dict) else json.loads(Path(dados).read_bytes())
+
+def _posicao(lista: List[str], codigo: str) -> Optional[int]:
+        i = bisect.bisect_left(lista, codigo)
+        return i if i < len(lista) and lista[i] == codigo else None
+
+class GrafoRequisitos:
+        # A partir de requisitos.json (caminho) ou do dicionário devolvido por gerar
+        def __init__(self, dados: Union[str, Path, Dict[str, Any]]):
+                dados = _carregar(dados)
+                self.materias: List[str] = dados['materias']
+                self.tipos: List[str] = dados['tipos']
+                self._requisitos = dados['requisitos']
+                self._dependentes = dados['dependentes']
+                self.niveis: List[int] = dados['niveis']
+                self.ciclos: List[List[str]] = dados['ciclos']
+
+        def __contains__(self, codigo: str) -> bool:
+                return _posicao(self.materias, codigo) is not None
+
+        def _vizinhos(self, colunas: Dict[str, List[int]], codigo: str, tipos: Optional[Iterable[str]]) -> List[Tuple[str, str]]:
+                i = _posicao(self.materias, codigo)
+                if i is None:
+                        return []
+                aceitos = None if tipos is None else {self.tipos.index(t) for t in tipos}
+                return [(self.materias[colunas['destinos'][j]], self.tipos[colunas['tipos'][j]])
+                        for j in range(colunas['inicio'][i], colunas['inicio'][i + 1])
+                        if aceitos is None or colunas['tipos'][j] in aceitos]
+
+        # Requisitos diretos da matéria, como (codigo, tipo)
+        def requisitos(self, codigo: str, tipos: Optional[Iterable[str]] = None) -> List[Tuple[str, str]]:
+                return self._vizinhos(self._requisitos, codigo, tipos)
+
+        # Matérias que têm esta como requisito direto (o que ela "libera"), como (codigo, tipo)
+        def dependentes(self, codigo: str, tipos: Optional[Iterable[str]] = None) -> List[Tuple[str, str]]:
+                return self._vizinhos(self._dependentes, codigo, tipos)
+
+        def _fecho(self, colunas: Dict[str, List[int]], codigo: str, tipos: Optional[Iterable[str]]) -> List[str]:
+                tipos = None if tipos is None else list(tipos)
+                vistos: Set[str] = set()
+                pendentes = [codigo]
+                while pendentes:
+                        for vizinho, _ in self._vizinhos(colunas, pendentes.pop(), tipos):
+                                if vizinho not in vistos and vizinho != codigo:
+                                        vistos.add(vizinho)
+                                        pendentes.append(vizinho)
+                return sorted(vistos)
+
+        # Todos os requisitos da matéria, diretos e indiretos
+        def todos_requisitos(self, codigo: str, tipos: Optional[Iterable[str]] = None) -> List[str]:
+                return self._fecho(self._requisitos, codigo, tipos)
+
+        # Todas as matérias que dependem desta, direta ou indiretamente
+        def todos_dependentes(self, codigo: str, tipos: Optional[Iterable[str]] = None) -> List[str]:
+                return self._fecho(self._dependentes, codigo, tipos)
+
+        def nivel(self, codigo: str) -> Optional[int]:
+                i = _posicao(self.materias, codigo)
+                return None if i is None else self.niveis[i]
+
+class IndiceCurriculos:
+        # A partir de curriculos.json (caminho) ou do dicionário devolvido por gerar
+        def __init__(self, dados: Union[str, Path, Dict[str, Any]]):
+                dados = _carregar(dados)
+                self.materias: List[str] = dados['materias']
+                self.lista: List[List[str]] = dados['curriculos']
+                self.tipos: List[str] = dados['tipos']
+                self._indice = dados['indice']
+
+        # Currículos em que a matéria aparece: {codigo, periodo, nome, semestre, tipo}; semestre é o "período ideal"
+        # (None se não é numérico)
+        def curriculos(self, codigo: str) -> List[Dict[str, Any]]:
+                i = _posicao(self.materias, codigo)
+                if i is None:
+                        return []
+                indice = self._indice
+                resultado = []
+                for j in range(indice['inicio'][i], indice['inicio'][i + 1]):
+                        curso, periodo, nome = self.lista[indice['curriculos'][j]]
+                        semestre = indice['semestres'][j]
+                        resultado.append({'codigo': curso, 'periodo': periodo, 'nome': nome, 'semestre': semestre if semestre >= 0 else None,
+                                          'tipo': self.tipos[indice['tipos'][j]]})
+                return resultado
+
+if __name__ == "__main__":
+        if len(sys.argv) > 1 and sys.argv[1] == 'gerar':
+                parser = argparse.ArgumentParser(description="Gera requisitos.json e curriculos.json a partir de cursos.json")
+                parser.add_argument('comando')
+                parser.add_argument('diretorio_db', help="diretório com cursos.json")
+                args = parser.parse_args()
+                logger.setLevel(logging.INFO)
+                logger.addHandler(logging.StreamHandler())
+                manifesto = saida.Manifesto(args.diretorio_db, arquivo='manifesto_cursos.json')
+                gravar(manifesto, json.loads((Path(args.diretorio_db) / 'cursos.json').read_bytes()))
+                manifesto.salvar()
+                sys.exit(0)
+
+        parser = argparse.ArgumentParser(description="Consultas ao grafo de requisitos e ao índice de currículos")
+        parser.add_argument('diretorio_db', help=f"diretório com {ARQUIVO_REQUISITOS} e {ARQUIVO_CURRICULOS}")
+        comandos = parser.add_subparsers(dest='comando', required=True)
+        for nome, ajuda in (('requisitos', "requisitos de CODIGO"), ('dependentes', "matérias que têm CODIGO como requisito")):
+                c = comandos.add_parser(nome, help=ajuda)
+                c.add_argument('codigo')
+                c.add_argument('--tipo', choices=TIPOS, nargs='+')
+                c.add_argument('--transitivo', help="incluir os indiretos", action='store_true')
+        comandos.add_parser('nivel', help="nível topológico de CODIGO").add_argument('codigo')
+        comandos.add_parser('curriculos', help="currículos em que CODIGO aparece").add_argument('codigo')
+        args = parser.parse_args()
+
+        diretorio = Path(args.diretorio_db)
+        if args.comando == 'curriculos':
+                for curriculo in IndiceCurriculos(diretorio / ARQUIVO_CURRICULOS).curriculos(args.codigo):
+                        print('\t'.join('' if v is None else str(v) for v in curriculo.values()))
+                sys.exit(0)
+        grafo = GrafoRequisitos(diretorio / ARQUIVO_REQUISITOS)
+        if args.comando == 'nivel':
+                print(grafo.nivel(args.codigo))
+        elif args.transitivo:
+                funcao = grafo.todos_requisitos if args.comando == 'requisitos' else grafo.todos_dependentes
+                print('\n'.join(funcao(args.codigo, args.tipo)))
+        else:
+                funcao = grafo.requisitos if args.comando == 'requisitos' else grafo.dependentes
+                for codigo, tipo in funcao(args.codigo, args.tipo):
+                        print(f"{codigo}\t{tipo}")
@@ -0,0 +1,427 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Gravação incremental dos arquivos de saída dos crawlers (db/{codigo}.json, db.json, cursos.json, ...).
+#
+# O manifesto (db/manifesto.json, ou db/manifesto_cursos.json para parse_cursos_usp.py) guarda o hash do conteúdo
+# de cada arquivo gravado. Um arquivo só é reescrito (junto com suas versões compactadas) quando o conteúdo muda ou
+# quando falta no disco, de forma que arquivos inalterados mantêm o mtime e o ETag entre execuções, e o cache do
+# navegador e da CDN continua válido.
+# Todos os arquivos são gravados num temporário e renomeados sobre o destino, então quem os lê (o servidor web, ou
+# parse_usp.py --resume depois de uma interrupção) nunca encontra um JSON gravado pela metade.
+#
+# Cada arquivo é gravado também pré-compactado, em cada formato de Compressao: .gz e, se as bibliotecas opcionais
+# estiverem instaladas, .br (brotli) e .zst (zstandard). db/.htaccess serve o menor formato que o navegador aceita.
+# A compressão é determinística (o .gz tem mtime 0 no cabeçalho): o mesmo conteúdo sempre gera os mesmos bytes.
+#
+# Os arquivos agregados (db.json, cursos.json, fragmentos, snapshots) não são montados em memória: cada registro é
+# serializado uma única vez, guardado num Acumulador (um arquivo temporário) à medida que chega, e o arquivo final
+# é gravado por partes, compactado de forma incremental (ver Manifesto.gravar_partes). Com um executor, cada formato
+# é gravado numa thread: zlib, brotli e zstandard liberam o GIL enquanto compactam.
+import re
+import sys
+import mmap
+import time
+import zlib
+import argparse
+import threading
+import os
+import json
+import hashlib
+import logging
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, Union
+
+try:
+        import brotli
+except ImportError:
+        brotli = None
+
+try:
+        import zstandard
+except ImportError:
+        zstandard = None
+
+logger = logging.getLogger('log')
+
+ARQUIVO_MANIFESTO = 'manifesto.json'
+
+def hash_conteudo(conteudo: bytes) -> str:
+        return hashlib.blake2b(conteudo, digest_size=16).hexdigest()
+
+# Hash de um conteúdo dado em partes, igual ao de hash_conteudo(b''.join(partes))
+def hash_partes(partes: Iterable[bytes]) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        for parte in partes:
+                h.update(parte)
+        return h.hexdigest()
+
+# Partes de um array JSON, sem espaços como os elementos de modelo.serializar, a partir dos elementos já serializados
+def lista_json(elementos: Iterable[bytes]) -> Iterator[bytes]:
+        yield b'['
+        for i, elemento in enumerate(elementos):
+                if i:
+                        yield b','
+                yield elemento
+        yield b']'
+
+# Compactadores incrementais, com a interface de zlib.compressobj: compress(dados) e flush(), que devolvem os bytes
+# compactados até ali, para os arquivos gravados por partes
+class _Brotli:
+        def __init__(self, nivel: int):
+                self._compactador = brotli.Compressor(quality=nivel)
+
+        def compress(self, dados: bytes) -> bytes:
+                return self._compactador.process(dados)
+
+        def flush(self) -> bytes:
+                return self._compactador.finish()
+
+def _gzip(nivel: int) -> Any:
+        return zlib.compressobj(nivel, zlib.DEFLATED, 31)
+
+def _zstandard(nivel: int) -> Any:
+        return zstandard.ZstdCompressor(level=nivel).compressobj()
+
+# Compressão de um arquivo inteiro. Para o zstandard, a compressão de uma vez (que conhece o tamanho do conteúdo)
+# escolhe uma janela proporcional ao arquivo, e é dezenas de vezes mais rápida que a incremental para arquivos pequenos.
+def _gzip_inteiro(nivel: int, dados: bytes) -> bytes:
+        compactador = _gzip(nivel)
+        return compactador.compress(dados) + compactador.flush()
+
+def _brotli_inteiro(nivel: int, dados: bytes) -> bytes:
+        return brotli.compress(dados, quality=nivel)
+
+def _zstandard_inteiro(nivel: int, dados: bytes) -> bytes:
+        return zstandard.ZstdCompressor(level=nivel).compress(dados)
+
+class Formato:
+        __slots__ = ('nivel_padrao', 'niveis', 'compactador', 'compactar', 'modulo')
+
+        def __init__(self, nivel_padrao: int, niveis: range, compactador: Callable[[int], Any],
+                     compactar: Callable[[int, bytes], bytes], modulo: Optional[str] = None):
+                self.nivel_padrao = nivel_padrao
+                self.niveis = niveis
+                self.compactador = compactador
+                self.compactar = compactar
+                self.modulo = modulo # Módulo opcional de que o formato depende
+
+        def disponivel(self) -> bool:
+                return self.modulo is None or globals()[self.modulo] is not None
+
+# Formatos de compressão, pela extensão. Os níveis padrão do brotli e do zstandard dão arquivos do mesmo tamanho,
+# em poucos segundos para o db.json inteiro; os níveis máximos (br=11, zst=19) ganham uns 10% a mais, mas levam
+# dezenas de segundos a cada vez que ele muda.
+FORMATOS: Dict[str, Formato] = {
+        'gz': Formato(9, range(0, 10), _gzip, _gzip_inteiro),
+        'br': Formato(9, range(0, 12), _Brotli, _brotli_inteiro, 'brotli'),
+        'zst': Formato(15, range(1, 23), _zstandard, _zstandard_inteiro, 'zstandard'),
+}
+
+def formatos_disponiveis() -> List[str]:
+        return [nome for nome, formato in FORMATOS.items() if formato.disponivel()]
+
+# Formatos e níveis de compressão dos arquivos de saída, como {'gz': 9, 'br': 11}. Sem formatos, não compacta.
+class Compressao:
+        def __init__(self, niveis: Optional[Dict[str, int]] = None):
+                self.niveis: Dict[str, int] = dict(niveis or {})
+
+        # True (só .gz, no nível padrão) ou False (nenhum formato), como o antigo parâmetro compactar
+        @staticmethod
+        def de(compactar: Union[bool, 'Compressao']) -> 'Compressao':
+                if isinstance(compactar, Compressao):
+                        return compactar
+                return Compressao({'gz': FORMATOS['gz'].nivel_padrao} if compactar else {})
+
+        def __bool__(self) -> bool:
+                return bool(self.niveis)
+
+        def __repr__(self) -> str:
+                return ' '.join(f"{formato}={nivel}" for formato, nivel in self.niveis.items()) or 'nenhuma'
+
+        def formatos(self) -> List[str]:
+                return list(self.niveis)
+
+        def compactador(self, formato: str) -> Any:
+                return FORMATOS[formato].compactador(self.niveis[formato])
+
+        def compactar(self, formato: str, dados: bytes) -> bytes:
+                return FORMATOS[formato].compactar(self.niveis[formato], dados)
+
+# Argumentos de linha de comando da compressão, comuns aos crawlers (além de --nogzip, que desliga a compressão)
+def adicionar_argumentos(parser: argparse.ArgumentParser) -> None:
+        parser.add_argument('--compressao', help=f"formatos dos arquivos pré-compactados (padrão: os disponíveis, {' '.join(formatos_disponiveis())})",
+                            nargs='+', choices=list(FORMATOS))
+        parser.add_argument('--nivel-compressao', help="nível de compressão de cada formato (padrão: " +
+                            ' '.join(f"{nome}={formato.nivel_padrao}" for nome, formato in FORMATOS.items()) + ")",
+                            nargs='+', default=[], metavar='FORMATO=NIVEL')
+
+# Compressao dos argumentos de linha de comando. Levanta ValueError se um formato não estiver disponível ou se um
+# nível for inválido.
+def compressao_dos_argumentos(args: argparse.Namespace) -> Compressao:
+        if args.nogzip:
+                return Compressao()
+        formatos = args.compressao or formatos_disponiveis()
+        for formato in formatos:
+                if not FORMATOS[formato].disponivel():
+                        raise ValueError(f"o formato {formato} precisa do módulo {FORMATOS[formato].modulo}")
+        niveis = {formato: FORMATOS[formato].nivel_padrao for formato in formatos}
+        for opcao in args.nivel_compressao:
+                formato, _, nivel = opcao.partition('=')
+                if formato not in niveis or not nivel.isdigit() or int(nivel) not in FORMATOS[formato].niveis:
+                        raise ValueError(f"nível de compressão inválido: {opcao}")
+                niveis[formato] = int(nivel)
+        return Compressao(niveis)
+
+def _variante(caminho: Path, formato: str) -> Path:
+        return caminho.with_name(f"{caminho.name}.{formato}")
+
+SUFIXO_TEMPORARIO = '.tmp'
+TAMANHO_BUFFER = 1 << 20
+
+def _temporario(caminho: Path) -> Path:
+        return caminho.with_name(f".{caminho.name}.{os.getpid()}.{threading.get_ident()}{SUFIXO_TEMPORARIO}")
+
+# Grava os dados em caminho atomicamente: num temporário no mesmo diretório, renomeado sobre caminho
+def gravar_atomico(caminho: Path, dados: bytes) -> None:
+        temporario = _temporario(caminho)
+        try:
+                temporario.write_bytes(dados)
+                os.replace(temporario, caminho)
+        except BaseException:
+                temporario.unlink(missing_ok=True)
+                raise
+
+# Tempo (segundos) sem modificação a partir do qual um temporário de outro processo é considerado abandonado
+IDADE_TEMPORARIO_ABANDONADO = 3600
+
+re_pid_temporario = re.compile(r"\.(\d+)(?:\.\d+)?" + re.escape(SUFIXO_TEMPORARIO))
+
+def _processo_existe(pid: int) -> bool:
+        # No Windows, os.kill(pid, 0) encerraria o processo: lá vale só a idade do temporário
+        if sys.platform == 'win32':
+                return False
+        try:
+                os.kill(pid, 0)
+        except ProcessLookupError:
+                return False
+        except PermissionError:
+                pass
+        return True
+
+# Remove os temporários (em diretorio e subdiretórios) deixados por uma execução que morreu antes de renomeá-los. Um
+# crawler pode estar gravando no mesmo diretório ao mesmo tempo (por exemplo, --vagas junto com uma execução completa),
+# então só são removidos os temporários cujo processo (o pid no nome) não existe mais e que não são modificados há
+# IDADE_TEMPORARIO_ABANDONADO segundos; a idade cobre processos de outras máquinas, num diretório compartilhado.
+def remover_temporarios(diretorio: Path, idade: float = IDADE_TEMPORARIO_ABANDONADO) -> None:
+        agora = time.time()
+        for temporario in diretorio.rglob(f".*{SUFIXO_TEMPORARIO}"):
+                r = re_pid_temporario.search(temporario.name)
+                if r is None or int(r.group(1)) == os.getpid() or _processo_existe(int(r.group(1))):
+                        continue
+                try:
+                        if agora - temporario.stat().st_mtime < idade:
+                                continue
+                except FileNotFoundError:
+                        continue
+                temporario.unlink(missing_ok=True)
+
+# Remove as versões compactadas de caminho em formatos que não estão em compressao, que de outra forma
+# continuariam a ser servidas com o conteúdo antigo
+def _remover_outras_variantes(caminho: Path, compressao: Compressao) -> None:
+        for formato in FORMATOS:
+                if formato not in compressao.niveis:
+                        _variante(caminho, formato).unlink(missing_ok=True)
+
+# Grava caminho e suas versões compactadas. compactar é uma Compressao, ou True (.gz) ou False (nenhuma).
+def gravar_arquivo(caminho: Path, dados: bytes, compactar: Union[bool, Compressao] = True) -> None:
+        compressao = Compressao.de(compactar)
+        for formato in compressao.formatos():
+                gravar_atomico(_variante(caminho, formato), compressao.compactar(formato, dados))
+        gravar_atomico(caminho, dados)
+        _remover_outras_variantes(caminho, compressao)
+
+# Grava as partes, compactadas se houver compactador, num temporário de caminho, e devolve o temporário
+def _gravar_temporario(caminho: Path, partes: Iterable[bytes], compactador: Any = None) -> Path:
+        temporario = _temporario(caminho)
+        try:
+                with open(temporario, 'wb', buffering=TAMANHO_BUFFER) as arquivo:
+                        for parte in partes:
+                                arquivo.write(compactador.compress(parte) if compactador is not None else parte)
+                        if compactador is not None:
+                                arquivo.write(compactador.flush())
+        except BaseException:
+                temporario.unlink(missing_ok=True)
+                raise
+        return temporario
+
+# Grava caminho e suas versões compactadas a partir das partes do conteúdo, sem juntá-las em memória: partes() é
+# percorrido uma vez por arquivo, e cada parte é compactada assim que é produzida. Com um executor, os arquivos
+# são gravados em paralelo. Todos são renomeados no fim, depois que todos foram gravados.
+def gravar_partes(caminho: Path, partes: Callable[[], Iterable[bytes]], compactar: Union[bool, Compressao] = True,
+                  executor: Optional[Executor] = None) -> None:
+        compressao = Compressao.de(compactar)
+        destinos = [(_variante(caminho, formato), formato) for formato in compressao.formatos()] + [(caminho, None)]
+
+        def gravar(destino: Path, formato: Optional[str]) -> Path:
+                return _gravar_temporario(destino, partes(), compressao.compactador(formato) if formato else None)
+
+        if executor is None:
+                tarefas = []
+                for destino, formato in destinos:
+                        try:
+                                tarefas.append(gravar(destino, formato))
+                        except BaseException as e:
+                                tarefas.append(e)
+                                break
+        else:
+                futuros = [executor.submit(gravar, destino, formato) for destino, formato in destinos]
+                tarefas = [f.exception() or f.result() for f in futuros]
+
+        erros = [t for t in tarefas if isinstance(t, BaseException)]
+        if erros:
+                for temporario in tarefas:
+                        if isinstance(temporario, Path):
+                                temporario.unlink(missing_ok=True)
+                raise erros[0]
+        for temporario, (destino, _) in zip(tarefas, destinos):
+                os.replace(temporario, destino)
+        _remover_outras_variantes(caminho, compressao)
+
+# Remove caminho e suas versões compactadas, em qualquer formato, se existirem
+def remover_arquivo(caminho: Path) -> None:
+        for c in [caminho] + [_variante(caminho, formato) for formato in FORMATOS]:
+                c.unlink(missing_ok=True)
+
+class Manifesto:
+        # Cada crawler usa o seu próprio arquivo de manifesto, para que possam rodar ao mesmo tempo no mesmo diretório.
+        # compactar é uma Compressao, ou True (.gz) ou False (nenhuma). gravar pode ser chamado de várias threads;
+        # gravar_partes usa o executor, se houver, para gravar os formatos em paralelo.
+        def __init__(self, diretorio: Union[str, Path], compactar: Union[bool, Compressao] = True, arquivo: str = ARQUIVO_MANIFESTO,
+                     executor: Optional[Executor] = None):
+                self.diretorio = Path(diretorio)
+                self.compressao = Compressao.de(compactar)
+                self.executor = executor
+                self.arquivo = self.diretorio / arquivo
+                self.hashes: Dict[str, str] = {}
+                self.estatisticas: Dict[str, int] = {'gravados': 0, 'inalterados': 0, 'removidos': 0}
+                self._trava = threading.Lock()
+                if self.arquivo.exists():
+                        try:
+                                self.hashes = json.loads(self.arquivo.read_text())
+                        except ValueError:
+                                logger.warning(f" -   Manifesto {self.arquivo} inválido, todos os arquivos serão regravados")
+
+        def _caminhos(self, nome: str) -> Iterable[Path]:
+                yield self.diretorio / nome
+                for formato in self.compressao.formatos():
+                        yield _variante(self.diretorio / nome, formato)
+
+        def _atual(self, nome: str, digest: str) -> bool:
+                return self.hashes.get(nome) == digest and all(p.exists() for p in self._caminhos(nome))
+
+        def _contar(self, estatistica: str) -> None:
+                with self._trava:
+                        self.estatisticas[estatistica] += 1
+
+        # Grava diretorio/nome (e as versões compactadas) se o conteúdo for diferente do registrado no manifesto.
+        # Retorna True se o arquivo foi gravado.
+        def gravar(self, nome: str, conteudo: Union[str, bytes]) -> bool:
+                dados = conteudo.encode('utf-8') if isinstance(conteudo, str) else conteudo
+                digest = hash_conteudo(dados)
+                if self._atual(nome, digest):
+                        self._contar('inalterados')
+                        return False
+
+                gravar_arquivo(self.diretorio / nome, dados, self.compressao)
+                self.hashes[nome] = digest
+                self._contar('gravados')
+                return True
+
+        # Como gravar, para um conteúdo produzido em partes por partes(), sem montá-lo em memória. partes() é
+        # percorrido uma vez para calcular o hash e, só se o conteúdo mudou, de novo para cada arquivo gravado.
+        def gravar_partes(self, nome: str, partes: Callable[[], Iterable[bytes]]) -> bool:
+                digest = hash_partes(partes())
+                if self._atual(nome, digest):
+                        self._contar('inalterados')
+                        return False
+
+                gravar_partes(self.diretorio / nome, partes, self.compressao, self.executor)
+                self.hashes[nome] = digest
+                self._contar('gravados')
+                return True
+
+        # Registra no manifesto o conteúdo de um arquivo lido do disco, sem regravá-lo (só o que faltar é gravado)
+        def registrar(self, nome: str, conteudo: Union[str, bytes]) -> bool:
+                if all(p.exists() for p in self._caminhos(nome)):
+                        self.hashes[nome] = hash_conteudo(conteudo.encode('utf-8') if isinstance(conteudo, str) else conteudo)
+                        self._contar('inalterados')
+                        return False
+                return self.gravar(nome, conteudo)
+
+        # Remove diretorio/nome, as versões compactadas e a entrada do manifesto
+        def remover(self, nome: str) -> None:
+                remover_arquivo(self.diretorio / nome)
+                if self.hashes.pop(nome, None) is not None:
+                        self._contar('removidos')
+
+        def salvar(self) -> None:
+                gravar_atomico(self.arquivo, json.dumps(self.hashes, sort_keys=True, indent=0).encode('utf-8'))
+
+# Registros já serializados (por exemplo, o JSON de cada matéria), guardados num arquivo temporário à medida que
+# chegam. Em memória fica só a posição de cada registro, então o tamanho do processo não cresce com o catálogo, e os
+# arquivos agregados são gravados a partir daqui, em qualquer ordem. O arquivo é removido por fechar(), ou por
+# remover_temporarios (numa execução seguinte) se o processo morrer antes.
+class Acumulador:
+        def __init__(self, diretorio: Union[str, Path], nome: str):
+                self.caminho = Path(diretorio) / f".{nome}.{os.getpid()}{SUFIXO_TEMPORARIO}"
+                self._arquivo = open(self.caminho, 'w+b', buffering=TAMANHO_BUFFER)
+                self._posicoes: Dict[Hashable, Tuple[int, int]] = {}
+                self._tamanho = 0
+                self._mapa: Optional[mmap.mmap] = None
+
+        def __len__(self) -> int:
+                return len(self._posicoes)
+
+        def __contains__(self, chave: Hashable) -> bool:
+                return chave in self._posicoes
+
+        # Acrescenta um registro; um registro com a mesma chave substitui o anterior
+        def acrescentar(self, chave: Hashable, dados: bytes) -> None:
+                if self._mapa is not None:
+                        self._mapa.close()
+                        self._mapa = None
+                self._arquivo.write(dados)
+                self._posicoes[chave] = (self._tamanho, len(dados))
+                self._tamanho += len(dados)
+
+        def ler(self, chave: Hashable) -> bytes:
+                if self._mapa is None:
+                        self._arquivo.flush()
+                        if not self._tamanho:
+                                return b''
+                        self._mapa = mmap.mmap(self._arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+                inicio, tamanho = self._posicoes[chave]
+                return self._mapa[inicio:inicio + tamanho]
+
+        # Chaves em ordem crescente
+        def chaves(self) -> List[Hashable]:
+                return sorted(self._posicoes)
+
+        # (chave, registro) em ordem crescente de chave, ou na ordem das chaves dadas
+        def itens(self, chaves: Optional[Iterable[Hashable]] = None) -> Iterator[Tuple[Hashable, bytes]]:
+                for chave in self.chaves() if chaves is None else chaves:
+                        yield chave, self.ler(chave)
+
+        def fechar(self) -> None:
+                if self._mapa is not None:
+                        self._mapa.close()
+                        self._mapa = None
+                self._arquivo.close()
+                self.caminho.unlink(missing_ok=True)
+
+        def __enter__(self) -> 'Acumulador':
+                return self
+
+        def __exit__(self, *excecao) -> None:
+                self.fechar()
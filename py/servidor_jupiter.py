@@ -0,0 +1,340 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Servidor local que imita o JupiterWeb a partir de páginas gravadas (fixtures), para testar e medir
+# o desempenho dos crawlers sem acessar uspdigital.usp.br.
+#
+# Uso:
+#   python servidor_jupiter.py gerar ../db fixtures/            # gera páginas sintéticas a partir de db/*.json
+#   python servidor_jupiter.py gravar fixtures/ -u 45 55        # grava as páginas reais das unidades 45 e 55
+#   python servidor_jupiter.py servir fixtures/ --latencia 200 --jitter 100 --taxa-erro 0.01
+#
+# O diretório de fixtures tem a forma:
+#   jupColegiadoLista.html
+#   jupDisciplinaLista/{codcg}.html
+#   obterTurma/{sgldis}.html
+#   obterDisciplina/{sgldis}.html
+#   jupCursoLista/{codcg}.html
+#   listarGradeCurricular/{codcur}-{codhab}[-{periodo}].html
+#
+# O nome de cada arquivo é montado só com os parâmetros de PARAMETROS, nessa ordem, e com os caracteres fora de
+# [A-Za-z0-9_-] trocados por _, de forma que um pedido não consegue ler fora do diretório. O período não existe nos
+# links do JupiterWeb: só as páginas geradas o acrescentam, porque um mesmo curso/habilitação pode ter uma grade por
+# período, e sem ele uma sobrescreveria a outra.
+import re
+import json
+import html
+import random
+import asyncio
+import argparse
+import logging
+from pathlib import Path
+from typing import Dict, List, Any, Mapping, Optional
+from urllib.parse import quote_plus
+
+from aiohttp import web
+
+from parse_usp import campus_por_unidade
+from requisicoes import ClienteJupiter, URL_BASE_PADRAO
+
+logger = logging.getLogger('log')
+
+PAGINAS = ('jupColegiadoLista', 'jupDisciplinaLista', 'obterTurma', 'obterDisciplina', 'jupCursoLista', 'listarGradeCurricular')
+
+# Parâmetros de consulta que identificam o arquivo de cada página, na ordem do nome; os de OPCIONAIS podem faltar
+PARAMETROS = {
+        'jupDisciplinaLista': ('codcg',),
+        'obterTurma': ('sgldis',),
+        'obterDisciplina': ('sgldis',),
+        'jupCursoLista': ('codcg',),
+        'listarGradeCurricular': ('codcur', 'codhab', 'periodo'),
+}
+OPCIONAIS = {'periodo'}
+
+def _limpar(valor: str) -> str:
+        return re.sub(r'[^A-Za-z0-9_-]', '_', valor.strip())
+
+# Nome do arquivo de uma página a partir dos parâmetros do pedido. Levanta KeyError se falta algum obrigatório.
+def chave_fixture(pagina: str, parametros: Mapping[str, str]) -> str:
+        valores = []
+        for nome in PARAMETROS[pagina]:
+                valor = _limpar(parametros.get(nome) or '')
+                if not valor and nome not in OPCIONAIS:
+                        raise KeyError(nome)
+                if valor:
+                        valores.append(valor)
+        return '-'.join(valores)
+
+def caminho_fixture(diretorio: Path, pagina: str, chave: Optional[str] = None) -> Path:
+        if chave is None:
+                return diretorio / f"{pagina}.html"
+        return diretorio / pagina / f"{_limpar(chave)}.html"
+
+# ---------------------------------------------------------------------------
+# Servidor
+# ---------------------------------------------------------------------------
+
+def criar_app(diretorio: Path, latencia: float = 0, jitter: float = 0, taxa_erro: float = 0, semente: Optional[int] = None) -> web.Application:
+        aleatorio = random.Random(semente)
+        estatisticas = {'pedidos': 0, 'erros_injetados': 0, 'nao_encontrados': 0}
+
+        async def responder(request: web.Request) -> web.Response:
+                pagina = request.match_info['pagina']
+                estatisticas['pedidos'] += 1
+
+                # Latência simulada: latencia ± jitter (ms), nunca negativa
+                atraso = max(0.0, latencia + aleatorio.uniform(-jitter, jitter)) / 1000
+                if atraso:
+                        await asyncio.sleep(atraso)
+
+                if taxa_erro and aleatorio.random() < taxa_erro:
+                        estatisticas['erros_injetados'] += 1
+                        return web.Response(status=aleatorio.choice((500, 503)), text="Erro simulado")
+
+                try:
+                        chave = chave_fixture(pagina, request.query) if pagina in PARAMETROS else None
+                except KeyError:
+                        return web.Response(status=400, text="Parâmetros inválidos")
+
+                arquivo = caminho_fixture(diretorio, pagina, chave)
+                if not arquivo.is_file():
+                        estatisticas['nao_encontrados'] += 1
+                        return web.Response(status=404, text="Página não gravada")
+                return web.Response(body=arquivo.read_bytes(), content_type='text/html', charset='utf-8')
+
+        async def status(request: web.Request) -> web.Response:
+                return web.json_response(estatisticas)
+
+        app = web.Application()
+        app['estatisticas'] = estatisticas
+        app.router.add_get('/_status', status)
+        app.router.add_get('/{pagina:(' + '|'.join(PAGINAS) + ')}', responder)
+        return app
+
+def servir(diretorio: Path, host: str = '127.0.0.1', porta: int = 8080, **opcoes) -> None:
+        web.run_app(criar_app(diretorio, **opcoes), host=host, port=porta, print=None, access_log=None)
+
+# ---------------------------------------------------------------------------
+# Geração de páginas sintéticas a partir de um db/ já existente
+# ---------------------------------------------------------------------------
+# As páginas geradas reproduzem apenas a estrutura de tabelas que os parsers de parse_usp.py e
+# parse_cursos_usp.py esperam, de forma que parsear as páginas geradas devolve o mesmo JSON de origem.
+
+e = html.escape
+
+def _tabela(linhas: List[List[str]]) -> str:
+        return '<table>' + ''.join('<tr>' + ''.join(f'<td>{e(td)}</td>' for td in tds) + '</tr>' for tds in linhas) + '</table>'
+
+def _pagina(*tabelas: str) -> str:
+        # Tabela externa de layout, como no JupiterWeb; somente as tabelas internas são "folhas"
+        corpo = ''.join(f'<tr><td>{t}</td></tr>' for t in tabelas)
+        return f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>JupiterWeb</title></head><body><table>{corpo}</table></body></html>'
+
+def renderizar_lista_unidades(unidades: Dict[str, str]) -> str:
+        links = ''.join(f'<tr><td><a href="jupColegiadoMenu.jsp?codcg={codigo}&amp;tipo=D&amp;nomclg={quote_plus(nome)}">{e(nome)}</a></td></tr>'
+                        for nome, codigo in unidades.items())
+        return _pagina(f'<table>{links}</table>')
+
+def renderizar_lista_disciplinas(materias: List[Dict[str, Any]]) -> str:
+        links = ''.join(f'<tr><td><a href="obterTurma?sgldis={m["codigo"]}&amp;print=true">{e(m["codigo"])}</a></td><td>{e(m["nome"])}</td></tr>'
+                        for m in materias)
+        return _pagina(f'<table>{links}</table>')
+
+def renderizar_turmas(materia: Dict[str, Any]) -> str:
+        rotulos = {'codigo': 'Código da Turma', 'codigo_teorica': 'Código da Turma Teórica', 'inicio': 'Início',
+                   'fim': 'Fim', 'tipo': 'Tipo da Turma', 'observacoes': 'Observações'}
+        tabelas = []
+        for turma in materia['turmas']:
+                tabelas.append(_tabela([[rotulos[k], v] for k, v in turma.items() if k in rotulos]))
+
+                # Horário/vagas nulos correspondem a turmas sem a respectiva tabela na página
+                if turma['horario'] is not None:
+                        tabelas.append(_tabela_horario(turma['horario']))
+                if turma['vagas'] is not None:
+                        tabelas.append(_tabela_vagas(turma['vagas']))
+        return _pagina(*tabelas)
+
+def _tabela_horario(horario: List[Dict[str, Any]]) -> str:
+        linhas = [['Horário', '', '', 'Prof(a).']]
+        dia_anterior = None
+        for h in horario:
+                # Aulas seguidas no mesmo dia aparecem sem o dia, como no JupiterWeb
+                dia = '' if h['dia'] == dia_anterior else h['dia']
+                linhas.append([dia, h['inicio'], h['fim'], h['professores'][0]])
+                linhas.extend(['', '', '', p] for p in h['professores'][1:])
+                dia_anterior = h['dia']
+        return _tabela(linhas)
+
+def _tabela_vagas(vagas: Dict[str, Any]) -> str:
+        linhas = [['', 'Vagas', 'Inscritos', 'Pendentes', 'Matriculados']]
+        for tipo, v in vagas.items():
+                linhas.append([tipo, str(v['vagas']), str(v['inscritos']), str(v['pendentes']), str(v['matriculados'])])
+                for grupo, g in v['grupos'].items():
+                        linhas.append(['', grupo, str(g['vagas']), str(g['inscritos']), str(g['pendentes']), str(g['matriculados'])])
+        return _tabela(linhas)
+
+def renderizar_disciplina(materia: Dict[str, Any]) -> str:
+        tabelas = [_tabela([[materia['unidade']], [materia['departamento']], [f"Disciplina: {materia['codigo']} - {materia['nome']}"]])]
+        for chave in materia:
+                if chave == 'creditos_aula':
+                        tabelas.append(_tabela([['Créditos Aula:', str(materia['creditos_aula'])],
+                                                ['Créditos Trabalho:', str(materia.get('creditos_trabalho', 0))]]))
+                elif chave == 'objetivos':
+                        tabelas.append(_tabela([['Objetivos'], [materia['objetivos']]]))
+                elif chave == 'programa_resumido':
+                        tabelas.append(_tabela([['Programa Resumido'], [materia['programa_resumido']]]))
+        return _pagina(*tabelas)
+
+def renderizar_lista_cursos(codcg: str, cursos: List[Dict[str, Any]]) -> str:
+        linhas = []
+        for curso in cursos:
+                codcur, codhab = curso['codigo'].split('-', 1)
+                href = f"listarGradeCurricular?codcg={codcg}&amp;codcur={codcur}&amp;codhab={codhab}&amp;tipo=N&amp;periodo={quote_plus(curso['periodo'])}"
+                linhas.append(f'<tr><td><a href="{href}">{e(curso["nome"])}</a></td><td>{e(curso["periodo"])}</td><td></td></tr>')
+        return _pagina(f'<table>{"".join(linhas)}</table>')
+
+def renderizar_grade(curso: Dict[str, Any]) -> str:
+        tipos = {'obrigatoria': 'Disciplinas Obrigatórias', 'optativa_eletiva': 'Disciplinas Optativas Eletivas',
+                 'optativa_livre': 'Disciplinas Optativas Livres'}
+        reqs = (('req_forte', 'Requisito'), ('req_fraco', 'Requisito fraco'), ('ind_conjunto', 'Indicação de Conjunto'))
+        cabecalho = f'<table><tr><td>Curso: {e(curso["nome"])}\n</td></tr></table>'
+        if 'periodos' not in curso:
+                return _pagina(cabecalho)
+
+        linhas = [['Disciplinas Obrigatórias']]
+        tipo_atual = 'obrigatoria'
+        for periodo, disciplinas in curso['periodos'].items():
+                linhas.append([f'{periodo}º Período Ideal'])
+                for d in disciplinas:
+                        if d['tipo'] != tipo_atual:
+                                linhas.append([tipos[d['tipo']]])
+                                tipo_atual = d['tipo']
+                        linhas.append([d['codigo'], ''])
+                        for chave, rotulo in reqs:
+                                linhas.extend([f'{req} - Disciplina', rotulo] for req in d[chave])
+        return _pagina(cabecalho, _tabela(linhas))
+
+def atribuir_codigos(campi: Dict[str, List[str]]) -> Dict[str, str]:
+        # Atribui a cada unidade um código que campus_por_unidade associa ao mesmo campus, para que o campus
+        # calculado pelo crawler coincida com o do db de origem. Unidades de "Outro" recebem códigos livres.
+        livres = {campus: sorted(k for chaves, c in campus_por_unidade.items() if c == campus for k in chaves)
+                  for campus in campi}
+        usados = {k for chaves in campus_por_unidade.keys() for k in chaves}
+        proximo_livre = 900
+        codigos = {}
+        for campus, unidades in campi.items():
+                for unidade in sorted(unidades):
+                        if livres.get(campus):
+                                codigos[unidade] = str(livres[campus].pop(0))
+                        else:
+                                while proximo_livre in usados:
+                                        proximo_livre += 1
+                                codigos[unidade] = str(proximo_livre)
+                                usados.add(proximo_livre)
+        return codigos
+
+def gerar(db_dir: Path, destino: Path) -> None:
+        materias = [json.loads(f.read_text()) for f in sorted(db_dir.glob('*.json')) if re.fullmatch(r'[A-Z0-9]{7}\.json', f.name)]
+        campi = json.loads((db_dir / 'campi.json').read_text())
+        for m in materias:
+                if m['unidade'] not in campi.setdefault(m['campus'], []):
+                        campi[m['campus']].append(m['unidade'])
+        cursos_file = db_dir / 'cursos.json'
+        cursos = json.loads(cursos_file.read_text()) if cursos_file.exists() else []
+        # Unidades que só aparecem nos cursos (por exemplo, com o nome antigo de uma unidade renomeada) também são
+        # listadas, para que seus cursos não sumam; os cursos não têm campus
+        conhecidas = {unidade for unidades in campi.values() for unidade in unidades}
+        for unidade in sorted({curso['unidade'] for curso in cursos} - conhecidas):
+                campi.setdefault('Outro', []).append(unidade)
+        codigos = atribuir_codigos(campi)
+
+        for pagina in PAGINAS[1:]:
+                (destino / pagina).mkdir(parents=True, exist_ok=True)
+
+        caminho_fixture(destino, 'jupColegiadoLista').write_text(renderizar_lista_unidades(codigos))
+
+        por_unidade: Dict[str, List[Dict[str, Any]]] = {}
+        for m in materias:
+                por_unidade.setdefault(codigos[m['unidade']], []).append(m)
+                caminho_fixture(destino, 'obterTurma', m['codigo']).write_text(renderizar_turmas(m))
+                caminho_fixture(destino, 'obterDisciplina', m['codigo']).write_text(renderizar_disciplina(m))
+        for codcg in codigos.values():
+                caminho_fixture(destino, 'jupDisciplinaLista', codcg).write_text(renderizar_lista_disciplinas(por_unidade.get(codcg, [])))
+
+        cursos_por_unidade: Dict[str, List[Dict[str, Any]]] = {}
+        for curso in cursos:
+                cursos_por_unidade.setdefault(codigos[curso['unidade']], []).append(curso)
+                codcur, codhab = curso['codigo'].split('-', 1)
+                chave = chave_fixture('listarGradeCurricular', {'codcur': codcur, 'codhab': codhab, 'periodo': curso['periodo']})
+                caminho_fixture(destino, 'listarGradeCurricular', chave).write_text(renderizar_grade(curso))
+        for codcg in codigos.values():
+                caminho_fixture(destino, 'jupCursoLista', codcg).write_text(renderizar_lista_cursos(codcg, cursos_por_unidade.get(codcg, [])))
+
+        logger.info(f" - {len(materias)} disciplinas, {len(cursos)} cursos e {len(codigos)} unidades gerados em {destino}")
+
+# ---------------------------------------------------------------------------
+# Gravação de páginas reais
+# ---------------------------------------------------------------------------
+
+async def gravar(destino: Path, unidades: List[str], url_base: str = URL_BASE_PADRAO, simultaneidade: int = 10) -> None:
+        for pagina in PAGINAS[1:]:
+                (destino / pagina).mkdir(parents=True, exist_ok=True)
+
+        async with ClienteJupiter(url_base, simultaneidade) as cliente:
+                async def baixar(caminho: str, arquivo: Path) -> Optional[str]:
+                        texto = await cliente.obter_texto(caminho)
+                        if texto is not None:
+                                arquivo.write_text(texto)
+                        return texto
+
+                await baixar('jupColegiadoLista?tipo=T', caminho_fixture(destino, 'jupColegiadoLista'))
+                for codcg in unidades:
+                        lista = await baixar(f'jupDisciplinaLista?letra=A-Z&tipo=T&codcg={codcg}', caminho_fixture(destino, 'jupDisciplinaLista', codcg)) or ''
+                        codigos = sorted(set(re.findall(r"sgldis=([A-Z0-9\s]{7})", lista)))
+                        await asyncio.gather(*[baixar(f'{p}?print=true&sgldis={c}', caminho_fixture(destino, p, c))
+                                               for c in codigos for p in ('obterTurma', 'obterDisciplina')])
+
+                        lista = await baixar(f'jupCursoLista?tipo=N&codcg={codcg}', caminho_fixture(destino, 'jupCursoLista', codcg)) or ''
+                        grades = set(re.findall(r'listarGradeCurricular\?[^"\']*codcur=([^&"\']+)&(?:amp;)?codhab=([^&"\']+)', lista))
+                        await asyncio.gather(*[baixar(f'listarGradeCurricular?codcg={codcg}&codcur={cur}&codhab={hab}&tipo=N',
+                                                      caminho_fixture(destino, 'listarGradeCurricular',
+                                                                      chave_fixture('listarGradeCurricular', {'codcur': cur, 'codhab': hab})))
+                                               for cur, hab in grades])
+                        logger.info(f" -   Unidade {codcg}: {len(codigos)} disciplinas e {len(grades)} cursos gravados")
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Servidor local de páginas do JupiterWeb para testes do crawler MatrUSP")
+        sub = parser.add_subparsers(dest='comando', required=True)
+
+        p = sub.add_parser('servir', help="servir as páginas gravadas em um diretório")
+        p.add_argument('fixtures', help="diretório com as páginas gravadas")
+        p.add_argument('--host', default='127.0.0.1')
+        p.add_argument('-p','--porta', type=int, default=8080)
+        p.add_argument('--latencia', help="latência média (ms) de cada resposta", type=float, default=0)
+        p.add_argument('--jitter', help="variação máxima (ms) em torno da latência média", type=float, default=0)
+        p.add_argument('--taxa-erro', help="fração das respostas que retornam erro 500/503", type=float, default=0)
+        p.add_argument('--semente', help="semente do gerador aleatório", type=int)
+
+        p = sub.add_parser('gerar', help="gerar páginas sintéticas a partir de um diretório db/ existente")
+        p.add_argument('db_dir', help="diretório com {codigo}.json, campi.json e cursos.json")
+        p.add_argument('fixtures', help="diretório de destino das páginas")
+
+        p = sub.add_parser('gravar', help="gravar as páginas reais do JupiterWeb")
+        p.add_argument('fixtures', help="diretório de destino das páginas")
+        p.add_argument('-u','--unidades', help="códigos das unidades a gravar", nargs='+', required=True)
+        p.add_argument('-s','--simultaneidade', help="número de pedidos HTTP simultâneos", type=int, default=10)
+        p.add_argument('--url-base', help="endereço base do JupiterWeb", default=URL_BASE_PADRAO)
+
+        args = parser.parse_args()
+
+        logger.setLevel(logging.INFO)
+        ch = logging.StreamHandler()
+        ch.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(ch)
+
+        if args.comando == 'servir':
+                servir(Path(args.fixtures), args.host, args.porta, latencia=args.latencia, jitter=args.jitter,
+                       taxa_erro=args.taxa_erro, semente=args.semente)
+        elif args.comando == 'gerar':
+                gerar(Path(args.db_dir), Path(args.fixtures))
+        elif args.comando == 'gravar':
+                asyncio.run(gravar(Path(args.fixtures), args.unidades, args.url_base.rstrip('/'), args.simultaneidade))
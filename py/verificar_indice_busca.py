@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Verifica que o índice de busca gerado por indice_busca.py é idêntico ao que loadLectures (js/dbupdate.js)
+# calcula no navegador: os mesmos trigramas, os mesmos pesos, os mesmos períodos e unidades. Os pesos podem diferir
+# no último bit, porque o Math.log do V8 (fdlibm) e o log da libm do Python não arredondam sempre igual; diferenças
+# relativas acima de TOLERANCIA são apontadas.
+#
+# O JavaScript original (js/dbhelpers.js e as funções de js/dbupdate.js) é executado no Node.js, com o Dexie e o
+# IndexedDB substituídos por objetos que só guardam o que seria gravado. Além das matérias do db.json, são
+# verificados casos sintéticos com números no fim do nome, algarismos romanos, stopwords, espaços não ASCII,
+# caracteres fora do BMP e horários inválidos. Por fim, o índice do Python é carregado pelo próprio loadLectures,
+# como busca.json, e o que seria gravado no IndexedDB é comparado de novo.
+#
+# Uso:
+#   python verificar_indice_busca.py ../db/db.json.gz
+import sys
+import gzip
+import json
+import shutil
+import argparse
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import indice_busca
+
+DIRETORIO_JS = Path(__file__).resolve().parent.parent / 'js'
+
+TOLERANCIA = 1e-12
+
+# Executa loadLectures (com o índice pré-calculado, se houver) e imprime {trigramas, periodos, unidades} como
+# seriam gravados no IndexedDB
+PROGRAMA_NODE = r"""
+const fs = require('fs'), vm = require('vm');
+const [dbhelpers, dbupdate, entrada, indice] = process.argv.slice(1);
+const gravado = {};
+const tabela = nome => ({bulkPut: (valores, chaves) => {
+  gravado[nome] = chaves ? Object.fromEntries(chaves.map((c, i) => [c, valores[i]])) : valores;
+  return Promise.resolve();
+}});
+globalThis.self = {addProgress: () => {}, postMessage: () => {}};
+globalThis.Dexie = class { version() { return {stores: () => {}}; } };
+vm.runInThisContext(fs.readFileSync(dbhelpers, 'utf8'));
+globalThis.matruspDB = {lectures: tabela('lectures'), trigrams: tabela('trigrams'), units: tabela('units')};
+const codigo = fs.readFileSync(dbupdate, 'utf8');
+vm.runInThisContext(codigo.slice(codigo.indexOf('function loadLectures')));
+loadLectures(JSON.parse(fs.readFileSync(entrada, 'utf8')), indice && JSON.parse(fs.readFileSync(indice, 'utf8'))).then(() => {
+  const periodos = {};
+  for (const lecture of gravado.lectures) if (lecture.periodos !== undefined) periodos[lecture.codigo] = lecture.periodos;
+  process.stdout.write(JSON.stringify({trigramas: gravado.trigrams, periodos: periodos, unidades: gravado.units}));
+});
+"""
+
+def casos_sinteticos() -> List[Dict[str, Any]]:
+        nomes = ["Cálculo Diferencial e Integral II I", "Física 3", "Física 0x1A", "Química 1e3", "Tópicos -5",
+                 "Álgebra Linear  ", "De A para O", "Estudos Avançados  IV", "Música \U0001D11E", "ß ÿ ǆ",
+                 "Seminário .5", "Projeto Infinity", "Inglês 12abc", "a"]
+        horarios = [[{'dia': 'seg', 'inicio': '07:30', 'fim': '11:10', 'professores': []}],
+                    [{'dia': 'ter', 'inicio': '13:00', 'fim': '20:00', 'professores': []}, None],
+                    [{'dia': 'qua', 'inicio': 'xx:00', 'fim': '??', 'professores': []}], []]
+        materias = []
+        for i, nome in enumerate(nomes):
+                materia = {'codigo': f"ZZZ{i:04d}", 'nome': nome, 'unidade': f"Unidade {i % 3}", 'departamento': f"Departamento {i % 4}"}
+                if i % 5:
+                        materia['turmas'] = [{'codigo': '1', 'horario': horarios[i % len(horarios)]}, None]
+                materias.append(materia)
+        return materias
+
+def executar_js(materias: List[Dict[str, Any]], node: str, indice: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        with tempfile.TemporaryDirectory() as diretorio:
+                argumentos = [node, '-e', PROGRAMA_NODE, DIRETORIO_JS / 'dbhelpers.js', DIRETORIO_JS / 'dbupdate.js', Path(diretorio) / 'materias.json']
+                argumentos[-1].write_text(json.dumps(materias))
+                if indice is not None:
+                        argumentos.append(Path(diretorio) / 'busca.json')
+                        argumentos[-1].write_text(json.dumps(indice, separators=(',', ':')))
+                saida = subprocess.run(argumentos, check=True, capture_output=True, text=True).stdout
+        return json.loads(saida)
+
+def comparar(python: Dict[str, Any], js: Dict[str, Any]) -> List[str]:
+        diferencas = []
+        for trigrama in sorted(set(python['trigramas']) | set(js['trigramas'])):
+                pesos_python, pesos_js = python['trigramas'].get(trigrama, {}), js['trigramas'].get(trigrama, {})
+                if set(pesos_python) != set(pesos_js):
+                        diferencas.append(f"trigrama {trigrama!r}: matérias {sorted(pesos_python)} != {sorted(pesos_js)}")
+                        continue
+                for codigo, peso in pesos_python.items():
+                        if abs(peso - pesos_js[codigo]) > TOLERANCIA * abs(pesos_js[codigo]):
+                                diferencas.append(f"trigrama {trigrama!r}, {codigo}: peso {peso} != {pesos_js[codigo]}")
+        for codigo in sorted(set(python['periodos']) | set(js['periodos'])):
+                if python['periodos'].get(codigo) != js['periodos'].get(codigo):
+                        diferencas.append(f"periodos de {codigo}: {python['periodos'].get(codigo)} != {js['periodos'].get(codigo)}")
+        if python['unidades'] != js['unidades']:
+                diferencas.append(f"unidades: {python['unidades']} != {js['unidades']}")
+        return diferencas
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Compara o índice de busca de indice_busca.py com o calculado por js/dbupdate.js")
+        parser.add_argument('db', help="db.json ou db.json.gz", nargs='?')
+        parser.add_argument('--node', help="executável do Node.js", default=shutil.which('node'))
+        args = parser.parse_args()
+
+        if not args.node:
+                print("Node.js não encontrado (use --node)")
+                sys.exit(2)
+
+        conjuntos = {'sintéticos': casos_sinteticos()}
+        if args.db:
+                abrir = gzip.open if args.db.endswith('.gz') else open
+                with abrir(args.db, 'rt', encoding='utf-8') as f:
+                        conjuntos['db'] = json.load(f)
+
+        falhou = False
+        for nome, materias in conjuntos.items():
+                python = indice_busca.gerar(materias)
+                diferencas = comparar(python, executar_js(materias, args.node))
+                # O mesmo índice, gravado pelo cliente a partir de busca.json, precisa chegar intacto ao IndexedDB
+                diferencas += comparar(python, executar_js(materias, args.node, python))
+                pesos = sum(len(p) for p in python['trigramas'].values())
+                print(f"{nome}: {len(materias)} matérias, {len(python['trigramas'])} trigramas, {pesos} pesos, {len(diferencas)} diferenças")
+                for d in diferencas[:20]:
+                        print(f"  {d}")
+                falhou = falhou or bool(diferencas)
+
+        sys.exit(1 if falhou else 0)
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Versões do banco de dados de matérias (db.json) e patches entre versões, para que js/dbupdate.js baixe só o que
+# mudou desde a versão que o navegador já tem.
+#
+# Arquivos em db/versoes/:
+#   versao.json         versão atual, seu snapshot e os patches disponíveis, por versão de origem:
+#                       {"versao": N, "data": "...", "materias": 5709, "snapshot": "db.N.json",
+#                        "busca": "busca.N.json", "compacto": "db.compacto.N.json",
+#                        "patches": {"N-1": "patch.N-1.N.json", ...}}
+#   db.N.json           snapshot completo da versão N (mesmo conteúdo de db.json); imutável
+#   db.compacto.N.json  o mesmo snapshot no formato compacto (ver compacto.py), só com parse_usp.py --compacto; o
+#                       cliente o baixa em vez de db.N.json quando versao.json o anuncia; imutável
+#   busca.N.json        índice de busca da versão N (mesmo conteúdo de busca.json, ver indice_busca.py); imutável
+#   patch.V.N.json      da versão V para a N: {"de": V, "para": N, "adicionadas": [materia, ...],
+#                        "alteradas": [materia, ...], "removidas": [codigo, ...]}; imutável
+#   indice.N.json       hash do JSON de cada matéria na versão N, usado para gerar os patches das versões seguintes
+#
+# Uma nova versão só é criada quando alguma matéria mudou. São mantidos os índices das últimas `manter` versões, de
+# forma que clientes até `manter` - 1 versões atrás baixam um único patch; os demais baixam o snapshot.
+import re
+import json
+import logging
+import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+from concurrent.futures import Executor
+
+from saida import Acumulador, Compressao, hash_conteudo, gravar_arquivo, gravar_atomico, gravar_partes, lista_json, remover_arquivo
+
+logger = logging.getLogger('log')
+
+DIRETORIO_VERSOES = 'versoes'
+ARQUIVO_VERSAO = 'versao.json'
+
+re_arquivo_versao = re.compile(r"(db|db\.compacto|busca|indice)\.(\d+)\.json|patch\.(\d+)\.(\d+)\.json")
+
+class Versoes:
+        # compactar é uma saida.Compressao, ou True (.gz) ou False; o executor, se houver, grava os formatos do
+        # snapshot em paralelo
+        def __init__(self, db_dir: Union[str, Path], compactar: Union[bool, Compressao] = True, manter: int = 10,
+                     executor: Optional[Executor] = None):
+                self.diretorio = Path(db_dir) / DIRETORIO_VERSOES
+                self.compactar = Compressao.de(compactar)
+                self.executor = executor
+                self.manter = max(1, manter)
+
+        def versao_atual(self) -> Optional[Dict[str, Any]]:
+                try:
+                        return json.loads((self.diretorio / ARQUIVO_VERSAO).read_text())
+                except (FileNotFoundError, ValueError):
+                        return None
+
+        def _indice(self, versao: int) -> Optional[Dict[str, str]]:
+                try:
+                        return json.loads((self.diretorio / f"indice.{versao}.json").read_text())
+                except (FileNotFoundError, ValueError):
+                        return None
+
+        # Publica uma nova versão a partir das matérias (o JSON de cada uma, por código), do índice de busca e do
+        # catálogo compacto, se algo mudou desde a versão atual. Retorna o número da versão publicada, ou None se nada
+        # mudou.
+        def publicar(self, materias: Acumulador, busca_json: Optional[str] = None, compacto_json: Optional[bytes] = None) -> Optional[int]:
+                self.diretorio.mkdir(parents=True, exist_ok=True)
+                hashes = {codigo: hash_conteudo(m) for codigo, m in materias.itens()}
+
+                atual = self.versao_atual()
+                if atual and self._indice(atual['versao']) == hashes:
+                        return None
+                versao = atual['versao'] + 1 if atual else 1
+
+                gravar_arquivo(self.diretorio / f"indice.{versao}.json", json.dumps(hashes, sort_keys=True).encode('utf-8'), compactar=False)
+                # O snapshot tem o mesmo conteúdo de db.json, gravado por partes
+                gravar_partes(self.diretorio / f"db.{versao}.json", lambda: lista_json(m for _, m in materias.itens()), self.compactar, self.executor)
+                if busca_json is not None:
+                        gravar_arquivo(self.diretorio / f"busca.{versao}.json", busca_json.encode('utf-8'), self.compactar)
+                if compacto_json is not None:
+                        gravar_arquivo(self.diretorio / f"db.compacto.{versao}.json", compacto_json, self.compactar)
+
+                patches = {}
+                for origem in range(max(1, versao - self.manter + 1), versao):
+                        indice = self._indice(origem)
+                        if indice is None:
+                                continue
+                        adicionadas = [codigo for codigo in hashes if codigo not in indice]
+                        alteradas = [codigo for codigo in hashes if codigo in indice and indice[codigo] != hashes[codigo]]
+                        removidas = sorted(codigo for codigo in indice if codigo not in hashes)
+                        # As matérias já estão serializadas: o patch é montado diretamente, como o db.json
+                        patch = (f'{{"de": {origem}, "para": {versao}, "adicionadas": ['.encode('utf-8') +
+                                 b', '.join(materias.ler(c) for c in adicionadas) + b'], "alteradas": [' +
+                                 b', '.join(materias.ler(c) for c in alteradas) +
+                                 f'], "removidas": {json.dumps(removidas)}}}'.encode('utf-8'))
+                        nome = f"patch.{origem}.{versao}.json"
+                        gravar_arquivo(self.diretorio / nome, patch, self.compactar)
+                        patches[str(origem)] = nome
+                        logger.debug(f" -      Patch {origem} -> {versao}: {len(adicionadas)} adicionadas, {len(alteradas)} alteradas, "
+                                     f"{len(removidas)} removidas ({len(patch)} bytes)")
+
+                # versao.json é substituído por último, e de forma atômica, para nunca apontar para arquivos incompletos
+                descricao = {'versao': versao, 'data': datetime.datetime.now().isoformat(timespec='seconds'), 'materias': len(materias),
+                             'snapshot': f"db.{versao}.json", 'patches': patches}
+                if busca_json is not None:
+                        descricao['busca'] = f"busca.{versao}.json"
+                if compacto_json is not None:
+                        descricao['compacto'] = f"db.compacto.{versao}.json"
+                gravar_atomico(self.diretorio / ARQUIVO_VERSAO, json.dumps(descricao, indent=1).encode('utf-8'))
+
+                self._remover_antigos(versao)
+                logger.info(f" -   Versão {versao} do banco de dados publicada, com {len(patches)} patches")
+                return versao
+
+        # Remove snapshots e patches de versões anteriores e os índices que não serão mais usados
+        def _remover_antigos(self, versao: int) -> None:
+                for caminho in list(self.diretorio.iterdir()):
+                        r = re_arquivo_versao.fullmatch(caminho.name)
+                        if not r:
+                                continue
+                        if r.group(1) in ('db', 'db.compacto', 'busca'):
+                                antigo = int(r.group(2)) < versao
+                        elif r.group(1) == 'indice':
+                                antigo = int(r.group(2)) <= versao - self.manter
+                        else:
+                                antigo = int(r.group(4)) < versao
+                        if antigo:
+                                remover_arquivo(caminho)